@@ -0,0 +1,141 @@
+from __future__ import annotations
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+from .logger import get_logger
+
+logger = get_logger("homevm")
+
+POOL_MAX_SIZE = 16
+POOL_IDLE_TIMEOUT = 300.0  # 秒
+
+PoolKey = Tuple[Hashable, ...]
+
+
+@dataclass
+class _Entry:
+    conn: Any
+    close: Optional[Callable[[Any], None]]
+    is_alive: Optional[Callable[[Any], bool]]
+    last_used: float = field(default_factory=time.monotonic)
+
+
+class ConnectionPool:
+    """
+    認証済みの接続（SSHトランスポート / WinRMセッションなど）を再利用するプール
+    キーは (method, host, user, port) を想定
+    - 貸し出し中の接続は他の呼び出し元に渡さない
+    - idle_timeout を過ぎた接続・is_alive が False の接続は破棄
+    - 保持数が max_size を超えたら古いものから閉じる
+    """
+    def __init__(self, max_size: int = POOL_MAX_SIZE, idle_timeout: float = POOL_IDLE_TIMEOUT):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle: Dict[PoolKey, List[_Entry]] = {}
+        self._broken: set = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(v) for v in self._idle.values())
+
+    @contextmanager
+    def connection(self, key: PoolKey, factory: Callable[[], Any],
+                   is_alive: Optional[Callable[[Any], bool]] = None,
+                   close: Optional[Callable[[Any], None]] = None) -> Iterator[Any]:
+        """
+        プールから接続を借りる（なければ factory で作成）
+        ブロック内で例外が出た接続・invalidate された接続は返却せずに閉じる
+        """
+        entry = self._checkout(key)
+        if entry is None:
+            entry = _Entry(factory(), close, is_alive)
+        try:
+            yield entry.conn
+        except BaseException:
+            self._broken.discard(id(entry.conn))
+            self._close(entry)
+            raise
+        if id(entry.conn) in self._broken:
+            self._broken.discard(id(entry.conn))
+            self._close(entry)
+            return
+        entry.last_used = time.monotonic()
+        self._checkin(key, entry)
+
+    def invalidate(self, conn: Any) -> None:
+        """貸し出し中の接続を返却時に破棄するよう印を付ける（shutdown後など）"""
+        self._broken.add(id(conn))
+
+    def prune(self) -> int:
+        """アイドル時間切れの接続を閉じる。閉じた数を返す"""
+        now = time.monotonic()
+        expired: List[_Entry] = []
+        with self._lock:
+            for key in list(self._idle):
+                keep = []
+                for e in self._idle[key]:
+                    (expired if now - e.last_used >= self.idle_timeout else keep).append(e)
+                if keep:
+                    self._idle[key] = keep
+                else:
+                    del self._idle[key]
+        for e in expired:
+            self._close(e)
+        return len(expired)
+
+    def close_all(self) -> None:
+        with self._lock:
+            entries = [e for v in self._idle.values() for e in v]
+            self._idle.clear()
+        for e in entries:
+            self._close(e)
+
+    # --- 内部処理 ---
+    def _checkout(self, key: PoolKey) -> Optional[_Entry]:
+        self.prune()
+        while True:
+            with self._lock:
+                entries = self._idle.get(key)
+                if not entries:
+                    return None
+                entry = entries.pop()
+                if not entries:
+                    del self._idle[key]
+            if entry.is_alive is None or self._alive(entry):
+                return entry
+            logger.info(f"Pool: dropping broken connection {key}")
+            self._close(entry)
+
+    def _checkin(self, key: PoolKey, entry: _Entry) -> None:
+        evicted: List[_Entry] = []
+        with self._lock:
+            self._idle.setdefault(key, []).append(entry)
+            total = sum(len(v) for v in self._idle.values())
+            while total > self.max_size:
+                # 最も長く使われていない接続から閉じる
+                oldest_key = min(self._idle, key=lambda k: self._idle[k][0].last_used)
+                evicted.append(self._idle[oldest_key].pop(0))
+                if not self._idle[oldest_key]:
+                    del self._idle[oldest_key]
+                total -= 1
+        for e in evicted:
+            self._close(e)
+
+    @staticmethod
+    def _alive(entry: _Entry) -> bool:
+        try:
+            return bool(entry.is_alive(entry.conn))
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close(entry: _Entry) -> None:
+        if entry.close is None:
+            return
+        try:
+            entry.close(entry.conn)
+        except Exception as e:
+            logger.warning(f"Pool: close failed: {e}")
@@ -0,0 +1,249 @@
+from __future__ import annotations
+import mmap
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from .logger import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows では排他ロックをかけない
+    fcntl = None
+
+logger = get_logger("homevm")
+
+HISTORY_FILE = Path(__file__).resolve().parent.parent / "data" / "history.bin"
+HISTORY_SLOTS = 1024       # 記録できるVM数
+HISTORY_CAPACITY = 4096    # VMごとのサンプル数（2分間隔なら約1週間分）
+HISTORY_MAX_GAP = 300.0    # これより長い間隔はサンプルが途切れたとみなす（秒）
+
+# ステータスは1バイトで保持する
+STATUS_CODES = {"稼働中": 1, "停止中": 2, "不明": 3}
+STATUS_NAMES = {v: k for k, v in STATUS_CODES.items()}
+_RTT_NONE = 0xFFFF  # RTTは0.1ms単位の uint16（6.5秒まで）
+
+_MAGIC = b"HVMH"
+_VERSION = 1
+_FILE_HEADER = struct.Struct("<4sIII16x")   # magic, version, slots, capacity
+_SLOT_HEADER = struct.Struct("<24sII")      # mac, head, count
+
+
+class HistoryLocked(RuntimeError):
+    """履歴ファイルを他のプロセスが開いている（同じファイルに書けるのは1プロセスだけ）"""
+
+
+def _align8(n: int) -> int:
+    return (n + 7) & ~7
+
+
+class StatusHistory:
+    """
+    VMごとのステータス・RTT履歴を固定長リングバッファに保持する
+    全体をひとつの mmap（path 指定時はファイル、None なら無名メモリ）に配置するため、
+    メモリ使用量は slots × capacity で決まり、サンプル数が増えても変わらない
+
+    ファイルは開いている間 flock で排他する（スロット表はプロセスごとにメモリ上で持つため、
+    2つのプロセスが同じファイルに書くと互いのスロットを上書きしてしまう）。
+    既に他のプロセスが開いていれば HistoryLocked
+
+    スロットのレイアウト:
+      header(mac, head, count) | ts: uint32 × cap | rtt: uint16 × cap | status: uint8 × cap
+    """
+    def __init__(self, path: Optional[Path] = HISTORY_FILE,
+                 slots: int = HISTORY_SLOTS, capacity: int = HISTORY_CAPACITY):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        if path is not None:
+            self._file = self._lock_file(Path(path))
+            # 既存ファイルはヘッダのサイズ設定を優先する
+            self._file.seek(0)
+            head = self._file.read(_FILE_HEADER.size)
+            if len(head) == _FILE_HEADER.size:
+                magic, version, f_slots, f_cap = _FILE_HEADER.unpack(head)
+                if magic == _MAGIC and version == _VERSION:
+                    slots, capacity = f_slots, f_cap
+                else:
+                    logger.warning(f"History file {path} has unknown format; recreating")
+                    self._file.truncate(0)
+        self.slots = slots
+        self.capacity = capacity
+        self._slot_size = _align8(_SLOT_HEADER.size + capacity * 7)
+        size = _FILE_HEADER.size + slots * self._slot_size
+        self._mm = self._open(size)
+        self._index: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._load_index()
+
+    @staticmethod
+    def _lock_file(path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        f = open(path, "a+b")
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                raise HistoryLocked(f"History file {path} is in use by another process")
+        return f
+
+    def _open(self, size: int) -> mmap.mmap:
+        if self.path is None:
+            mm = mmap.mmap(-1, size)
+        else:
+            if Path(self.path).stat().st_size < size:
+                self._file.truncate(size)
+            mm = mmap.mmap(self._file.fileno(), size)
+        if mm[:4] != _MAGIC:
+            _FILE_HEADER.pack_into(mm, 0, _MAGIC, _VERSION, self.slots, self.capacity)
+        return mm
+
+    def _load_index(self) -> None:
+        for slot in range(self.slots):
+            mac, _, _ = _SLOT_HEADER.unpack_from(self._mm, self._slot_offset(slot))
+            mac = mac.rstrip(b"\0").decode("ascii", errors="ignore")
+            if mac:
+                self._index[mac] = slot
+            else:
+                self._free.append(slot)
+        self._free.reverse()
+
+    def _slot_offset(self, slot: int) -> int:
+        return _FILE_HEADER.size + slot * self._slot_size
+
+    def _arrays(self, slot: int) -> Tuple[memoryview, memoryview, memoryview]:
+        base = self._slot_offset(slot) + _SLOT_HEADER.size
+        cap = self.capacity
+        view = memoryview(self._mm)
+        ts = view[base:base + cap * 4].cast("I")
+        rtt = view[base + cap * 4:base + cap * 6].cast("H")
+        st = view[base + cap * 6:base + cap * 7]
+        return ts, rtt, st
+
+    def _slot_for(self, mac: str, create: bool) -> Optional[int]:
+        slot = self._index.get(mac)
+        if slot is None and create:
+            if not self._free:
+                logger.warning(f"History slots exhausted; not recording {mac}")
+                return None
+            slot = self._free.pop()
+            _SLOT_HEADER.pack_into(self._mm, self._slot_offset(slot), mac.encode("ascii")[:24], 0, 0)
+            self._index[mac] = slot
+        return slot
+
+    # --- 記録 ---
+    def record(self, mac: str, status: str, rtt: Optional[float] = None,
+               ts: Optional[float] = None) -> None:
+        """サンプルを1件追加（rtt は秒）"""
+        mac = mac.lower()
+        ts = time.time() if ts is None else ts
+        code = STATUS_CODES.get(status, STATUS_CODES["不明"])
+        rtt_v = _RTT_NONE if rtt is None else min(int(rtt * 10000), _RTT_NONE - 1)
+        with self._lock:
+            slot = self._slot_for(mac, create=True)
+            if slot is None:
+                return
+            off = self._slot_offset(slot)
+            _, head, count = _SLOT_HEADER.unpack_from(self._mm, off)
+            ts_a, rtt_a, st_a = self._arrays(slot)
+            ts_a[head] = int(ts)
+            rtt_a[head] = rtt_v
+            st_a[head] = code
+            ts_a.release(); rtt_a.release(); st_a.release()
+            struct.pack_into("<II", self._mm, off + 24, (head + 1) % self.capacity,
+                             min(count + 1, self.capacity))
+
+    def forget(self, mac: str) -> None:
+        """VM削除時にスロットを解放する"""
+        with self._lock:
+            slot = self._index.pop(mac.lower(), None)
+            if slot is not None:
+                _SLOT_HEADER.pack_into(self._mm, self._slot_offset(slot), b"", 0, 0)
+                self._free.append(slot)
+
+    # --- 参照 ---
+    def samples(self, mac: str, since: float = 0, until: Optional[float] = None
+                ) -> List[Tuple[int, int, int]]:
+        """(ts, status_code, rtt_raw) を古い順に返す"""
+        until = time.time() if until is None else until
+        with self._lock:
+            slot = self._slot_for(mac.lower(), create=False)
+            if slot is None:
+                return []
+            _, head, count = _SLOT_HEADER.unpack_from(self._mm, self._slot_offset(slot))
+            ts_a, rtt_a, st_a = self._arrays(slot)
+            start = (head - count) % self.capacity
+            order = [(start + i) % self.capacity for i in range(count)]
+            out = [(ts_a[i], st_a[i], rtt_a[i]) for i in order if since <= ts_a[i] <= until]
+            ts_a.release(); rtt_a.release(); st_a.release()
+        return out
+
+    def query(self, mac: str, range_sec: float = 86400, points: int = 200,
+              now: Optional[float] = None) -> dict:
+        """
+        期間内の履歴を points 個のバケットに間引いて返す
+        uptime は時間加重の稼働率（%、サンプルがなければ None）
+        """
+        now = time.time() if now is None else now
+        since = now - range_sec
+        rows = self.samples(mac, since, now)
+        points = max(1, min(points, 2000))
+        width = range_sec / points
+        buckets = [[0, 0, 0.0, 0, None] for _ in range(points)]  # n, up, rtt_sum, rtt_n, last
+        up_time = known_time = 0.0
+        for i, (ts, code, rtt_raw) in enumerate(rows):
+            b = buckets[min(int((ts - since) / width), points - 1)]
+            b[0] += 1
+            b[1] += code == STATUS_CODES["稼働中"]
+            if rtt_raw != _RTT_NONE:
+                b[2] += rtt_raw / 10.0
+                b[3] += 1
+            b[4] = code
+            nxt = rows[i + 1][0] if i + 1 < len(rows) else now
+            dur = min(max(nxt - ts, 0), HISTORY_MAX_GAP)
+            if code != STATUS_CODES["不明"]:
+                known_time += dur
+                if code == STATUS_CODES["稼働中"]:
+                    up_time += dur
+        series = [
+            {
+                "t": int(since + k * width),
+                "samples": n,
+                "up": up / n,
+                "rtt_ms": round(rtt_sum / rtt_n, 2) if rtt_n else None,
+                "status": STATUS_NAMES.get(last),
+            }
+            for k, (n, up, rtt_sum, rtt_n, last) in enumerate(buckets) if n
+        ]
+        return {
+            "mac": mac.lower(),
+            "range": range_sec,
+            "samples": len(rows),
+            "uptime": round(100.0 * up_time / known_time, 2) if known_time else None,
+            "series": series,
+        }
+
+    def flush(self) -> None:
+        with self._lock:
+            self._mm.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._mm.flush()
+            self._mm.close()
+            if self._file:
+                self._file.close()  # ロックも解放される
+
+
+def open_history(path: Optional[Path] = HISTORY_FILE, **kw) -> StatusHistory:
+    """
+    履歴を開く。他のプロセス（共有監視サービスなど）が同じファイルを使っていれば、
+    ファイルには書かずにこのプロセスのメモリ上だけで記録する
+    """
+    try:
+        return StatusHistory(path, **kw)
+    except HistoryLocked as e:
+        logger.warning(f"{e}; keeping history in memory for this process only")
+        return StatusHistory(None, **kw)
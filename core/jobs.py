@@ -0,0 +1,152 @@
+from __future__ import annotations
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+from .logger import get_logger
+
+logger = get_logger("homevm")
+
+JOB_MAX_WORKERS = 8      # 同時に実行する電源操作の数
+JOB_MAX_PENDING = 64     # 実行待ちとして受け付ける数（超えたら JobQueueFull）
+JOB_KEEP_FINISHED = 500  # 完了後も参照できるように残すジョブ数
+
+# ジョブの状態
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFull(RuntimeError):
+    """実行待ちのジョブが上限に達している"""
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    params: Dict[str, Any] = field(default_factory=dict)
+    state: str = QUEUED
+    ok: Optional[bool] = None
+    message: str = ""
+    result: Any = None  # 操作ごとの詳細（一括WOLの台ごとの結果など）
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    seq: int = 0  # 投入順（一覧の並び替え用）
+
+    @property
+    def done(self) -> bool:
+        return self.state in (DONE, FAILED)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "params": dict(self.params),
+            "state": self.state,
+            "ok": self.ok,
+            "message": self.message,
+            "result": self.result,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "elapsed": (self.finished - self.started) if self.finished and self.started else None,
+        }
+
+
+class JobQueue:
+    """
+    時間のかかる操作（SSH/WinRM の電源操作など）を固定数のワーカーで実行する
+    submit() はすぐにジョブIDを返し、進捗は get() / list() で参照する
+    - 実行中＋待ちが max_workers + max_pending を超える投入は JobQueueFull
+    - 完了したジョブは新しい順に keep 件まで保持する
+    fn は (ok, message) または (ok, message, result) を返す。例外は失敗として記録する
+    """
+    def __init__(self, max_workers: int = JOB_MAX_WORKERS,
+                 max_pending: int = JOB_MAX_PENDING,
+                 keep: int = JOB_KEEP_FINISHED,
+                 on_finish: Optional[Callable[[Job], None]] = None):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.keep = keep
+        self.on_finish = on_finish
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._active = 0
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn: Callable[[], tuple],
+               params: Optional[Dict[str, Any]] = None) -> Job:
+        with self._lock:
+            if self._active >= self.max_workers + self.max_pending:
+                raise JobQueueFull(f"Too many pending jobs ({self._active})")
+            job = Job(uuid.uuid4().hex[:12], kind, dict(params or {}), seq=next(self._seq))
+            self._jobs[job.id] = job
+            self._active += 1
+            self._prune()
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job: Job, fn: Callable[[], tuple]) -> None:
+        job.started = time.time()
+        job.state = RUNNING
+        try:
+            out = fn()
+            ok, msg = out[0], out[1]
+            job.result = out[2] if len(out) > 2 else None
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) error: {e}")
+            ok, msg = False, str(e)
+        job.ok, job.message = bool(ok), msg
+        job.finished = time.time()
+        job.state = DONE if ok else FAILED
+        with self._lock:
+            self._active -= 1
+        if self.on_finish:
+            try:
+                self.on_finish(job)
+            except Exception as e:
+                logger.error(f"Job {job.id} callback error: {e}")
+
+    def _prune(self) -> None:
+        finished = [j for j in self._jobs.values() if j.done]
+        for j in finished[:max(0, len(finished) - self.keep)]:
+            del self._jobs[j.id]
+
+    # --- 参照 ---
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self, state: Optional[str] = None, limit: int = 100) -> List[Job]:
+        """新しい順に返す"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if state:
+            jobs = [j for j in jobs if j.state == state]
+        jobs.sort(key=lambda j: j.seq, reverse=True)
+        return jobs[:limit]
+
+    @property
+    def active(self) -> int:
+        """実行中・実行待ちのジョブ数"""
+        return self._active
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Job]:
+        """ジョブの完了を待つ（主にテスト・CLI用）"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        job = self.get(job_id)
+        while job is not None and not job.done:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(0.01)
+        return job
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
@@ -1,34 +1,171 @@
 from __future__ import annotations
+import atexit
+import json
 import logging
-from logging.handlers import TimedRotatingFileHandler
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 from pathlib import Path
+from typing import Dict, Optional, Tuple
 
 LOG_DIR = Path(__file__).resolve().parent.parent / "logs"
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
+# "json" でファイルへの出力を JSON Lines（1行1レコード）にする
+LOG_FORMAT = os.environ.get("HOMEVM_LOG_FORMAT", "text").lower()
+
+ERROR_DEDUP_WINDOW = 60.0  # 同じ警告・エラーを1回だけ出す期間（秒）
+ERROR_RATE = 5.0           # 警告・エラー全体の出力上限（/秒）
+ERROR_BURST = 20           # 一時的に許容する件数
+_DEDUP_MAX_KEYS = 1000
+
+_TEXT_FORMAT = logging.Formatter(
+    fmt="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+)
+
+
+class JsonFormatter(logging.Formatter):
+    """1レコードを1行のJSONにする"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    WARNING 以上の繰り返しを抑える（INFO 以下はそのまま通す）
+    - 同じメッセージは window 秒に1回だけ出し、次に出す時に抑制した件数を付ける
+    - 全体で rate 件/秒（burst 件まで一時的に超過可）を超えた分は捨てる
+    """
+    def __init__(self, window: float = ERROR_DEDUP_WINDOW, rate: float = ERROR_RATE,
+                 burst: int = ERROR_BURST, clock=time.monotonic):
+        super().__init__()
+        self.window = window
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.dropped = 0
+        self._seen: Dict[Tuple[str, int, str], list] = {}  # key -> [最後に出した時刻, 抑制件数]
+        self._tokens = float(burst)
+        self._refilled_at = clock()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING:
+            return True
+        now = self.clock()
+        msg = record.getMessage()
+        key = (record.name, record.levelno, msg)
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is not None and now - entry[0] < self.window:
+                entry[1] += 1
+                self.dropped += 1
+                return False
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+            if self._tokens < 1:
+                self.dropped += 1
+                return False
+            self._tokens -= 1
+            suppressed = entry[1] if entry is not None else 0
+            if len(self._seen) >= _DEDUP_MAX_KEYS:
+                self._prune(now)
+            self._seen[key] = [now, 0]
+        if suppressed:
+            record.msg = f"{msg} (同じメッセージを {suppressed} 件抑制)"
+            record.args = None
+            record.suppressed = suppressed
+        return True
+
+    def _prune(self, now: float) -> None:
+        for key in [k for k, (t, _) in self._seen.items() if now - t >= self.window]:
+            del self._seen[key]
+
+
+class ChangeLog:
+    """キーごとに直前の値を覚え、変わった時だけ INFO を出す（状態変化のログ用）"""
+    def __init__(self, logger: logging.Logger):
+        self.logger = logger
+        self._last: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def update(self, key: str, value: str, message: str) -> bool:
+        with self._lock:
+            if self._last.get(key) == value:
+                return False
+            self._last[key] = value
+        self.logger.info(message)
+        return True
+
+
+# ---------- 非同期出力 ----------
+# 呼び出し側はキューに積むだけにして、ファイル・コンソールへの書き込みは専用スレッドで行う
+_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_listener: Optional[QueueListener] = None
+_listener_lock = threading.Lock()
+
+
+def _start_listener() -> None:
+    global _listener
+    with _listener_lock:
+        if _listener is not None:
+            return
+        fh = TimedRotatingFileHandler(
+            filename=str(LOG_DIR / "homevm.log"),
+            when="midnight",
+            backupCount=7,
+            encoding="utf-8",
+            delay=True  # 最初の書き込みまでファイルを作らない
+        )
+        fh.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else _TEXT_FORMAT)
+        sh = logging.StreamHandler()
+        sh.setFormatter(_TEXT_FORMAT)
+        _listener = QueueListener(_queue, fh, sh, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """キューに残っているログを書き出して出力スレッドを止める"""
+    global _listener
+    with _listener_lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def set_log_dir(path: Path) -> None:
+    """ログファイルの出力先を変える（テストやベンチマークで logs/ に書かないため）"""
+    global LOG_DIR
+    shutdown_logging()
+    LOG_DIR = Path(path)
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
+    _start_listener()
+
+
 def get_logger(name: str = "homevm") -> logging.Logger:
     logger = logging.getLogger(name)
     if logger.handlers:
         return logger  # 既に初期化済み
 
     logger.setLevel(logging.INFO)
-    log_file = LOG_DIR / "homevm.log"
-
-    fh = TimedRotatingFileHandler(
-        filename=str(log_file),
-        when="midnight",
-        backupCount=7,
-        encoding="utf-8"
-    )
-    fmt = logging.Formatter(
-        fmt="%(asctime)s [%(levelname)s] %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S"
-    )
-    fh.setFormatter(fmt)
-
-    sh = logging.StreamHandler()
-    sh.setFormatter(fmt)
-
-    logger.addHandler(fh)
-    logger.addHandler(sh)
-    return logger
\ No newline at end of file
+    _start_listener()
+    qh = QueueHandler(_queue)
+    qh.addFilter(RateLimitFilter())
+    logger.addHandler(qh)
+    return logger
@@ -0,0 +1,194 @@
+from __future__ import annotations
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# 計測側は数値を足すだけにして、文字列化は /metrics を読まれた時だけ行う
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelKey = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Tuple[str, ...], values: LabelKey, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelKey:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}"
+                                for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), func: Optional[Callable[[], Optional[float]]] = None):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelKey, float] = {}
+        self.func = func  # 読まれた時に値を計算する場合
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def remove(self, **labels: str) -> None:
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def value(self, **labels: str) -> Optional[float]:
+        return self._values.get(self._key(labels))
+
+    def render(self) -> List[str]:
+        if self.func is not None:
+            v = self.func()
+            return self.header() + ([] if v is None else [f"{self.name} {_fmt_value(v)}"])
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_fmt_labels(self.labelnames, k)} {_fmt_value(v)}"
+                                for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket毎の件数(非累積) ..., +Inf, sum, count]
+        self._values: Dict[LabelKey, List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            row[idx] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        row = self._values.get(self._key(labels))
+        return row[-1] if row else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = self.header()
+        for key, row in items:
+            acc = 0
+            for bound, n in zip(self.buckets + (float("inf"),), row):
+                acc += n
+                le = 'le="' + _fmt_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {acc}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(row[-2])}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {row[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+              func: Optional[Callable[[], Optional[float]]] = None) -> Gauge:
+        return self._register(Gauge(name, help, labelnames, func))
+
+    def histogram(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        """Prometheus テキスト形式（version 0.0.4）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ---------- 監視・制御のホットパス用メトリクス ----------
+SWEEP_SECONDS = REGISTRY.histogram(
+    "homevm_sweep_duration_seconds", "Duration of one status sweep",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0))
+SWEEP_HOSTS = REGISTRY.counter("homevm_sweep_hosts_total", "Hosts checked by status sweeps", ("status",))
+PROBE_RTT = REGISTRY.histogram("homevm_probe_rtt_seconds", "Liveness probe round-trip time")
+PROBE_HOST_RTT = REGISTRY.gauge("homevm_probe_host_rtt_seconds", "Last probe RTT per host", ("host",))
+PROBE_TIMEOUTS = REGISTRY.counter("homevm_probe_timeouts_total", "Liveness probes without reply")
+ARP_SECONDS = REGISTRY.histogram("homevm_arp_refresh_seconds", "Time to take one ARP table snapshot",
+                                 ("source",))
+ARP_ENTRIES = REGISTRY.gauge("homevm_arp_entries", "Entries in the last ARP snapshot")
+REMOTE_CONNECT = REGISTRY.histogram("homevm_remote_connect_seconds", "SSH/WinRM connect latency", ("method",))
+REMOTE_EXEC = REGISTRY.histogram("homevm_remote_exec_seconds", "SSH/WinRM command latency", ("method",))
+POWER_ACTIONS = REGISTRY.counter("homevm_power_actions_total", "Power actions by result",
+                                 ("action", "result"))
@@ -0,0 +1,374 @@
+from __future__ import annotations
+import heapq
+import queue
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from . import vm_info
+from .history import StatusHistory
+from .logger import ChangeLog, get_logger
+from .vm_info import sweep_status
+
+logger = get_logger("homevm")
+
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+# 購読キューがあふれた時に入れる印（受け手はスナップショットを取り直す）
+RESYNC = {"type": "resync"}
+# インベントリ（VMの追加・削除）が変わったことを知らせる印
+INVENTORY_CHANGED = {"type": "inventory"}
+# 配信を終了したことを知らせる印（受け手は購読をやめる）
+CLOSED = {"type": "closed"}
+
+
+class StatusHub:
+    """
+    VMごとの最新ステータスを保持し、変化があった分だけを購読者へ配信する
+    状態やIPが変わるたびに version が1つ進む
+    version はプロセスごとに 0 から数え直し、replace() で戻ることもあるため、
+    比較する側は epoch（起動・置き換えのたびに変わるID）と組で扱う
+    """
+    def __init__(self):
+        self._state: Dict[str, dict] = {}
+        self._version = 0
+        self._epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._subscribers: List[queue.Queue] = []
+        self._updated_at: Optional[float] = None
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def epoch(self) -> str:
+        return self._epoch
+
+    def stamp(self) -> Tuple[str, int]:
+        """(epoch, version) を同じ時点の組で返す"""
+        with self._lock:
+            return self._epoch, self._version
+
+    def update(self, mac: str, status: str, ip: Optional[str]) -> bool:
+        """ステータスを反映する。変化があった場合のみ配信して True を返す"""
+        now = time.strftime("%H:%M:%S")
+        with self._lock:
+            self._updated_at = time.monotonic()
+            cur = self._state.get(mac)
+            if cur is not None and cur["status"] == status and cur["ip"] == ip:
+                cur["last_updated"] = now
+                return False
+            self._version += 1
+            entry = {"status": status, "ip": ip, "last_updated": now, "version": self._version}
+            self._state[mac] = entry
+            delta = {"type": "status", "mac": mac, **entry}
+            subscribers = list(self._subscribers)
+        self._publish(subscribers, delta)
+        return True
+
+    def age(self) -> Optional[float]:
+        """最後に結果を受け取ってからの秒数（まだなければ None）"""
+        if self._updated_at is None:
+            return None
+        return time.monotonic() - self._updated_at
+
+    def get(self, mac: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._state.get(mac)
+            return dict(entry) if entry else None
+
+    def snapshot(self) -> Tuple[int, Dict[str, dict]]:
+        """(version, {mac: status}) のコピーを返す"""
+        with self._lock:
+            return self._version, {mac: dict(e) for mac, e in self._state.items()}
+
+    # --- 他プロセスの StatusHub の写し（status_service.MonitorClient が使う） ---
+    def replace(self, version: int, state: Dict[str, dict]) -> None:
+        """スナップショットで丸ごと置き換え、購読者には再同期させる"""
+        with self._lock:
+            self._updated_at = time.monotonic()
+            self._version = version
+            self._epoch = uuid.uuid4().hex[:8]  # version が戻り得るので、以前の version とは比べさせない
+            self._state = {mac: dict(e) for mac, e in state.items()}
+            subscribers = list(self._subscribers)
+        self._publish(subscribers, RESYNC)
+
+    def apply(self, delta: dict) -> bool:
+        """配信元の差分（type=status）をそのまま反映する。古い version は捨てる"""
+        with self._lock:
+            self._updated_at = time.monotonic()
+            if delta["version"] <= self._version:
+                return False
+            self._version = delta["version"]
+            self._state[delta["mac"]] = {k: delta[k] for k in ("status", "ip", "last_updated", "version")}
+            subscribers = list(self._subscribers)
+        self._publish(subscribers, dict(delta))
+        return True
+
+    def notify_inventory(self) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        self._publish(subscribers, INVENTORY_CHANGED)
+
+    def close(self) -> None:
+        """購読者全員に CLOSED を送って購読を解除する（サーバー停止時）"""
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        self._publish(subscribers, CLOSED)
+
+    # --- 購読 ---
+    def subscribe(self, maxsize: int = SUBSCRIBER_QUEUE_SIZE) -> "queue.Queue[dict]":
+        q: "queue.Queue[dict]" = queue.Queue(maxsize=maxsize)
+        with self._lock:
+            self._subscribers.append(q)
+        return q
+
+    def unsubscribe(self, q: "queue.Queue[dict]") -> None:
+        with self._lock:
+            if q in self._subscribers:
+                self._subscribers.remove(q)
+
+    @staticmethod
+    def _publish(subscribers: List[queue.Queue], event: dict) -> None:
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # 読み出しが追いつかない購読者は差分を捨てて再同期させる
+                with q.mutex:
+                    q.queue.clear()
+                q.put_nowait(RESYNC)
+
+
+# ---------- ポーリングスケジューラ ----------
+POLL_BASE_INTERVAL = 10.0    # 状態が変わった直後・初回の間隔
+POLL_MAX_INTERVAL = 120.0    # 安定しているホストの最大間隔
+POLL_FAST_INTERVAL = 2.0     # 電源操作・WOL直後の間隔
+POLL_FAST_DURATION = 180.0   # 高速ポーリングを続ける時間
+POLL_BACKOFF = 2.0
+POLL_JITTER = 0.1            # 間隔に対する揺らぎの割合
+POLL_MAX_RATE = 50.0         # 全体のプローブ数上限（/秒）
+
+
+@dataclass
+class _PollState:
+    interval: float
+    due: float
+    token: int = 0
+    last_status: Optional[str] = None
+    fast_until: float = 0.0
+
+
+class PollScheduler:
+    """
+    VMごとに次回確認時刻を持つ優先度付きキュー（heapq）
+    - 状態が変わらないホストは間隔を指数的に延ばす（最大 max_interval）
+    - 状態が変わったら base_interval に戻す
+    - boost() 後しばらくは fast_interval で確認する
+    - ジッタで確認時刻を散らし、max_rate（/秒）で全体のプローブ数を抑える
+    """
+    def __init__(self, base_interval: float = POLL_BASE_INTERVAL,
+                 max_interval: float = POLL_MAX_INTERVAL,
+                 fast_interval: float = POLL_FAST_INTERVAL,
+                 fast_duration: float = POLL_FAST_DURATION,
+                 backoff: float = POLL_BACKOFF,
+                 jitter: float = POLL_JITTER,
+                 max_rate: float = POLL_MAX_RATE,
+                 clock: Callable[[], float] = time.monotonic):
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.fast_interval = fast_interval
+        self.fast_duration = fast_duration
+        self.backoff = backoff
+        self.jitter = jitter
+        self.max_rate = max_rate
+        self.clock = clock
+        self._heap: List[Tuple[float, int, str]] = []
+        self._states: Dict[str, _PollState] = {}
+        self._tokens = max_rate
+        self._refilled_at = clock()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def sync(self, macs: Iterable[str]) -> None:
+        """監視対象を入れ替える（新規は即時確認、消えたものは破棄）"""
+        now = self.clock()
+        wanted = set(macs)
+        with self._lock:
+            for mac in list(self._states):
+                if mac not in wanted:
+                    del self._states[mac]  # ヒープ上の古い要素は取り出し時に捨てる
+            for mac in wanted:
+                if mac not in self._states:
+                    self._states[mac] = _PollState(interval=self.base_interval, due=now)
+                    self._push(mac, now)
+
+    def due(self) -> List[str]:
+        """期限が来たMACを取り出す（レート上限を超える分は次回に回す）"""
+        now = self.clock()
+        out: List[str] = []
+        with self._lock:
+            self._refill(now)
+            while self._heap and self._heap[0][0] <= now and self._tokens >= 1:
+                _, token, mac = heapq.heappop(self._heap)
+                st = self._states.get(mac)
+                if st is None or st.token != token:
+                    continue
+                st.token = -1  # 確認中（report まで再投入しない）
+                self._tokens -= 1
+                out.append(mac)
+        return out
+
+    def report(self, mac: str, status: str) -> None:
+        """確認結果を受けて次回時刻を決める"""
+        now = self.clock()
+        with self._lock:
+            st = self._states.get(mac)
+            if st is None:
+                return
+            if now < st.fast_until:
+                st.interval = self.fast_interval
+            elif st.last_status is None or status != st.last_status:
+                st.interval = self.base_interval
+            else:
+                st.interval = min(st.interval * self.backoff, self.max_interval)
+            st.last_status = status
+            self._push(mac, now + self._jittered(st.interval))
+
+    def boost(self, mac: str, duration: Optional[float] = None) -> None:
+        """電源操作・WOLの直後に呼ぶ。すぐに確認し、しばらく高速ポーリングする"""
+        now = self.clock()
+        with self._lock:
+            st = self._states.get(mac)
+            if st is None:
+                st = self._states[mac] = _PollState(interval=self.fast_interval, due=now)
+            st.fast_until = now + (self.fast_duration if duration is None else duration)
+            st.interval = self.fast_interval
+            if st.token != -1:
+                self._push(mac, now)
+
+    def next_delay(self) -> Optional[float]:
+        """次に期限が来るまでの秒数（対象がなければ None）"""
+        with self._lock:
+            while self._heap:
+                due, token, mac = self._heap[0]
+                st = self._states.get(mac)
+                if st is not None and st.token == token:
+                    wait = max(0.0, due - self.clock())
+                    if self._tokens < 1:
+                        wait = max(wait, (1 - self._tokens) / self.max_rate)
+                    return wait
+                heapq.heappop(self._heap)
+            return None
+
+    # --- 内部処理 ---
+    def _push(self, mac: str, due: float) -> None:
+        st = self._states[mac]
+        st.token = max(st.token, 0) + 1
+        st.due = due
+        heapq.heappush(self._heap, (due, st.token, mac))
+
+    def _jittered(self, interval: float) -> float:
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.max_rate, self._tokens + (now - self._refilled_at) * self.max_rate)
+        self._refilled_at = now
+
+
+# ---------- 監視ループ ----------
+MONITOR_MAX_WAIT = 1.0  # boost や対象の増減に気付くまでの最大待ち時間
+
+
+class StatusMonitor:
+    """
+    PollScheduler で期限が来たVMだけを sweep_status でまとめて確認し、
+    結果を StatusHub・StatusHistory（指定時）と on_result コールバックへ流す
+    vm_source: 現在の監視対象（mac / host_ip を持つオブジェクト）を返す関数
+    guest_status: ハイパーバイザーからゲストの状態をまとめて得る関数（HypervisorBackend.guest_states など）
+    max_workers: 1回の確認で同時に調べる台数の上限
+    """
+    def __init__(self, vm_source: Callable[[], Iterable[Any]],
+                 hub: Optional[StatusHub] = None,
+                 scheduler: Optional[PollScheduler] = None,
+                 on_result: Optional[Callable[[Any, str, Optional[str]], None]] = None,
+                 history: Optional[StatusHistory] = None,
+                 guest_status: Optional[Callable[[list], Dict[str, str]]] = None,
+                 max_workers: int = vm_info.SWEEP_MAX_WORKERS):
+        self.vm_source = vm_source
+        self.hub = hub if hub is not None else StatusHub()
+        self.scheduler = scheduler or PollScheduler()
+        self.on_result = on_result
+        self.history = history
+        self.guest_status = guest_status
+        self.max_workers = max_workers
+        self._status_log = ChangeLog(logger)  # 状態が変わった時だけログに残す
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def boost(self, mac: str) -> None:
+        self.scheduler.boost(mac)
+        self._wake.set()
+
+    def run_once(self) -> int:
+        """期限が来たVMを1回分確認し、確認した台数を返す"""
+        vms = list(self.vm_source())
+        self.scheduler.sync(vm.mac for vm in vms)
+        due = set(self.scheduler.due())
+        if not due:
+            return 0
+        targets = [vm for vm in vms if vm.mac in due]
+        seen = set()
+        for vm, status, new_ip in sweep_status(targets, max_workers=self.max_workers,
+                                                 guest_status=self.guest_status):
+            ip = new_ip or vm.host_ip or "-"
+            self.hub.update(vm.mac, status, ip)
+            if vm.mac not in seen:
+                seen.add(vm.mac)
+                self._status_log.update(vm.mac, status,
+                                        f"Status changed: {getattr(vm, 'vm_name', vm.mac)} -> {status} ({ip})")
+                self.scheduler.report(vm.mac, status)
+                if self.history is not None:
+                    rtt = vm_info.default_prober.rtt.get(new_ip) if new_ip else None
+                    self.history.record(vm.mac, status, rtt)
+            if self.on_result:
+                self.on_result(vm, status, new_ip)
+        # 結果が返らなかったもの（例外など）も次回に回す
+        for mac in due - seen:
+            self.scheduler.report(mac, "不明")
+        # インベントリから消えた・IPが変わったホストの RTT を共有プローバーに残さない
+        macs = {vm.mac for vm in vms}
+        _, state = self.hub.snapshot()
+        vm_info.default_prober.retain({vm.host_ip for vm in vms if vm.host_ip} |
+                                      {e["ip"] for mac, e in state.items() if mac in macs and e["ip"]})
+        return len(targets)
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Status monitor error: {e}")
+            delay = self.scheduler.next_delay()
+            wait = MONITOR_MAX_WAIT if delay is None else min(delay, MONITOR_MAX_WAIT)
+            self._wake.wait(wait)
+            self._wake.clear()
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="status-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
@@ -0,0 +1,287 @@
+from __future__ import annotations
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, asdict, field
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from .logger import get_logger
+from .vm_control import BATCH_MAX_WORKERS, power_action_unified, send_magic_packet
+from .vm_info import resolve_status
+
+logger = get_logger("homevm")
+
+STARTUP = "startup"
+SHUTDOWN = "shutdown"
+
+READY_TIMEOUT = 300.0   # WOL・ゲスト起動から応答するまでの上限（秒）
+STOP_TIMEOUT = 180.0    # 停止コマンドから応答が消えるまでの上限（秒）
+POLL_INTERVAL = 2.0     # 起動・停止待ちの確認間隔（秒）
+
+# ゲストを起動する関数: (guest, host) -> (ok, message)
+GuestStarter = Callable[[Any, Optional[Any]], Tuple[bool, str]]
+# ゲストを停止する関数: (guest, host, ゲストのパスワード) -> (ok, message)
+GuestStopper = Callable[[Any, Optional[Any], Optional[str]], Tuple[bool, str]]
+
+
+class DependencyError(ValueError):
+    """runs_on が存在しないVMを指している、または循環している"""
+
+
+@dataclass
+class StepResult:
+    vm_name: str
+    mac: str
+    action: str
+    ok: bool
+    message: str
+    start: float   # 計画開始からの秒数
+    end: float
+    depends_on: List[str] = field(default_factory=list)
+    skipped: bool = False
+
+    @property
+    def elapsed(self) -> float:
+        return self.end - self.start
+
+    def to_dict(self) -> dict:
+        d = asdict(self)
+        d["elapsed"] = self.elapsed
+        return d
+
+
+@dataclass
+class PlanResult:
+    action: str
+    steps: List[StepResult]
+    elapsed: float
+    critical_path: List[str]   # 最後に終わったステップまでの依存の連鎖（vm_name）
+    critical_path_time: float
+
+    @property
+    def ok(self) -> bool:
+        return all(s.ok for s in self.steps)
+
+    def to_dict(self) -> dict:
+        return {
+            "action": self.action,
+            "ok": self.ok,
+            "elapsed": self.elapsed,
+            "critical_path": self.critical_path,
+            "critical_path_time": self.critical_path_time,
+            "steps": [s.to_dict() for s in self.steps],
+        }
+
+
+def dependency_graph(vms: Iterable[Any]) -> Dict[str, Optional[str]]:
+    """{vm_name: runs_on} を返す。存在しないホスト・循環は DependencyError"""
+    vms = list(vms)
+    names = {vm.vm_name for vm in vms}
+    graph: Dict[str, Optional[str]] = {}
+    for vm in vms:
+        host = getattr(vm, "runs_on", "") or None
+        if host is not None and host not in names:
+            raise DependencyError(f"{vm.vm_name}: runs_on '{host}' is not in the inventory")
+        if host == vm.vm_name:
+            raise DependencyError(f"{vm.vm_name}: runs_on points to itself")
+        graph[vm.vm_name] = host
+    for name in graph:
+        chain = [name]
+        host = graph[name]
+        while host is not None:
+            if host in chain:
+                raise DependencyError(f"runs_on cycle: {' -> '.join(chain)} -> {host}")
+            chain.append(host)
+            host = graph[host]
+    return graph
+
+
+def critical_path(steps: List[StepResult]) -> Tuple[List[str], float]:
+    """最後に終わったステップから、一番遅く終わった依存元をたどる"""
+    if not steps:
+        return [], 0.0
+    by_name = {s.vm_name: s for s in steps}
+    cur = max(steps, key=lambda s: s.end)
+    path = [cur.vm_name]
+    while cur.depends_on:
+        cur = max((by_name[d] for d in cur.depends_on), key=lambda s: s.end)
+        path.append(cur.vm_name)
+    path.reverse()
+    return path, max(s.end for s in steps)
+
+
+class PowerOrchestrator:
+    """
+    runs_on の依存関係に沿って電源操作を並列に進める
+    - startup:  ハイパーバイザーをWOLで起動 → 応答を待つ → その上のゲストを並列に起動
+    - shutdown: ゲストを並列に停止 → 応答が消えたらハイパーバイザーを停止
+    依存先が失敗したステップは実行せず skipped として返す
+    対象に含めたVMの依存先（startup ではホスト、shutdown ではゲスト）は自動で加える
+
+    guest_starter: 仮想マシンを起動する関数（ハイパーバイザー経由の電源ONなど）
+                   指定がなければホスト側の自動起動を待つだけにする
+    guest_stopper: 仮想マシンを停止する関数（ハイパーバイザー経由の停止など）
+                   指定がなければゲストへ直接 SSH/WinRM で停止する
+    """
+    def __init__(self, vms: Iterable[Any],
+                 password_for: Callable[[Any], Optional[str]] = lambda vm: None,
+                 guest_starter: Optional[GuestStarter] = None,
+                 guest_stopper: Optional[GuestStopper] = None,
+                 max_workers: int = BATCH_MAX_WORKERS,
+                 ready_timeout: float = READY_TIMEOUT,
+                 stop_timeout: float = STOP_TIMEOUT,
+                 poll_interval: float = POLL_INTERVAL,
+                 resolver: Callable[[str, Optional[str]], Tuple[str, Optional[str]]] = resolve_status,
+                 wake: Callable[[str], None] = send_magic_packet,
+                 power: Callable[[str, str, str, str, str], Tuple[bool, str]] = power_action_unified):
+        self.vms = list(vms)
+        self.by_name = {vm.vm_name: vm for vm in self.vms}
+        self.graph = dependency_graph(self.vms)
+        self.password_for = password_for
+        self.guest_starter = guest_starter
+        self.guest_stopper = guest_stopper
+        self.max_workers = max_workers
+        self.ready_timeout = ready_timeout
+        self.stop_timeout = stop_timeout
+        self.poll_interval = poll_interval
+        self.resolver = resolver
+        self.wake = wake
+        self.power = power
+
+    # --- 計画 ---
+    def plan(self, action: str, targets: Optional[Iterable[str]] = None) -> Dict[str, Set[str]]:
+        """{vm_name: 先に終わっている必要がある vm_name の集合}"""
+        if action not in (STARTUP, SHUTDOWN):
+            raise ValueError(f"Unsupported action: {action}")
+        guests: Dict[str, Set[str]] = {}
+        for name, host in self.graph.items():
+            if host is not None:
+                guests.setdefault(host, set()).add(name)
+
+        selected = set(self.by_name) if targets is None else set(targets)
+        unknown = selected - set(self.by_name)
+        if unknown:
+            raise DependencyError(f"Unknown VMs: {', '.join(sorted(unknown))}")
+        # 依存先を閉包に加える
+        stack = list(selected)
+        while stack:
+            name = stack.pop()
+            nxt = [self.graph[name]] if action == STARTUP else list(guests.get(name, ()))
+            for n in nxt:
+                if n is not None and n not in selected:
+                    selected.add(n)
+                    stack.append(n)
+
+        if action == STARTUP:
+            return {n: {self.graph[n]} & selected for n in selected}
+        return {n: guests.get(n, set()) & selected for n in selected}
+
+    def run(self, action: str, targets: Optional[Iterable[str]] = None) -> PlanResult:
+        start = time.monotonic()
+        steps = list(self.iter_run(action, targets))
+        path, path_time = critical_path(steps)
+        result = PlanResult(action, steps, time.monotonic() - start, path, path_time)
+        logger.info(f"Orchestrated {action}: {sum(s.ok for s in steps)}/{len(steps)} OK, "
+                    f"critical path {' -> '.join(path)} ({path_time:.1f}s)")
+        return result
+
+    def iter_run(self, action: str, targets: Optional[Iterable[str]] = None) -> Iterator[StepResult]:
+        """依存関係が満たされたものから並列に実行し、終わった順に StepResult を yield する"""
+        deps = self.plan(action, targets)
+        if not deps:
+            return
+        task = self._start_one if action == STARTUP else self._stop_one
+        t0 = time.monotonic()
+        done: Dict[str, StepResult] = {}
+        running: Dict[Future, Tuple[str, float]] = {}
+        submitted: Set[str] = set()
+        workers = max(1, min(self.max_workers, len(deps)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="orchestrate") as pool:
+            while len(done) < len(deps):
+                progressed = False
+                for name in sorted(deps):
+                    if name in submitted:
+                        continue
+                    if not deps[name] <= set(done):
+                        continue
+                    failed = [d for d in deps[name] if not done[d].ok]
+                    now = time.monotonic() - t0
+                    if failed:
+                        vm = self.by_name[name]
+                        res = StepResult(name, vm.mac, action, False, f"Skipped: {', '.join(failed)} failed",
+                                         now, now, sorted(deps[name]), skipped=True)
+                        done[name] = res
+                        submitted.add(name)
+                        progressed = True
+                        yield res
+                        continue
+                    running[pool.submit(task, self.by_name[name])] = (name, now)
+                    submitted.add(name)
+                    progressed = True
+                if progressed:
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    name, started = running.pop(fut)
+                    try:
+                        ok, msg = fut.result()
+                    except Exception as e:
+                        logger.error(f"Orchestrated {action} error on {name}: {e}")
+                        ok, msg = False, str(e)
+                    vm = self.by_name[name]
+                    res = StepResult(name, vm.mac, action, ok, msg, started, time.monotonic() - t0,
+                                     sorted(deps[name]))
+                    done[name] = res
+                    yield res
+
+    # --- 各ステップ ---
+    def _status(self, vm: Any) -> str:
+        status, ip = self.resolver(vm.mac, vm.host_ip or None)
+        if ip:
+            vm.host_ip = ip
+        return status
+
+    def _wait_for(self, vm: Any, want_running: bool, timeout: float) -> Optional[float]:
+        """稼働中（want_running=False なら稼働中でない）になるまで待ち、かかった秒数を返す"""
+        start = time.monotonic()
+        while True:
+            if (self._status(vm) == "稼働中") == want_running:
+                return time.monotonic() - start
+            remaining = timeout - (time.monotonic() - start)
+            if remaining <= 0:
+                return None
+            time.sleep(min(self.poll_interval, remaining))
+
+    def _start_one(self, vm: Any) -> Tuple[bool, str]:
+        if self._status(vm) == "稼働中":
+            return True, "Already running"
+        if vm.type == "physical":
+            self.wake(vm.mac)
+            how = "Magic Packet sent"
+        elif self.guest_starter is not None:
+            ok, msg = self.guest_starter(vm, self.by_name.get(vm.runs_on))
+            if not ok:
+                return False, msg
+            how = msg or "Start requested"
+        else:
+            how = "Waiting for autostart"
+        waited = self._wait_for(vm, True, self.ready_timeout)
+        if waited is None:
+            return False, f"{how}; no reply within {self.ready_timeout:.0f}s"
+        return True, f"{how}; ready after {waited:.1f}s"
+
+    def _stop_one(self, vm: Any) -> Tuple[bool, str]:
+        if self._status(vm) != "稼働中":
+            return True, "Already stopped"
+        if vm.type != "physical" and self.guest_stopper is not None:
+            ok, msg = self.guest_stopper(vm, self.by_name.get(vm.runs_on), self.password_for(vm))
+        elif not vm.host_ip:
+            return False, "IP unknown"
+        elif not (password := self.password_for(vm)):
+            return False, "Password required"
+        else:
+            ok, msg = self.power(vm.method, vm.host_ip, vm.user, password, "off")
+        if not ok:
+            return False, msg
+        waited = self._wait_for(vm, False, self.stop_timeout)
+        if waited is None:
+            return False, f"Still answering {self.stop_timeout:.0f}s after shutdown"
+        return True, f"Stopped after {waited:.1f}s"
@@ -0,0 +1,490 @@
+"""
+共有ステータス監視サービス
+
+1台のマシンで GUI（main.py）と Web（web/app.py）を同時に開いても、
+ARP・生存確認のループは このサービスの1つだけが回す。
+各フロントエンドは MonitorClient で購読し、手元の StatusHub に写しを持つ。
+
+    python -m core.status_service                 # 既定のアドレスで起動
+    python -m core.status_service --probe-workers 32
+
+通信は1行1メッセージの JSON（Unix ソケット、使えない環境では 127.0.0.1 の TCP）
+  サービス → クライアント
+    {"type": "snapshot", "version": v, "status": {mac: {...}}}  接続直後・再同期時
+    {"type": "status", "mac": ..., "status": ..., "ip": ..., "last_updated": ..., "version": v}
+    {"type": "reply", "id": n, "result": ...} / {"type": "reply", "id": n, "error": "..."}
+    {"type": "ping"}                                             無通信時の生存確認
+  クライアント → サービス
+    {"type": "boost", "mac": ...}                                電源操作・WOL直後の高速ポーリング
+    {"type": "forget", "mac": ...}                               VM削除時に履歴を消す
+    {"type": "history", "id": n, "mac": ..., "range": 秒, "points": 点数}
+"""
+from __future__ import annotations
+import argparse
+import itertools
+import json
+import os
+import queue
+import signal
+import socket
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple, Union
+from .logger import get_logger
+from .monitor import CLOSED, INVENTORY_CHANGED, RESYNC, StatusHub, StatusMonitor
+from .vm_data import DATA_DIR
+
+logger = get_logger("homevm")
+
+SERVICE_SOCKET = DATA_DIR / "monitor.sock"
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 5099           # AF_UNIX が無い環境（Windows）で使うポート
+SERVICE_KEEPALIVE = 15.0      # 無通信時に ping を送る間隔（秒）
+CONNECT_TIMEOUT = 1.0         # サービスの有無を確かめる接続の待ち時間（秒）
+RECONNECT_MAX_DELAY = 5.0     # 切断後の再接続間隔の上限（秒）
+REQUEST_TIMEOUT = 5.0         # history などの問い合わせの待ち時間（秒）
+
+# ("unix", パス) または ("tcp", (ホスト, ポート))
+Address = Tuple[str, Union[str, Tuple[str, int]]]
+
+
+# ---------- アドレス ----------
+def parse_address(text: str) -> Address:
+    """"ホスト:ポート" なら TCP、それ以外は Unix ソケットのパス"""
+    host, sep, port = text.rpartition(":")
+    if sep and port.isdigit() and "/" not in text and "\\" not in text:
+        return "tcp", (host or SERVICE_HOST, int(port))
+    return "unix", text
+
+
+def default_address() -> Optional[Address]:
+    """
+    HOMEVM_MONITOR で指定されたアドレス（"off" なら None）
+    未指定なら data/monitor.sock、AF_UNIX が使えなければ 127.0.0.1:SERVICE_PORT
+    """
+    env = os.environ.get("HOMEVM_MONITOR", "").strip()
+    if env.lower() == "off":
+        return None
+    if env and env.lower() != "auto":
+        return parse_address(env)
+    if hasattr(socket, "AF_UNIX"):
+        return "unix", str(SERVICE_SOCKET)
+    return "tcp", (SERVICE_HOST, SERVICE_PORT)
+
+
+def _connect(address: Address, timeout: Optional[float]) -> socket.socket:
+    kind, target = address
+    if kind == "unix":
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(target)
+    except OSError:
+        sock.close()
+        raise
+    sock.settimeout(None)
+    return sock
+
+
+def _send(sock: socket.socket, lock: threading.Lock, message: dict) -> None:
+    data = (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+    with lock:
+        sock.sendall(data)
+
+
+def _lines(sock: socket.socket) -> Iterable[dict]:
+    """受信した行を JSON として順に返す（切断で終わる）"""
+    with sock.makefile("r", encoding="utf-8", newline="\n") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+# ---------- サービス側 ----------
+class MonitorService:
+    """
+    StatusMonitor の StatusHub をソケットで配信する
+    接続ごとに送信（購読キュー → ソケット）と受信（コマンド処理）のスレッドを持つ
+    """
+    def __init__(self, monitor: StatusMonitor, address: Optional[Address] = None):
+        self.monitor = monitor
+        self.hub = monitor.hub
+        self.address = address or default_address() or ("tcp", (SERVICE_HOST, SERVICE_PORT))
+        self._sock: Optional[socket.socket] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._clients = 0
+        self._lock = threading.Lock()
+
+    @property
+    def clients(self) -> int:
+        """接続中のフロントエンド数"""
+        return self._clients
+
+    def bind(self) -> Address:
+        """待ち受けを開始し、実際のアドレスを返す。既に動いているサービスがあれば RuntimeError"""
+        kind, target = self.address
+        if kind == "unix":
+            path = Path(target)
+            if path.exists():
+                try:
+                    _connect(self.address, CONNECT_TIMEOUT).close()
+                except OSError:
+                    path.unlink()  # 前回の異常終了で残ったソケット
+                else:
+                    raise RuntimeError(f"Monitor service already running at {path}")
+            path.parent.mkdir(parents=True, exist_ok=True)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.bind(str(path))
+            os.chmod(path, 0o600)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                sock.bind(target)
+            except OSError as e:
+                sock.close()
+                raise RuntimeError(f"Monitor service port {target[0]}:{target[1]} is in use: {e}")
+            self.address = "tcp", sock.getsockname()[:2]
+        sock.listen(16)
+        self._sock = sock
+        return self.address
+
+    def start(self) -> None:
+        if self._sock is None:
+            self.bind()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.serve_forever, name="monitor-service", daemon=True)
+        self._thread.start()
+
+    def serve_forever(self) -> None:
+        if self._sock is None:
+            self.bind()
+        logger.info(f"Monitor service listening on {self.address[1]}")
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                break  # close() で待ち受けソケットが閉じられた
+            threading.Thread(target=self._serve_client, args=(conn,),
+                             name="monitor-client", daemon=True).start()
+
+    def close(self) -> None:
+        """待ち受けを止め、接続中のクライアントには CLOSED を送って切断する"""
+        self._stop.set()
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        self.hub.close()
+        if self.address[0] == "unix":
+            try:
+                Path(self.address[1]).unlink()
+            except OSError:
+                pass
+        if self._thread:
+            self._thread.join(CONNECT_TIMEOUT)
+
+    # --- 接続ごとの処理 ---
+    def _serve_client(self, conn: socket.socket) -> None:
+        send_lock = threading.Lock()
+        sub = self.hub.subscribe()
+        with self._lock:
+            self._clients += 1
+        reader = threading.Thread(target=self._read_commands, args=(conn, send_lock, sub),
+                                  name="monitor-client-rx", daemon=True)
+        reader.start()
+        try:
+            self._send_snapshot(conn, send_lock)
+            while reader.is_alive():
+                try:
+                    ev = sub.get(timeout=SERVICE_KEEPALIVE)
+                except queue.Empty:
+                    _send(conn, send_lock, {"type": "ping"})
+                    continue
+                if ev is CLOSED:
+                    break
+                if ev is RESYNC or ev is INVENTORY_CHANGED:
+                    self._send_snapshot(conn, send_lock)
+                else:
+                    _send(conn, send_lock, ev)
+        except OSError:
+            pass  # クライアントが切断した
+        finally:
+            self.hub.unsubscribe(sub)
+            with self._lock:
+                self._clients -= 1
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+
+    def _send_snapshot(self, conn: socket.socket, send_lock: threading.Lock) -> None:
+        version, state = self.hub.snapshot()
+        _send(conn, send_lock, {"type": "snapshot", "version": version, "status": state})
+
+    def _read_commands(self, conn: socket.socket, send_lock: threading.Lock,
+                       sub: "queue.Queue[dict]") -> None:
+        try:
+            for msg in _lines(conn):
+                reply = self._handle(msg)
+                if reply is not None:
+                    _send(conn, send_lock, reply)
+        except (OSError, ValueError):
+            pass
+        finally:
+            # 切断に気付いたら送信側も待たずに終わらせる
+            try:
+                sub.put_nowait(CLOSED)
+            except queue.Full:
+                pass
+
+    def _handle(self, msg: dict) -> Optional[dict]:
+        kind = msg.get("type")
+        if kind == "boost":
+            self.monitor.boost(msg["mac"])
+            return None
+        if kind == "forget":
+            if self.monitor.history is not None:
+                self.monitor.history.forget(msg["mac"])
+            return None
+        if kind == "history":
+            reply = {"type": "reply", "id": msg.get("id")}
+            if self.monitor.history is None:
+                reply["error"] = "History is not recorded by this service"
+            else:
+                reply["result"] = self.monitor.history.query(
+                    msg["mac"], float(msg.get("range", 86400)), int(msg.get("points", 200)))
+            return reply
+        logger.warning(f"Monitor service: unknown command {kind!r}")
+        return None
+
+
+# ---------- クライアント側 ----------
+class RemoteHistory:
+    """StatusHistory の代わりに、問い合わせをサービスへ転送する（query / forget / flush）"""
+    def __init__(self, client: "MonitorClient"):
+        self.client = client
+
+    def query(self, mac: str, range_sec: float = 86400, points: int = 200) -> dict:
+        return self.client.request({"type": "history", "mac": mac, "range": range_sec, "points": points})
+
+    def forget(self, mac: str) -> None:
+        self.client.send({"type": "forget", "mac": mac})
+
+    def flush(self) -> None:
+        pass  # 書き込みはサービス側で行う
+
+
+class MonitorClient:
+    """
+    MonitorService を購読して StatusHub に写す（StatusMonitor と同じ start / stop / boost を持つ）
+    vm_source: 手元のVM一覧を返す関数（on_result に渡すVMをMACで引く）
+    on_result: 状態が届くたびに (vm, status, ip) で呼ぶ（スナップショット時は全台分）
+    切断されても再接続を続け、つながるたびにスナップショットから取り直す
+    """
+    def __init__(self, vm_source: Callable[[], Iterable[Any]],
+                 hub: Optional[StatusHub] = None,
+                 on_result: Optional[Callable[[Any, str, Optional[str]], None]] = None,
+                 address: Optional[Address] = None):
+        self.vm_source = vm_source
+        self.hub = hub if hub is not None else StatusHub()
+        self.on_result = on_result
+        self.address = address or default_address() or ("tcp", (SERVICE_HOST, SERVICE_PORT))
+        self.history = RemoteHistory(self)
+        self._sock: Optional[socket.socket] = None
+        self._send_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._waiting: Dict[int, Future] = {}
+        self._connected = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def wait_connected(self, timeout: Optional[float] = None) -> bool:
+        return self._connected.wait(timeout)
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="monitor-subscriber", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        self._disconnect()
+        if self._thread:
+            self._thread.join(timeout)
+
+    # --- コマンド ---
+    def boost(self, mac: str) -> None:
+        self.send({"type": "boost", "mac": mac})
+
+    def send(self, message: dict) -> bool:
+        """返事のいらないコマンドを送る。未接続なら捨てて False"""
+        sock = self._sock
+        if sock is None:
+            return False
+        try:
+            _send(sock, self._send_lock, message)
+            return True
+        except OSError:
+            return False
+
+    def request(self, message: dict, timeout: float = REQUEST_TIMEOUT) -> Any:
+        """返事のあるコマンドを送り、result を返す（未接続・タイムアウトは ConnectionError）"""
+        req_id = next(self._ids)
+        fut: Future = Future()
+        self._waiting[req_id] = fut
+        try:
+            if not self.send({**message, "id": req_id}):
+                raise ConnectionError("Monitor service is not connected")
+            try:
+                return fut.result(timeout)
+            except TimeoutError:
+                raise ConnectionError("Monitor service did not answer") from None
+        finally:
+            self._waiting.pop(req_id, None)
+
+    # --- 受信ループ ---
+    def _loop(self) -> None:
+        delay = 0.2
+        while not self._stop.is_set():
+            try:
+                sock = _connect(self.address, CONNECT_TIMEOUT)
+            except OSError:
+                self._stop.wait(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+            delay = 0.2
+            self._sock = sock
+            logger.info(f"Subscribed to monitor service at {self.address[1]}")
+            try:
+                for msg in _lines(sock):
+                    self._dispatch(msg)
+            except (OSError, ValueError) as e:
+                if not self._stop.is_set():
+                    logger.warning(f"Monitor service connection lost: {e}")
+            self._disconnect()
+
+    def _disconnect(self) -> None:
+        self._connected.clear()
+        sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+        for fut in list(self._waiting.values()):
+            if not fut.done():
+                fut.set_exception(ConnectionError("Monitor service disconnected"))
+
+    def _dispatch(self, msg: dict) -> None:
+        kind = msg.get("type")
+        if kind == "status":
+            if self.hub.apply(msg):
+                self._report({msg["mac"]: msg})
+        elif kind == "snapshot":
+            self.hub.replace(msg["version"], msg["status"])
+            self._connected.set()
+            self._report(msg["status"])
+        elif kind == "reply":
+            fut = self._waiting.get(msg.get("id"))
+            if fut is not None and not fut.done():
+                if "error" in msg:
+                    fut.set_exception(RuntimeError(msg["error"]))
+                else:
+                    fut.set_result(msg.get("result"))
+
+    def _report(self, entries: Dict[str, dict]) -> None:
+        if self.on_result is None:
+            return
+        for vm in list(self.vm_source()):
+            entry = entries.get(vm.mac)
+            if entry is not None:
+                ip = entry.get("ip")
+                self.on_result(vm, entry["status"], ip if ip and ip != "-" else None)
+
+
+def connect_service(vm_source: Callable[[], Iterable[Any]],
+                    hub: Optional[StatusHub] = None,
+                    on_result: Optional[Callable[[Any, str, Optional[str]], None]] = None,
+                    address: Optional[Address] = None) -> Optional[MonitorClient]:
+    """
+    監視サービスが動いていれば購読用の MonitorClient（未開始）を返す。無ければ None
+    （呼び出し側は None なら自分で StatusMonitor を動かす）
+    """
+    address = address or default_address()
+    if address is None:
+        return None
+    try:
+        _connect(address, CONNECT_TIMEOUT).close()
+    except OSError:
+        return None
+    return MonitorClient(vm_source, hub, on_result, address)
+
+
+# ---------- 起動 ----------
+def _keyring_password(host_ip: str) -> Optional[str]:
+    try:
+        import keyring
+        return keyring.get_password("HomeVM-Manager", host_ip)
+    except Exception:
+        return None
+
+
+def _exit_on_signal(signum, frame):
+    raise SystemExit(0)
+
+
+def main(argv=None) -> int:
+    from .history import open_history
+    from .vm_control import HypervisorBackend
+    from .vm_data import get_repository
+    from .vm_info import SWEEP_MAX_WORKERS
+
+    ap = argparse.ArgumentParser(description="HomeVM Manager 共有ステータス監視サービス")
+    ap.add_argument("--address", help="Unix ソケットのパス または ホスト:ポート（既定: HOMEVM_MONITOR / data/monitor.sock）")
+    ap.add_argument("--probe-workers", type=int, default=SWEEP_MAX_WORKERS, help="1回の確認で同時に調べる台数")
+    args = ap.parse_args(argv)
+
+    address = parse_address(args.address) if args.address else default_address()
+    inventory = get_repository()
+    history = open_history()  # Web が先に単独で監視していればメモリ上だけで記録する
+    hypervisor = HypervisorBackend(lambda: inventory.snapshot().vms, lambda vm: _keyring_password(vm.host_ip))
+    monitor = StatusMonitor(lambda: inventory.snapshot().vms, history=history,
+                            guest_status=hypervisor.guest_states, max_workers=args.probe_workers)
+    service = MonitorService(monitor, address)
+    try:
+        service.bind()
+    except RuntimeError as e:
+        logger.error(str(e))
+        return 1
+
+    signal.signal(signal.SIGTERM, _exit_on_signal)
+    monitor.start()
+    try:
+        service.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        service.close()
+        monitor.stop(CONNECT_TIMEOUT * 5)
+        history.close()
+        logger.info("Monitor service stopped")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
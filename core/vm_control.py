@@ -1,74 +1,347 @@
 from __future__ import annotations
 import binascii
+import codecs
+import hashlib
+import ipaddress
+import queue
+import re
+import select
 import socket
+import threading
+import time
 import paramiko
 import winrm
-from typing import Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, asdict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, Optional
+from . import metrics, vm_info
+from .conn_pool import ConnectionPool
 from .logger import get_logger
 
 logger = get_logger("homevm")
 
+SSH_KEEPALIVE = 30  # 秒
+EXEC_CHUNK_SIZE = 32768
+EXEC_POLL_INTERVAL = 0.2  # 出力待ちの select 間隔（秒）
+WINRM_PORT = 5985
+
+# SSH / WinRM の認証済み接続を使い回すための共有プール
+connection_pool = ConnectionPool()
+
+
+def credential_digest(password: Optional[str]) -> str:
+    """プールのキーに含めるパスワードのダイジェスト（違うパスワードで認証済みの接続を使わせない）"""
+    return hashlib.sha256((password or "").encode("utf-8")).hexdigest()
+
 
 # ---------- Wake on LAN ----------
+def build_magic_packet(mac: str) -> bytes:
+    """マジックパケット（FF×6 + MAC×16）を組み立てる"""
+    mac_clean = mac.replace(":", "").replace("-", "").lower()
+    if len(mac_clean) != 12 or not all(c in "0123456789abcdef" for c in mac_clean):
+        raise ValueError(f"Invalid MAC: {mac}")
+    return b"\xff" * 6 + binascii.unhexlify(mac_clean) * 16
+
+
 def send_magic_packet(mac: str,
                       broadcast_ip: str = "255.255.255.255",
                       port: int = 9) -> None:
     """MACアドレスへマジックパケット送信"""
-    mac_clean = mac.replace(":", "").replace("-", "").lower()
-    if len(mac_clean) != 12 or not all(c in "0123456789abcdef" for c in mac_clean):
-        raise ValueError(f"Invalid MAC: {mac}")
+    packet = build_magic_packet(mac)
+
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            s.sendto(packet, (broadcast_ip, port))
+    except OSError:
+        metrics.POWER_ACTIONS.inc(action="wol", result="error")
+        raise
+    metrics.POWER_ACTIONS.inc(action="wol", result="ok")
+
+    logger.info(f"WOL sent to MAC={mac}, dst={broadcast_ip}:{port}")
+
 
-    data = b"FF" * 6 + (mac_clean.encode("ascii") * 16)
-    packet = binascii.unhexlify(data)
+# ---------- 一括 Wake on LAN ----------
+WOL_PORT = 9
+WOL_BROADCAST = "255.255.255.255"
+WOL_REPEAT = 3              # 1台あたりの送信回数（取りこぼし対策）
+WOL_REPEAT_INTERVAL = 0.1   # 送信バースト間の間隔（秒）
+WOL_PREFIX = 24             # サブネット指向ブロードキャストの算出に使うプレフィックス長
+WOL_WAIT_TIMEOUT = 180.0    # 起動待ちの上限（秒）
+WOL_POLL_INTERVAL = 2.0     # 起動待ち中の生存確認の間隔（秒）
 
+
+def directed_broadcast(ip: str, prefix: int = WOL_PREFIX) -> Optional[str]:
+    """ホストIPが属するサブネットのブロードキャストアドレス（例: 192.168.1.255）"""
+    try:
+        return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False).broadcast_address)
+    except ValueError:
+        return None
+
+
+@dataclass
+class WakeResult:
+    vm_name: str
+    mac: str
+    sent: bool
+    destinations: List[str]
+    alive: Optional[bool] = None            # 起動待ちをしない場合は None
+    ip: Optional[str] = None
+    time_to_alive: Optional[float] = None   # 送信から応答までの秒数
+    message: str = ""
+
+    @property
+    def ok(self) -> bool:
+        return self.sent and self.alive is not False
+
+    def to_dict(self) -> dict:
+        d = asdict(self)
+        d["ok"] = self.ok
+        return d
+
+
+def wake_on_lan(vms: Iterable[Any],
+                repeat: int = WOL_REPEAT,
+                interval: float = WOL_REPEAT_INTERVAL,
+                port: int = WOL_PORT,
+                broadcast: str = WOL_BROADCAST,
+                directed: bool = True,
+                prefix: int = WOL_PREFIX,
+                wait: bool = False,
+                timeout: float = WOL_WAIT_TIMEOUT,
+                poll_interval: float = WOL_POLL_INTERVAL,
+                prober: Optional[vm_info.LivenessProber] = None) -> Iterator[WakeResult]:
+    """
+    複数の物理マシンへマジックパケットをまとめて送る
+    - パケットは先に組み立て、1つのUDPソケットで全台へ repeat 回ずつ送る
+    - directed=True なら host_ip のサブネット（/prefix）宛てにも送る
+    - wait=True なら生存確認に応答した台から順に time_to_alive 付きで返し、
+      timeout までに応答しなかった台は alive=False で返す
+    戻り値: WakeResult を yield する（wait=False なら送信後すぐ全件）
+    """
+    plan = []
+    for vm in vms:
+        if getattr(vm, "type", "physical") != "physical":
+            yield WakeResult(vm.vm_name, vm.mac, False, [], message="WOL only for physical machines")
+            continue
+        try:
+            packet = build_magic_packet(vm.mac)
+        except ValueError as e:
+            yield WakeResult(vm.vm_name, vm.mac, False, [], message=str(e))
+            continue
+        dests = [broadcast]
+        sub = directed_broadcast(vm.host_ip, prefix) if directed and vm.host_ip else None
+        if sub and sub not in dests:
+            dests.append(sub)
+        plan.append((vm, packet, dests))
+    if not plan:
+        return
+
+    delivered: Dict[int, set] = {id(vm): set() for vm, _, _ in plan}
+    errors: Dict[int, str] = {}
     with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
         s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        s.sendto(packet, (broadcast_ip, port))
+        for burst in range(max(1, repeat)):
+            if burst:
+                time.sleep(interval)
+            for vm, packet, dests in plan:
+                for dst in dests:
+                    try:
+                        s.sendto(packet, (dst, port))
+                        delivered[id(vm)].add(dst)
+                    except OSError as e:
+                        errors[id(vm)] = f"{dst}: {e}"
+    sent_at = time.monotonic()
 
-    logger.info(f"WOL sent to MAC={mac}, dst={broadcast_ip}:{port}")
+    pending = []
+    for vm, _, dests in plan:
+        ok_dests = [d for d in dests if d in delivered[id(vm)]]
+        sent = bool(ok_dests)
+        metrics.POWER_ACTIONS.inc(action="wol", result="ok" if sent else "error")
+        if sent:
+            logger.info(f"WOL sent to MAC={vm.mac}, dst={','.join(ok_dests)}:{port} x{max(1, repeat)}")
+        else:
+            logger.error(f"WOL failed for MAC={vm.mac}: {errors.get(id(vm))}")
+        res = WakeResult(vm.vm_name, vm.mac, sent, ok_dests,
+                         message="Magic Packet sent" if sent else errors.get(id(vm), "send failed"))
+        if wait and sent:
+            pending.append((vm, res))
+        else:
+            yield res
+
+    if pending:
+        yield from _wait_alive(pending, sent_at, timeout, poll_interval, prober or vm_info.default_prober)
+
+
+def _wait_alive(pending: list, sent_at: float, timeout: float, poll_interval: float,
+                prober: vm_info.LivenessProber) -> Iterator[WakeResult]:
+    """起動したホストから順に返す。ARPは毎回取り直して、起動後に変わったIPも拾う"""
+    deadline = sent_at + timeout
+    while pending:
+        vm_info.arp_table.refresh()
+        by_ip: Dict[str, list] = {}
+        for vm, res in pending:
+            ip = vm_info.get_ip_from_mac(vm.mac) or vm.host_ip or None
+            if ip:
+                by_ip.setdefault(ip, []).append((vm, res))
+        up = set()
+        for ip, rtt in prober.probe_iter(by_ip):
+            if rtt is None:
+                continue
+            for vm, res in by_ip[ip]:
+                res.alive, res.ip = True, ip
+                res.time_to_alive = time.monotonic() - sent_at
+                res.message = f"Alive after {res.time_to_alive:.1f}s"
+                up.add(id(vm))
+                yield res
+        pending = [(vm, res) for vm, res in pending if id(vm) not in up]
+        remaining = deadline - time.monotonic()
+        if not pending or remaining <= 0:
+            break
+        time.sleep(min(poll_interval, remaining))
+    for vm, res in pending:
+        res.alive = False
+        res.message = f"No reply within {timeout:.0f}s"
+        yield res
 
 
 # ---------- 汎用 SSH クライアント ----------
 class SshClient:
     """SSHで任意のコマンドを実行して電源制御などを行う"""
     def __init__(self, host: str, user: str, password: str,
-                 port: int = 22, timeout: int = 10):
+                 port: int = 22, timeout: int = 10,
+                 pool: Optional[ConnectionPool] = None):
         self.host = host
         self.user = user
         self.password = password
         self.port = port
         self.timeout = timeout
+        self.pool = pool
         self.client: Optional[paramiko.SSHClient] = None
+        self._lease = None
+
+    def _connect(self) -> paramiko.SSHClient:
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        with metrics.REMOTE_CONNECT.time(method="SSH"):
+            client.connect(
+                hostname=self.host,
+                port=self.port,
+                username=self.user,
+                password=self.password,
+                timeout=self.timeout,
+                look_for_keys=False,
+                allow_agent=False,
+            )
+        transport = client.get_transport()
+        if transport:
+            transport.set_keepalive(SSH_KEEPALIVE)
+        return client
+
+    @staticmethod
+    def _is_active(client: paramiko.SSHClient) -> bool:
+        transport = client.get_transport()
+        return bool(transport and transport.is_active())
 
     def __enter__(self):
-        self.client = paramiko.SSHClient()
-        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.client.connect(
-            hostname=self.host,
-            port=self.port,
-            username=self.user,
-            password=self.password,
-            timeout=self.timeout,
-            look_for_keys=False,
-            allow_agent=False,
+        if self.pool is None:
+            self.client = self._connect()
+            return self
+        # プールに認証済みトランスポートがあればハンドシェイクを省略
+        self._lease = self.pool.connection(
+            ("SSH", self.host, self.user, self.port, credential_digest(self.password)),
+            self._connect,
+            is_alive=self._is_active,
+            close=lambda c: c.close(),
         )
+        self.client = self._lease.__enter__()
         return self
 
     def __exit__(self, exc_type, exc, tb):
+        if self._lease is not None:
+            lease, self._lease = self._lease, None
+            return lease.__exit__(exc_type, exc, tb)
         if self.client:
             self.client.close()
 
+    def _exec(self, cmd: str):
+        try:
+            return self.client.exec_command(cmd)
+        except (paramiko.SSHException, EOFError, OSError) as e:
+            if self._lease is None:
+                raise
+            # プール上の接続が切れていた場合は張り直して1回だけ再試行
+            logger.info(f"SSH {self.host}: pooled session lost, reconnecting ({e})")
+            self.pool.invalidate(self.client)
+            self._lease.__exit__(None, None, None)
+            self.__enter__()
+            return self.client.exec_command(cmd)
+
+    def stream(self, cmd: str, timeout: Optional[float] = None,
+               cancel: Optional[threading.Event] = None) -> Iterator[Tuple[str, Any]]:
+        """
+        コマンドを実行し、出力を届いた順に yield する
+        ("stdout", text) / ("stderr", text) を交互に返し、最後に ("exit", rc) を返す
+        stdout と stderr を同時に読むため、片方のパイプが詰まって止まることがない
+        timeout 秒を超えたら TimeoutError、cancel がセットされたら中断する
+        """
+        assert self.client
+        logger.debug(f"SSH {self.host} $ {cmd}")
+        start = time.perf_counter()
+        stdin, stdout, stderr = self._exec(cmd)
+        chan = stdout.channel
+        stdin.close()
+        decoders = {"stdout": codecs.getincrementaldecoder("utf-8")(errors="replace"),
+                    "stderr": codecs.getincrementaldecoder("utf-8")(errors="replace")}
+        readers = (("stdout", chan.recv_ready, chan.recv), ("stderr", chan.recv_stderr_ready, chan.recv_stderr))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while True:
+                got = False
+                for name, ready, recv in readers:
+                    if ready():
+                        data = recv(EXEC_CHUNK_SIZE)
+                        if data:
+                            got = True
+                            text = decoders[name].decode(data)
+                            if text:
+                                yield name, text
+                if got:
+                    continue
+                if chan.exit_status_ready() and not chan.recv_ready() and not chan.recv_stderr_ready():
+                    break
+                if cancel is not None and cancel.is_set():
+                    raise InterruptedError("Cancelled")
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"No exit status within {timeout:.0f}s")
+                # 出力か終了が届くまで待つ（stdout / stderr どちらのデータでも起こされる）
+                select.select([chan], [], [], EXEC_POLL_INTERVAL)
+            for name, dec in decoders.items():
+                tail = dec.decode(b"", final=True)
+                if tail:
+                    yield name, tail
+            rc = chan.recv_exit_status()
+        finally:
+            chan.close()
+            metrics.REMOTE_EXEC.observe(time.perf_counter() - start, method="SSH")
+        yield "exit", rc
+
     def run(self, cmd: str) -> Tuple[int, str, str]:
         """任意コマンド実行"""
-        assert self.client
-        logger.info(f"SSH {self.host} $ {cmd}")
-        stdin, stdout, stderr = self.client.exec_command(cmd)
-        out = stdout.read().decode("utf-8", errors="ignore")
-        err = stderr.read().decode("utf-8", errors="ignore")
-        rc = stdout.channel.recv_exit_status()
+        out: List[str] = []
+        err: List[str] = []
+        rc = -1
+        for name, data in self.stream(cmd):
+            if name == "stdout":
+                out.append(data)
+            elif name == "stderr":
+                err.append(data)
+            else:
+                rc = data
+        out_s, err_s = "".join(out).strip(), "".join(err).strip()
         if rc != 0:
-            logger.error(f"SSH failed rc={rc}, err={err.strip()}")
-        return rc, out.strip(), err.strip()
+            logger.error(f"SSH failed rc={rc}, err={err_s}")
+        return rc, out_s, err_s
 
     def power_action(self, action: str) -> Tuple[bool, str]:
         """
@@ -90,6 +363,9 @@ class SshClient:
             return False, msg
 
         rc, out, err = self.run(cmd)
+        if self.pool is not None and self.client is not None:
+            # 停止・再起動後の接続は使えないので返却時に破棄する
+            self.pool.invalidate(self.client)
         ok = (rc == 0)
         msg = out or err or ("OK" if ok else "NG")
         if ok:
@@ -101,22 +377,35 @@ class SshClient:
 # ---------- WinRMクライアント (Windows) ----------
 class WinRMClient:
     """WinRM経由でWindowsを制御"""
-    def __init__(self, host: str, user: str, password: str):
+    def __init__(self, host: str, user: str, password: str,
+                 pool: Optional[ConnectionPool] = None):
         self.host = host
         self.user = user
         self.password = password
+        self.pool = pool
 
-    def run(self, ps_script: str) -> Tuple[int, str]:
-        """PowerShellスクリプトを実行"""
-        logger.info(f"[WinRM {self.host}] exec: {ps_script}")
-        try:
-            session = winrm.Session(
+    def _session(self) -> winrm.Session:
+        with metrics.REMOTE_CONNECT.time(method="WinRM"):
+            return winrm.Session(
                 self.host,
                 auth=(self.user, self.password),
                 transport='basic',
                 server_cert_validation='ignore'
             )
-            result = session.run_ps(ps_script)
+
+    def run(self, ps_script: str) -> Tuple[int, str]:
+        """PowerShellスクリプトを実行"""
+        logger.info(f"[WinRM {self.host}] exec: {ps_script}")
+        try:
+            if self.pool is None:
+                session = self._session()
+                with metrics.REMOTE_EXEC.time(method="WinRM"):
+                    result = session.run_ps(ps_script)
+            else:
+                key = ("WINRM", self.host, self.user, WINRM_PORT, credential_digest(self.password))
+                with self.pool.connection(key, self._session) as session:
+                    with metrics.REMOTE_EXEC.time(method="WinRM"):
+                        result = session.run_ps(ps_script)
             return result.status_code, result.std_out.decode("utf-8", errors="ignore")
         except Exception as e:
             logger.error(f"WinRM error: {e}")
@@ -136,16 +425,444 @@ class WinRMClient:
         logger.info(f"[WinRM {self.host}] {action} -> {msg}")
         return ok, msg
     
+# ---------- ESXi ハイパーバイザー ----------
+# ゲスト一覧の取得（vmid と Name、続けて vmid ごとのMAC）
+_ESXI_IDS = "vim-cmd vmsvc/getallvms | awk 'NR>1 && $1 ~ /^[0-9]+$/ {print $1}'"
+ESXI_INVENTORY_CMD = (
+    "vim-cmd vmsvc/getallvms; echo '#MACS'; "
+    f"for id in $({_ESXI_IDS}); do "
+    "vim-cmd vmsvc/device.getdevices $id | sed -n \"s/.*macAddress = \\\"\\(.*\\)\\\".*/$id \\1/p\"; done"
+)
+# 全ゲストの電源状態（1回のSSH実行で取得）
+ESXI_STATES_CMD = (
+    f"for id in $({_ESXI_IDS}); do "
+    "echo \"$id $(vim-cmd vmsvc/power.getstate $id | tail -n 1)\"; done"
+)
+ESXI_POWER_CMDS = {
+    "on": "power.on",
+    "wol": "power.on",         # ゲストへのWOL要求はハイパーバイザー経由の電源ONとして扱う
+    "off": "power.shutdown",   # VMware Tools によるゲストOSのシャットダウン
+    "reboot": "power.reboot",
+    "poweroff": "power.off",   # 強制停止
+    "reset": "power.reset",
+}
+ESXI_STATE_MAP = {"powered on": "稼働中", "powered off": "停止中", "suspended": "停止中"}
+ESXI_INVENTORY_TTL = 300.0  # ゲスト一覧（vmid・MAC）のキャッシュ時間（秒）
+
+_GETALLVMS_LINE = re.compile(r"^(\d+)\s+(.+?)\s+\[[^\]]*\]")
+
+
+def parse_esxi_inventory(text: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """ESXI_INVENTORY_CMD の出力を ({vmid: name}, {mac: vmid}) にする"""
+    names: Dict[str, str] = {}
+    macs: Dict[str, str] = {}
+    section = "vms"
+    for line in text.splitlines():
+        line = line.strip()
+        if line == "#MACS":
+            section = "macs"
+            continue
+        if section == "vms":
+            m = _GETALLVMS_LINE.match(line)
+            if m:
+                names[m.group(1)] = m.group(2)
+        else:
+            parts = line.split()
+            if len(parts) == 2 and parts[0].isdigit():
+                macs[vm_info.normalize_mac(parts[1])] = parts[0]
+    return names, macs
+
+
+def parse_esxi_states(text: str) -> Dict[str, str]:
+    """ESXI_STATES_CMD の出力を {vmid: "稼働中" / "停止中" / "不明"} にする"""
+    states: Dict[str, str] = {}
+    for line in text.splitlines():
+        vmid, _, state = line.strip().partition(" ")
+        if vmid.isdigit():
+            states[vmid] = ESXI_STATE_MAP.get(state.strip().lower(), "不明")
+    return states
+
+
+class EsxiHost:
+    """
+    ESXi ホストへのSSH（プール済みセッション）で vim-cmd を実行し、
+    ホスト上の全ゲストの電源状態取得・電源操作を行う
+    ゲストは MAC（なければ名前）で ESXi 側の vmid に対応付ける
+    """
+    def __init__(self, host: str, user: str, password: str, port: int = 22,
+                 pool: Optional[ConnectionPool] = None,
+                 inventory_ttl: float = ESXI_INVENTORY_TTL):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.port = port
+        self.pool = connection_pool if pool is None else pool
+        self.inventory_ttl = inventory_ttl
+        self._names: Dict[str, str] = {}
+        self._macs: Dict[str, str] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _run(self, cmd: str) -> str:
+        with SshClient(self.host, self.user, self.password, port=self.port, pool=self.pool) as cli:
+            rc, out, err = cli.run(cmd)
+        if rc != 0:
+            raise RuntimeError(f"{self.host}: {err or out or f'rc={rc}'}")
+        return out
+
+    def refresh_inventory(self, force: bool = False) -> None:
+        with self._lock:
+            fresh = (self._loaded_at is not None
+                     and time.monotonic() - self._loaded_at < self.inventory_ttl)
+            if fresh and not force:
+                return
+            self._names, self._macs = parse_esxi_inventory(self._run(ESXI_INVENTORY_CMD))
+            self._loaded_at = time.monotonic()
+
+    def vmid_for(self, guest: Any) -> Optional[str]:
+        """ゲストに対応する vmid（見つからなければ一覧を取り直して再検索）"""
+        for force in (False, True):
+            self.refresh_inventory(force)
+            vmid = self._macs.get(vm_info.normalize_mac(guest.mac))
+            if vmid is None:
+                vmid = next((i for i, n in self._names.items() if n == guest.vm_name), None)
+            if vmid is not None:
+                return vmid
+        return None
+
+    def guest_states(self, guests: Iterable[Any]) -> Dict[str, str]:
+        """{mac: status} を1回の問い合わせで返す（ESXi 側に見つからないゲストは含めない）"""
+        guests = list(guests)
+        self.refresh_inventory()
+        states = parse_esxi_states(self._run(ESXI_STATES_CMD))
+        out: Dict[str, str] = {}
+        for guest in guests:
+            vmid = self._macs.get(vm_info.normalize_mac(guest.mac))
+            if vmid is None:
+                vmid = next((i for i, n in self._names.items() if n == guest.vm_name), None)
+            if vmid in states:
+                out[guest.mac] = states[vmid]
+        return out
+
+    def power(self, guest: Any, action: str) -> Tuple[bool, str]:
+        op = ESXI_POWER_CMDS.get(action)
+        if op is None:
+            return False, f"Unsupported action: {action}"
+        vmid = self.vmid_for(guest)
+        if vmid is None:
+            return False, f"{guest.vm_name} not found on {self.host}"
+        with SshClient(self.host, self.user, self.password, port=self.port, pool=self.pool) as cli:
+            rc, out, err = cli.run(f"vim-cmd vmsvc/{op} {vmid}")
+        ok = rc == 0
+        msg = out or err or ("OK" if ok else "NG")
+        logger.info(f"[ESXi {self.host}] {op} {guest.vm_name} (vmid={vmid}) -> {msg}")
+        return ok, msg
+
+
+class HypervisorUnavailable(ConnectionError):
+    """ホストのパスワードがない・ホストへ接続できない（ゲストへ直接つなげば操作できる場合がある）"""
+
+
+class HypervisorBackend:
+    """
+    runs_on でハイパーバイザー（SSH で入れる ESXi）を指しているゲストを、
+    ホスト側から一括で状態取得・電源操作する
+    vm_source: 現在のVM一覧を返す関数
+    password_for: ホストVMのパスワードを返す関数（None なら使わない）
+    """
+    def __init__(self, vm_source: Callable[[], Iterable[Any]],
+                 password_for: Callable[[Any], Optional[str]],
+                 pool: Optional[ConnectionPool] = None, port: int = 22):
+        self.vm_source = vm_source
+        self.password_for = password_for
+        self.pool = pool
+        self.port = port
+        self._hosts: Dict[Tuple[str, str], EsxiHost] = {}
+        self._lock = threading.Lock()
+
+    def host_vm(self, guest: Any) -> Optional[Any]:
+        name = getattr(guest, "runs_on", "") or ""
+        if not name or guest.type != "virtual":
+            return None
+        host = next((vm for vm in self.vm_source() if vm.vm_name == name), None)
+        if host is None or not host.host_ip or host.method.upper() != "SSH":
+            return None
+        return host
+
+    def manages(self, guest: Any) -> bool:
+        return self.host_vm(guest) is not None
+
+    def _client(self, host: Any) -> Optional[EsxiHost]:
+        password = self.password_for(host)
+        if not password:
+            return None
+        key = (host.host_ip, host.user)
+        with self._lock:
+            cli = self._hosts.get(key)
+            if cli is None or cli.password != password:
+                cli = self._hosts[key] = EsxiHost(host.host_ip, host.user, password,
+                                                  port=self.port, pool=self.pool)
+        return cli
+
+    def guest_states(self, guests: Iterable[Any]) -> Dict[str, str]:
+        """
+        {mac: status}。ホストごとに1回の問い合わせで取得する
+        ホストに届かない・パスワードがない場合は含めない（呼び出し側で通常の確認に回す）
+        """
+        by_host: Dict[str, Tuple[Any, list]] = {}
+        for guest in guests:
+            host = self.host_vm(guest)
+            if host is not None:
+                by_host.setdefault(host.vm_name, (host, []))[1].append(guest)
+        jobs = [(host, cli, members) for host, members in by_host.values()
+                if (cli := self._client(host)) is not None]
+        out: Dict[str, str] = {}
+        if not jobs:
+            return out
+        # ホストごとに1回、複数ホストは並列に問い合わせる
+        with ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="hypervisor") as pool:
+            futures = {pool.submit(cli.guest_states, members): host for host, cli, members in jobs}
+            for fut in as_completed(futures):
+                try:
+                    out.update(fut.result())
+                except Exception as e:
+                    logger.warning(f"Hypervisor {futures[fut].vm_name} status failed: {e}")
+        return out
+
+    def power(self, guest: Any, action: str) -> Tuple[bool, str]:
+        host = self.host_vm(guest)
+        if host is None:
+            return False, f"{guest.vm_name} has no hypervisor"
+        cli = self._client(host)
+        if cli is None:
+            raise HypervisorUnavailable(f"Password required for hypervisor {host.vm_name}")
+        try:
+            return cli.power(guest, action)
+        except (OSError, EOFError, paramiko.SSHException) as e:
+            raise HypervisorUnavailable(f"Hypervisor {host.vm_name} unreachable: {e}") from e
+
+    def start_guest(self, guest: Any, host: Optional[Any] = None) -> Tuple[bool, str]:
+        """PowerOrchestrator の guest_starter として使う"""
+        try:
+            return self.power(guest, "on")
+        except HypervisorUnavailable as e:
+            return False, str(e)
+
+    def stop_guest(self, guest: Any, host: Optional[Any] = None,
+                   password: Optional[str] = None) -> Tuple[bool, str]:
+        """
+        PowerOrchestrator の guest_stopper として使う
+        ホスト経由で停止し、ホストが使えなければゲストのパスワードで直接停止する
+        """
+        return power_action_vm(guest, "off", password, self)
+
+
 # ---------- Unified Controller ----------
 def power_action_unified(method: str, host: str, user: str, password: str, action: str) -> Tuple[bool, str]:
     """methodに応じてSSH or WinRMを自動選択"""
+    try:
+        ok, msg = _power_action_unified(method, host, user, password, action)
+    except Exception:
+        metrics.POWER_ACTIONS.inc(action=action, result="error")
+        raise
+    metrics.POWER_ACTIONS.inc(action=action, result="ok" if ok else "fail")
+    return ok, msg
+
+
+def _power_action_unified(method: str, host: str, user: str, password: str, action: str) -> Tuple[bool, str]:
     if method.upper() == "SSH":
-        with SshClient(host, user, password) as cli:
+        with SshClient(host, user, password, pool=connection_pool) as cli:
             return cli.power_action(action)
     elif method.upper() in ("API", "WINRM"):  # API=WinRMとする
-        client = WinRMClient(host, user, password)
+        client = WinRMClient(host, user, password, pool=connection_pool)
         return client.power_action(action)
     else:
         msg = f"Unsupported method: {method}"
         logger.error(msg)
-        return False, msg
\ No newline at end of file
+        return False, msg
+
+
+# ---------- 一括電源操作 ----------
+BATCH_MAX_WORKERS = 16
+
+
+@dataclass
+class PowerResult:
+    vm_name: str
+    mac: str
+    action: str
+    ok: bool
+    message: str
+    elapsed: float  # 秒
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def power_action_vm(vm: Any, action: str, password: Optional[str],
+                    hypervisor: Optional[HypervisorBackend] = None) -> Tuple[bool, str]:
+    """
+    VM 1台に対して電源操作（wol はマジックパケット、それ以外は SSH/WinRM）
+    hypervisor が扱えるゲストはハイパーバイザー経由で操作する（wol は電源ON）
+    ホストのパスワードが無い・ホストへ接続できない場合は、ゲストのIPとパスワードが
+    分かっていればゲストへ直接 SSH/WinRM する（電源ONはゲスト側からはできない）
+    """
+    if hypervisor is not None and hypervisor.manages(vm):
+        try:
+            ok, msg = hypervisor.power(vm, action)
+        except HypervisorUnavailable as e:
+            if action in ("on", "wol") or not vm.host_ip:
+                metrics.POWER_ACTIONS.inc(action=action, result="fail")
+                return False, str(e)
+            if not password:
+                # ゲストのパスワードがあれば直接操作できるので、入力を促す
+                metrics.POWER_ACTIONS.inc(action=action, result="fail")
+                return False, "Password required"
+            logger.warning(f"{vm.vm_name}: {e}; falling back to {vm.method} on the guest")
+            return power_action_unified(vm.method, vm.host_ip, vm.user, password, action)
+        except Exception:
+            metrics.POWER_ACTIONS.inc(action=action, result="error")
+            raise
+        metrics.POWER_ACTIONS.inc(action=action, result="ok" if ok else "fail")
+        return ok, msg
+    if action == "wol":
+        if vm.type != "physical":
+            return False, "WOL only for physical machines"
+        send_magic_packet(vm.mac)
+        return True, "Magic Packet sent"
+    if not vm.host_ip:
+        return False, "IP unknown"
+    if not password:
+        return False, "Password required"
+    return power_action_unified(vm.method, vm.host_ip, vm.user, password, action)
+
+
+def power_action_batch(vms: Iterable[Any], action: str,
+                       password_for: Callable[[Any], Optional[str]] = lambda vm: None,
+                       max_workers: int = BATCH_MAX_WORKERS,
+                       hypervisor: Optional[HypervisorBackend] = None) -> Iterator[PowerResult]:
+    """
+    複数VMへ同じ電源操作を並列に実行する
+    password_for: VMごとのパスワード取得関数
+    hypervisor: 指定時はハイパーバイザー上のゲストをホスト経由で操作する
+    戻り値: 完了した順に PowerResult を yield する
+    """
+    targets = list(vms)
+    if not targets:
+        return
+
+    def run(vm: Any) -> PowerResult:
+        start = time.monotonic()
+        try:
+            password = password_for(vm) if action != "wol" else None
+            ok, msg = power_action_vm(vm, action, password, hypervisor)
+        except Exception as e:
+            logger.error(f"Power {action} error on {vm.vm_name}: {e}")
+            ok, msg = False, str(e)
+        return PowerResult(vm.vm_name, vm.mac, action, ok, msg, time.monotonic() - start)
+
+    workers = max(1, min(max_workers, len(targets)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="power") as pool:
+        futures = [pool.submit(run, vm) for vm in targets]
+        for fut in as_completed(futures):
+            yield fut.result()
+
+
+# ---------- 複数ホストへのコマンド実行 ----------
+EXEC_MAX_WORKERS = 16
+EXEC_TIMEOUT = 3600.0  # 1ホストあたりの上限（dnf update など長いコマンドを想定）
+EXEC_QUEUE_SIZE = 256  # 読み手に渡していない出力の上限（超えたら各ホストの読み取りを止める）
+
+
+@dataclass
+class ExecChunk:
+    """
+    コマンド出力の断片
+    stream: stdout / stderr / exit（rc に終了コード） / error（接続失敗など）
+    """
+    vm_name: str
+    mac: str
+    stream: str
+    data: str = ""
+    rc: Optional[int] = None
+    elapsed: float = 0.0
+
+    @property
+    def final(self) -> bool:
+        return self.stream in ("exit", "error")
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def run_command_batch(vms: Iterable[Any], cmd: str,
+                      password_for: Callable[[Any], Optional[str]] = lambda vm: None,
+                      max_workers: int = EXEC_MAX_WORKERS,
+                      timeout: Optional[float] = EXEC_TIMEOUT,
+                      pool: Optional[ConnectionPool] = None,
+                      port: int = 22,
+                      cancel: Optional[threading.Event] = None,
+                      queue_size: int = EXEC_QUEUE_SIZE) -> Iterator[ExecChunk]:
+    """
+    複数VMで同じコマンドを並列に実行し、各ホストの出力を届いた順に ExecChunk で yield する
+    ホストごとに最後は exit か error の断片が1つ届く（SSH のみ対応）
+    途中で読むのをやめる（ジェネレータを閉じる）か cancel をセットすると実行中のコマンドは中断する
+    読み手が遅い場合は queue_size 個たまった所で各ホストからの読み取りを止める（出力をため込まない）
+    """
+    targets = list(vms)
+    if not targets:
+        return
+    out: "queue.Queue[ExecChunk]" = queue.Queue(maxsize=queue_size)
+    cancel = cancel or threading.Event()
+
+    def run(vm: Any) -> None:
+        start = time.monotonic()
+
+        def put(stream: str, data: str = "", rc: Optional[int] = None) -> None:
+            chunk = ExecChunk(vm.vm_name, vm.mac, stream, data, rc, time.monotonic() - start)
+            while not cancel.is_set():
+                try:
+                    out.put(chunk, timeout=EXEC_POLL_INTERVAL)
+                    return
+                except queue.Full:
+                    continue
+
+        try:
+            if vm.method.upper() != "SSH":
+                return put("error", "SSH only")
+            if not vm.host_ip:
+                return put("error", "IP unknown")
+            password = password_for(vm)
+            if not password:
+                return put("error", "Password required")
+            with SshClient(vm.host_ip, vm.user, password, port=port,
+                           pool=connection_pool if pool is None else pool) as cli:
+                for stream, data in cli.stream(cmd, timeout=timeout, cancel=cancel):
+                    if stream == "exit":
+                        put("exit", rc=data)
+                    else:
+                        put(stream, data)
+        except Exception as e:
+            if not cancel.is_set():
+                logger.error(f"Exec error on {vm.vm_name}: {e}")
+            put("error", str(e) or type(e).__name__)
+
+    workers = max(1, min(max_workers, len(targets)))
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="exec")
+    try:
+        for vm in targets:
+            executor.submit(run, vm)
+        remaining = len(targets)
+        while remaining:
+            try:
+                chunk = out.get(timeout=EXEC_POLL_INTERVAL)
+            except queue.Empty:
+                if cancel.is_set():
+                    return
+                continue
+            if chunk.final:
+                remaining -= 1
+            yield chunk
+    finally:
+        cancel.set()
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -1,12 +1,27 @@
 from __future__ import annotations
-from dataclasses import dataclass, asdict
-from typing import List
+from dataclasses import dataclass, asdict, field, replace
+from types import MappingProxyType
+from typing import Dict, Hashable, Iterable, List, Mapping, Optional, Tuple, Union
 import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
 from pathlib import Path
+from .logger import get_logger
+
+logger = get_logger("homevm")
 
 # 既定のデータファイルパス（プロジェクト相対）
 DATA_DIR = Path(__file__).resolve().parent.parent / "data"
 DATA_FILE = DATA_DIR / "vmlist.json"
+DATA_DB = DATA_DIR / "vmlist.db"
+
+
+class InventoryCorruptError(ValueError):
+    """インベントリファイルが壊れていて、バックアップからも復旧できない"""
 
 @dataclass
 class VM:
@@ -16,6 +31,7 @@ class VM:
     method: str # "SSH" or "WinRM"
     user: str
     type: str = "virtual" # "virtual" or "physical"
+    runs_on: str = "" # 稼働先ハイパーバイザーの vm_name（ゲストの場合）
 
     @staticmethod
     def from_dict(d: dict) -> "VM":
@@ -26,6 +42,7 @@ class VM:
             method = d.get("method", ""),
             user = d.get("user", ""),
             type = d.get("type", "virtual"),
+            runs_on = d.get("runs_on") or "",
         )
     
     def to_dict(self) -> dict:
@@ -38,30 +55,420 @@ def ensure_data_file(path: Path = DATA_FILE) -> None:
     if not path.exists():
         path.write_text("[]", encoding="utf-8")
 
+def _parse_vm_list(text: str) -> List[VM]:
+    vms = [VM.from_dict(x) for x in json.loads(text)]
+    # typeが空のものは自動補完
+    for vm in vms:
+        if not getattr(vm, "type", None):
+            vm.type = "virtual"
+    return vms
+
 def load_vm_list(path: Path = DATA_FILE) -> List[VM]:
-    """JSON から VM リストロード"""
+    """
+    JSON から VM リストロード
+    壊れていた場合は元ファイルを残したまま .bak から復旧する
+    （.bak も読めなければ InventoryCorruptError）
+    """
     ensure_data_file(path)
     try:
-        raw = json.loads(path.read_text(encoding="utf-8"))
-        vms = [VM.from_dict(x) for x in raw]
-
-        # typeが空のものは自動補完
-        for vm in vms:
-            if not getattr(vm, "type", None):
-                vm.type = "virtual"
-        return vms
+        return _parse_vm_list(path.read_text(encoding="utf-8"))
+    except Exception as e:
+        error = e
+    # 壊れたファイルは上書きせず退避しておく
+    corrupt = path.with_name(f"{path.name}.corrupt-{time.strftime('%Y%m%d%H%M%S')}")
+    try:
+        shutil.copy2(path, corrupt)
+    except OSError:
+        pass
+    bak = path.with_suffix(".json.bak")
+    try:
+        vms = _parse_vm_list(bak.read_text(encoding="utf-8"))
     except Exception:
-        # 壊れた場合はバックアップし、空配列で復旧
-        bak = path.with_suffix(".json.bak")
+        raise InventoryCorruptError(f"{path} is corrupted and no usable backup: {error}") from error
+    logger.error(f"{path} が壊れているため {bak} から復旧しました（退避先: {corrupt}）: {error}")
+    return vms
+
+def _atomic_write(path: Path, text: str) -> None:
+    """同じディレクトリの一時ファイルに書いてから置き換える（途中で落ちても元が残る）"""
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
         try:
-            path.replace(bak)
-        except Exception:
+            os.unlink(tmp)
+        except OSError:
             pass
-        path.write_text("[]", encoding="utf-8")
-        return []
-    
+        raise
+
 def save_vm_list(vms: List[VM], path: Path = DATA_FILE) -> None:
-    """VM リストを JSON に保存（整形して書き出し）"""
+    """VM リストを JSON に保存（整形して書き出し、直前の内容は .bak に残す）"""
     ensure_data_file(path)
     data = [vm.to_dict() for vm in vms]
-    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
\ No newline at end of file
+    # 読める内容のときだけ .bak を更新する（壊れた内容で正常なバックアップを潰さない）
+    try:
+        json.loads(path.read_text(encoding="utf-8"))
+        shutil.copy2(path, path.with_suffix(".json.bak"))
+    except (OSError, ValueError):
+        pass
+    _atomic_write(path, json.dumps(data, ensure_ascii=False, indent=2))
+
+
+# ---------- ストレージバックエンド ----------
+# どのバックエンドも load / save_all / upsert / upsert_many / delete / stamp を持つ
+# VMは vm_name で識別する（MACは重複登録があり得るため）
+
+class JsonStorage:
+    """vmlist.json をそのまま使う（書き込みは毎回全体をアトミックに置き換え）"""
+    def __init__(self, path: Path = DATA_FILE):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def load(self) -> List[VM]:
+        return load_vm_list(self.path)
+
+    def save_all(self, vms: List[VM]) -> None:
+        with self._lock:
+            save_vm_list(vms, self.path)
+
+    def upsert(self, vm: VM) -> None:
+        with self._lock:
+            vms = load_vm_list(self.path)
+            for i, cur in enumerate(vms):
+                if cur.vm_name == vm.vm_name:
+                    vms[i] = vm
+                    break
+            else:
+                vms.append(vm)
+            save_vm_list(vms, self.path)
+
+    def upsert_many(self, vms: List[VM]) -> None:
+        """複数VMの更新を1回の書き込みで反映する"""
+        with self._lock:
+            by_name = {vm.vm_name: vm for vm in vms}
+            cur = load_vm_list(self.path)
+            out = [by_name.pop(v.vm_name, v) for v in cur] + list(by_name.values())
+            save_vm_list(out, self.path)
+
+    def delete(self, vm_name: str) -> None:
+        with self._lock:
+            vms = load_vm_list(self.path)
+            save_vm_list([v for v in vms if v.vm_name != vm_name], self.path)
+
+    def stamp(self) -> Optional[Hashable]:
+        try:
+            st = self.path.stat()
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def import_json(self, path: Path) -> int:
+        vms = load_vm_list(Path(path))
+        self.save_all(vms)
+        return len(vms)
+
+    def export_json(self, path: Path) -> int:
+        vms = self.load()
+        save_vm_list(vms, Path(path))
+        return len(vms)
+
+
+class SqliteStorage:
+    """
+    SQLite (WALモード) に1VM=1行で保存する
+    追加・更新・削除は1行単位のトランザクションなので件数に依存しない
+    GUIとWebが別プロセスで同時に書き込んでも壊れない
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS vms (
+            vm_name TEXT PRIMARY KEY,
+            pos     INTEGER NOT NULL,
+            data    TEXT NOT NULL
+        )
+    """
+
+    def __init__(self, path: Path = DATA_DB, seed_json: Optional[Path] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        is_new = not self.path.exists()
+        self._conn = sqlite3.connect(str(self.path), timeout=5.0,
+                                     check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(self.SCHEMA)
+            empty = self._conn.execute("SELECT 1 FROM vms LIMIT 1").fetchone() is None
+        # 新規・空のDBにだけ既存の vmlist.json を取り込む
+        # （取り込みは全件の置き換えなので、DBに1件でもあれば JSON 側が新しくても触らない）
+        if (is_new or empty) and seed_json is not None and Path(seed_json).exists():
+            n = self.import_json(seed_json)
+            logger.info(f"Imported {n} VMs from {seed_json} into {self.path}")
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def load(self) -> List[VM]:
+        with self._lock:
+            rows = self._conn.execute("SELECT data FROM vms ORDER BY pos").fetchall()
+        return [VM.from_dict(json.loads(r[0])) for r in rows]
+
+    def save_all(self, vms: List[VM]) -> None:
+        rows = [(vm.vm_name, i, json.dumps(vm.to_dict(), ensure_ascii=False)) for i, vm in enumerate(vms)]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM vms")
+                self._conn.executemany("INSERT OR REPLACE INTO vms (vm_name, pos, data) VALUES (?, ?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def upsert(self, vm: VM) -> None:
+        data = json.dumps(vm.to_dict(), ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO vms (vm_name, pos, data) "
+                "VALUES (?, (SELECT COALESCE(MAX(pos), -1) + 1 FROM vms), ?) "
+                "ON CONFLICT(vm_name) DO UPDATE SET data = excluded.data",
+                (vm.vm_name, data),
+            )
+
+    def upsert_many(self, vms: List[VM]) -> None:
+        """複数VMの更新を1トランザクションで反映する"""
+        rows = [(vm.vm_name, json.dumps(vm.to_dict(), ensure_ascii=False)) for vm in vms]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO vms (vm_name, pos, data) "
+                    "VALUES (?, (SELECT COALESCE(MAX(pos), -1) + 1 FROM vms), ?) "
+                    "ON CONFLICT(vm_name) DO UPDATE SET data = excluded.data",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, vm_name: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM vms WHERE vm_name = ?", (vm_name,))
+
+    def stamp(self) -> Optional[Hashable]:
+        # 他の接続（別プロセス）がコミットした時だけ値が変わる
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def import_json(self, path: Path) -> int:
+        vms = load_vm_list(Path(path))
+        self.save_all(vms)
+        return len(vms)
+
+    def export_json(self, path: Path) -> int:
+        vms = self.load()
+        save_vm_list(vms, Path(path))
+        return len(vms)
+
+
+Storage = Union[JsonStorage, SqliteStorage]
+
+def open_storage(path: Path) -> Storage:
+    """拡張子でバックエンドを選ぶ（.json → JSON、それ以外 → SQLite）"""
+    path = Path(path)
+    if path.suffix.lower() == ".json":
+        return JsonStorage(path)
+    return SqliteStorage(path)
+
+def default_storage() -> Storage:
+    """既定は data/vmlist.db（空の時だけ data/vmlist.json を取り込む）"""
+    return SqliteStorage(DATA_DB, seed_json=DATA_FILE)
+
+
+# ---------- インベントリリポジトリ ----------
+@dataclass(frozen=True)
+class InventorySnapshot:
+    """
+    ある時点のVM一覧と索引（読み取り専用）
+    build() で渡されたVMを複製して持つので、元のリストを書き換えても影響しない
+    VMを書き換えたい場合は copy_vms() で複製してから扱うこと
+    """
+    vms: Tuple[VM, ...] = ()
+    by_mac: Mapping[str, VM] = field(default_factory=lambda: MappingProxyType({}))
+    by_name: Mapping[str, VM] = field(default_factory=lambda: MappingProxyType({}))
+    by_ip: Mapping[str, VM] = field(default_factory=lambda: MappingProxyType({}))
+    revision: int = 0
+
+    @staticmethod
+    def build(vms: Iterable[VM], revision: int) -> "InventorySnapshot":
+        vms = [replace(vm) for vm in vms]
+        by_mac: Dict[str, VM] = {}
+        by_name: Dict[str, VM] = {}
+        by_ip: Dict[str, VM] = {}
+        for vm in vms:
+            # 重複時は先頭を優先（従来の線形探索と同じ結果）
+            by_mac.setdefault(vm.mac.lower(), vm)
+            by_name.setdefault(vm.vm_name, vm)
+            if vm.host_ip:
+                by_ip.setdefault(vm.host_ip, vm)
+        return InventorySnapshot(tuple(vms), MappingProxyType(by_mac), MappingProxyType(by_name),
+                                 MappingProxyType(by_ip), revision)
+
+    def get(self, mac: str) -> Optional[VM]:
+        return self.by_mac.get(mac.lower())
+
+    def find(self, key: str) -> Optional[VM]:
+        """MAC または VM名で検索"""
+        return self.get(key) or self.by_name.get(key)
+
+    def copy_vms(self) -> List[VM]:
+        return [replace(vm) for vm in self.vms]
+
+    def __len__(self) -> int:
+        return len(self.vms)
+
+
+class InventoryRepository:
+    """
+    インベントリを一度だけ読み込んでメモリ上に保持する
+    ストレージが変わった時（JSONなら mtime / サイズ）だけ読み直し、読み取りはスナップショットを返す
+    """
+    def __init__(self, storage: Union[Path, str, Storage] = DATA_FILE, check_interval: float = 1.0):
+        self.storage = open_storage(Path(storage)) if isinstance(storage, (str, Path)) else storage
+        self.check_interval = check_interval
+        self._snapshot = InventorySnapshot()
+        self._stamp: Optional[Hashable] = None
+        self._loaded = False
+        self._checked_at = 0.0
+        self._lock = threading.RLock()
+
+    @property
+    def path(self) -> Path:
+        return self.storage.path
+
+    def snapshot(self) -> InventorySnapshot:
+        """現在のスナップショット（ストレージが変わっていれば読み直す）"""
+        if self._loaded and time.monotonic() - self._checked_at < self.check_interval:
+            return self._snapshot
+        return self._refresh()
+
+    def _refresh(self) -> InventorySnapshot:
+        """
+        ストレージが変わっていれば読み直す
+        書き込み前は check_interval に関係なく確認する（古い一覧を元に書くと、他プロセスの変更が消えるため）
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            stamp = self.storage.stamp()
+            if not self._loaded or stamp is None or stamp != self._stamp:
+                self._publish(self.storage.load())
+            return self._snapshot
+
+    @property
+    def revision(self) -> int:
+        return self.snapshot().revision
+
+    def reload(self) -> InventorySnapshot:
+        with self._lock:
+            self._publish(self.storage.load())
+            return self._snapshot
+
+    def save(self, vms: List[VM]) -> InventorySnapshot:
+        """VM一覧を丸ごと保存してスナップショットを更新"""
+        with self._lock:
+            self.storage.save_all(vms)
+            self._publish(vms)
+            return self._snapshot
+
+    def save_changes(self, base: Iterable[VM], vms: List[VM]) -> InventorySnapshot:
+        """
+        base（読み込んだ時点の一覧）から vms への差分だけを保存する
+        変わった行は upsert、消した行は delete するので、その間に他（Webなど）が追加したVMは残る
+        """
+        before = {vm.vm_name: vm for vm in base}
+        after = {vm.vm_name: vm for vm in vms}
+        changed = [vm for name, vm in after.items() if before.get(name) != vm]
+        removed = {name for name in before if name not in after}
+        with self._lock:
+            snap = self._refresh()
+            if changed:
+                self.storage.upsert_many(changed)
+            for name in removed:
+                self.storage.delete(name)
+            if changed or removed:
+                updated = {vm.vm_name: vm for vm in changed}
+                out = [updated.pop(v.vm_name, v) for v in snap.vms if v.vm_name not in removed]
+                self._publish(out + list(updated.values()))
+            return self._snapshot
+
+    def add(self, vm: VM) -> bool:
+        """VMを追加（同名が既にあれば False）"""
+        with self._lock:
+            snap = self._refresh()
+            if vm.vm_name in snap.by_name:
+                return False
+            self.storage.upsert(vm)
+            self._publish(list(snap.vms) + [vm])
+            return True
+
+    def upsert(self, vm: VM) -> InventorySnapshot:
+        """同名のVMを置き換え（なければ追加）"""
+        with self._lock:
+            snap = self._refresh()
+            self.storage.upsert(vm)
+            vms = [vm if v.vm_name == vm.vm_name else v for v in snap.vms]
+            if vm.vm_name not in snap.by_name:
+                vms.append(vm)
+            self._publish(vms)
+            return self._snapshot
+
+    def update_ips(self, ips: Mapping[str, str]) -> List[VM]:
+        """{vm_name: host_ip} をまとめて反映し（保存は1回）、更新したVMを返す"""
+        with self._lock:
+            snap = self._refresh()
+            changed = [replace(snap.by_name[name], host_ip=ip) for name, ip in ips.items()
+                       if name in snap.by_name and snap.by_name[name].host_ip != ip]
+            if not changed:
+                return []
+            self.storage.upsert_many(changed)
+            by_name = {vm.vm_name: vm for vm in changed}
+            self._publish([by_name.get(v.vm_name, v) for v in snap.vms])
+            return changed
+
+    def remove(self, mac: str) -> int:
+        """MACが一致するVMを削除し、削除件数を返す"""
+        with self._lock:
+            snap = self._refresh()
+            gone = [v for v in snap.vms if v.mac.lower() == mac.lower()]
+            for vm in gone:
+                self.storage.delete(vm.vm_name)
+            if gone:
+                self._publish([v for v in snap.vms if v.mac.lower() != mac.lower()])
+            return len(gone)
+
+    def _publish(self, vms: List[VM]) -> None:
+        self._snapshot = InventorySnapshot.build(vms, self._snapshot.revision + 1)
+        self._stamp = self.storage.stamp()
+        self._loaded = True
+        self._checked_at = time.monotonic()
+
+
+_repositories: Dict[Path, InventoryRepository] = {}
+_repositories_lock = threading.Lock()
+
+def get_repository(path: Optional[Path] = None) -> InventoryRepository:
+    """
+    パスごとに共有されるリポジトリを返す
+    path 省略時は既定のストレージ（data/vmlist.db）
+    """
+    key = Path(path).resolve() if path is not None else DATA_DB
+    with _repositories_lock:
+        repo = _repositories.get(key)
+        if repo is None:
+            storage = default_storage() if path is None else open_storage(key)
+            repo = _repositories[key] = InventoryRepository(storage)
+        return repo
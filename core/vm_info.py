@@ -2,32 +2,121 @@ import subprocess
 import re
 import platform
 import ipaddress
-from typing import Optional, Tuple
+import errno
+import os
+import selectors
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from . import metrics
 from .logger import get_logger
 
 logger = get_logger("homevm")
 
-def get_ip_from_mac(mac: str) -> Optional[str]:
+
+# ---------- ARPテーブル ----------
+PROC_NET_ARP = Path("/proc/net/arp")
+ARP_TTL = 5.0
+
+_ARP_LINE = re.compile(r"(\d+\.\d+\.\d+\.\d+)\s+([\da-fA-F:-]{17})", re.I)
+_NULL_MAC = "00:00:00:00:00:00"
+
+
+def normalize_mac(mac: str) -> str:
+    """MACアドレスを小文字・コロン区切りに正規化"""
+    return mac.strip().lower().replace("-", ":")
+
+
+def parse_proc_arp(text: str) -> Dict[str, str]:
     """
-    ARPテーブルからMACに対応するIPを取得する
-    Windows/Linux対応
+    /proc/net/arp の内容を MAC→IP の辞書に変換する
+    未解決エントリ（Flags=0x0 / MAC全ゼロ）は除外
     """
-    mac = mac.lower()
-    cmd = ["arp", "-a"]
-    try:
-        output = subprocess.check_output(cmd, text=True, encoding="utf-8", errors="ignore")
-    except Exception as e:
-        logger.error(f"ARP取得失敗: {e}")
-        return None
+    table: Dict[str, str] = {}
+    for line in text.splitlines()[1:]:
+        cols = line.split()
+        if len(cols) < 4:
+            continue
+        ip, flags, mac = cols[0], cols[2], normalize_mac(cols[3])
+        if flags == "0x0" or mac == _NULL_MAC:
+            continue
+        table.setdefault(mac, ip)
+    return table
+
 
-    pattern = re.compile(r"(\d+\.\d+\.\d+\.\d+)\s+([\da-fA-F:-]{17})", re.I)
-    for line in output.splitlines():
-        m = pattern.search(line)
+def parse_arp_output(text: str) -> Dict[str, str]:
+    """`arp -a` の出力を MAC→IP の辞書に変換する（Windows/Linux対応）"""
+    table: Dict[str, str] = {}
+    for line in text.splitlines():
+        m = _ARP_LINE.search(line)
         if m:
-            ip, found_mac = m.group(1), m.group(2).lower().replace("-", ":")
-            if mac == found_mac:
-                return ip
-    return None
+            table.setdefault(normalize_mac(m.group(2)), m.group(1))
+    return table
+
+
+class ArpTable:
+    """
+    ARPテーブルのスナップショットを保持し、MAC→IPを引けるようにする
+    スナップショットは ttl 秒間再利用されるので、1回の監視サイクルで
+    読み込みは1回だけになる
+    """
+    def __init__(self, ttl: float = ARP_TTL, proc_path: Path = PROC_NET_ARP):
+        self.ttl = ttl
+        self.proc_path = proc_path
+        self._table: Dict[str, str] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _read(self) -> Dict[str, str]:
+        # Linuxはプロセスを起動せずカーネルのテーブルを直接読む
+        start = time.perf_counter()
+        try:
+            table = parse_proc_arp(self.proc_path.read_text(encoding="utf-8", errors="ignore"))
+            source = "proc"
+        except OSError:
+            try:
+                output = subprocess.check_output(["arp", "-a"], text=True, encoding="utf-8", errors="ignore")
+            except Exception as e:
+                logger.error(f"ARP取得失敗: {e}")
+                return {}
+            table = parse_arp_output(output)
+            source = "arp"
+        metrics.ARP_SECONDS.observe(time.perf_counter() - start, source=source)
+        metrics.ARP_ENTRIES.set(len(table))
+        return table
+
+    def snapshot(self, force: bool = False) -> Dict[str, str]:
+        """MAC→IP の辞書を返す（TTL切れ or force 時のみ再取得）"""
+        with self._lock:
+            now = time.monotonic()
+            if force or self._loaded_at is None or now - self._loaded_at >= self.ttl:
+                self._table = self._read()
+                self._loaded_at = now
+            return self._table
+
+    def refresh(self) -> Dict[str, str]:
+        """スナップショットを強制的に取り直す"""
+        return self.snapshot(force=True)
+
+    def lookup(self, mac: str) -> Optional[str]:
+        return self.snapshot().get(normalize_mac(mac))
+
+
+# プロセス全体で共有するARPテーブル
+arp_table = ArpTable()
+
+
+def get_ip_from_mac(mac: str, arp: Optional[ArpTable] = None) -> Optional[str]:
+    """
+    ARPテーブルからMACに対応するIPを取得する
+    Windows/Linux対応（共有スナップショットを参照）
+    """
+    return (arp or arp_table).lookup(mac)
 
 
 def is_host_alive(ip: str, timeout: int = 1) -> bool:
@@ -47,17 +136,436 @@ def is_host_alive(ip: str, timeout: int = 1) -> bool:
         return False
 
 
-def resolve_status(mac: str, last_ip: Optional[str]) -> Tuple[str, Optional[str]]:
+# ---------- ネイティブ生存確認 ----------
+PROBE_TIMEOUT = 1.0
+PROBE_TCP_PORTS = (22, 5985)   # SSH / WinRM
+PROBE_MAX_INFLIGHT = 256       # TCP判定で同時に開くホスト数の上限
+
+_ICMP_ECHO_REQUEST = 8
+_ICMP_ECHO_REPLY = 0
+# 接続拒否(RST)はホストが応答した証拠なので稼働中とみなす
+_TCP_ALIVE_ERRNOS = {0, errno.ECONNREFUSED}
+
+
+def _icmp_checksum(data: bytes) -> int:
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data) // 2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _icmp_echo(ident: int, seq: int) -> bytes:
+    payload = b"homevm" + struct.pack("!d", time.monotonic())
+    header = struct.pack("!BBHHH", _ICMP_ECHO_REQUEST, 0, 0, ident, seq)
+    csum = _icmp_checksum(header + payload)
+    return struct.pack("!BBHHH", _ICMP_ECHO_REQUEST, 0, csum, ident, seq) + payload
+
+
+def _parse_icmp_reply(data: bytes) -> Optional[int]:
+    """受信データが Echo Reply ならその seq を返す（それ以外は None）"""
+    # macOS等はIPヘッダ付きで返るので取り除く
+    if len(data) >= 20 and data[0] >> 4 == 4:
+        data = data[(data[0] & 0x0F) * 4:]
+    if len(data) < 8:
+        return None
+    icmp_type, _, _, _, seq = struct.unpack("!BBHHH", data[:8])
+    return seq if icmp_type == _ICMP_ECHO_REPLY else None
+
+
+def icmp_available() -> bool:
+    """非特権ICMPデータグラムソケットが使えるか（Linux: net.ipv4.ping_group_range）"""
+    try:
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP).close()
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+class LivenessProber:
+    """
+    プロセスを起動せずに複数ホストの生存確認をまとめて行う
+    - ICMPデータグラムソケットが使える場合: 1つのソケットから全ホストへEchoを送り、
+      selectors(epoll/select) で応答を集める
+    - 使えない場合: TCP 22/5985 への非同期接続で判定
+    ホストごとの直近RTT（秒）は rtt に記録される
+    host_metrics=False ならホスト別のRTTメトリクス（host ラベル）を付けない
+    （サブネット探索のようにインベントリ外のアドレスを大量に確認する場合、ラベルが際限なく増えるため）
+    """
+    def __init__(self, timeout: float = PROBE_TIMEOUT,
+                 tcp_ports: Tuple[int, ...] = PROBE_TCP_PORTS,
+                 use_icmp: Optional[bool] = None,
+                 max_inflight: int = PROBE_MAX_INFLIGHT,
+                 host_metrics: bool = True):
+        self.timeout = timeout
+        self.tcp_ports = tcp_ports
+        self.use_icmp = icmp_available() if use_icmp is None else use_icmp
+        self.max_inflight = max_inflight
+        self.host_metrics = host_metrics
+        self.rtt: Dict[str, Optional[float]] = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def probe_iter(self, ips: Iterable[str]) -> Iterator[Tuple[str, Optional[float]]]:
+        """
+        応答があったホストから順に (ip, rtt秒) を yield する
+        タイムアウトしたホストは最後に (ip, None) として返す
+        """
+        targets = list(dict.fromkeys(ips))
+        if not targets:
+            return
+        probe = self._probe_icmp if self.use_icmp else self._probe_tcp
+        for ip, rtt in probe(targets):
+            self.rtt[ip] = rtt
+            if rtt is None:
+                metrics.PROBE_TIMEOUTS.inc()
+                if self.host_metrics:
+                    metrics.PROBE_HOST_RTT.remove(host=ip)
+            else:
+                metrics.PROBE_RTT.observe(rtt)
+                if self.host_metrics:
+                    metrics.PROBE_HOST_RTT.set(rtt, host=ip)
+            yield ip, rtt
+
+    def probe_many(self, ips: Iterable[str]) -> Dict[str, Optional[float]]:
+        return dict(self.probe_iter(ips))
+
+    def retain(self, ips: Iterable[str]) -> None:
+        """ips 以外のホストの RTT 記録（とホスト別RTTメトリクス）を捨てる"""
+        keep = set(ips)
+        gone = [ip for ip in list(self.rtt) if ip not in keep]
+        for ip in gone:
+            self.rtt.pop(ip, None)
+            if self.host_metrics:
+                metrics.PROBE_HOST_RTT.remove(host=ip)
+
+    def is_alive(self, ip: str) -> bool:
+        return self.probe_many([ip]).get(ip) is not None
+
+    # --- ICMP ---
+    def _next_seq(self) -> int:
+        with self._lock:
+            self._seq = (self._seq + 1) & 0xFFFF
+            return self._seq
+
+    def _probe_icmp(self, targets: list) -> Iterator[Tuple[str, Optional[float]]]:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+        sock.setblocking(False)
+        sel = selectors.DefaultSelector()
+        sel.register(sock, selectors.EVENT_READ)
+        # データグラムソケットではIDをカーネルが書き換えるため、送信元IP+seqで照合する
+        pending: Dict[Tuple[str, int], float] = {}
+        try:
+            ident = os.getpid() & 0xFFFF
+            for ip in targets:
+                seq = self._next_seq()
+                try:
+                    sock.sendto(_icmp_echo(ident, seq), (ip, 0))
+                    pending[(ip, seq)] = time.monotonic()
+                except OSError as e:
+                    logger.debug(f"ICMP送信失敗 {ip}: {e}")
+            answered = set()
+            deadline = time.monotonic() + self.timeout
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not sel.select(remaining):
+                    break
+                while True:
+                    try:
+                        data, (src, _) = sock.recvfrom(1024)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except OSError:
+                        continue
+                    seq = _parse_icmp_reply(data)
+                    sent = pending.pop((src, seq), None) if seq is not None else None
+                    if sent is None:
+                        continue
+                    answered.add(src)
+                    yield src, time.monotonic() - sent
+            for ip in targets:
+                if ip not in answered:
+                    yield ip, None
+        finally:
+            sel.close()
+            sock.close()
+
+    # --- TCP ---
+    def _probe_tcp(self, targets: list) -> Iterator[Tuple[str, Optional[float]]]:
+        sel = selectors.DefaultSelector()
+        queue = list(reversed(targets))
+        open_socks: Dict[str, list] = {}
+        started: Dict[str, float] = {}
+
+        def close_host(ip: str) -> None:
+            for sk in open_socks.pop(ip, []):
+                sel.unregister(sk)
+                sk.close()
+            started.pop(ip, None)
+
+        def start_host(ip: str) -> bool:
+            started[ip] = time.monotonic()
+            socks = []
+            for port in self.tcp_ports:
+                sk = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sk.setblocking(False)
+                rc = sk.connect_ex((ip, port))
+                if rc in _TCP_ALIVE_ERRNOS:
+                    sk.close()
+                    for other in socks:
+                        sel.unregister(other)
+                        other.close()
+                    return True
+                if rc not in (errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN, getattr(errno, "WSAEWOULDBLOCK", -1)):
+                    sk.close()
+                    continue
+                sel.register(sk, selectors.EVENT_WRITE, ip)
+                socks.append(sk)
+            open_socks[ip] = socks
+            return False
+
+        try:
+            while queue or open_socks:
+                # 上限まで新しいホストへの接続を開始
+                while queue and len(open_socks) < self.max_inflight:
+                    ip = queue.pop()
+                    if start_host(ip):
+                        rtt = time.monotonic() - started.pop(ip)
+                        yield ip, rtt
+                    elif not open_socks.get(ip):
+                        close_host(ip)
+                        yield ip, None
+                if not open_socks:
+                    continue
+
+                now = time.monotonic()
+                oldest = min(started.values())
+                timeout = max(0.0, oldest + self.timeout - now)
+                for key, _ in sel.select(timeout):
+                    ip = key.data
+                    if ip not in open_socks:
+                        continue
+                    sk = key.fileobj
+                    err = sk.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if err in _TCP_ALIVE_ERRNOS:
+                        rtt = time.monotonic() - started[ip]
+                        close_host(ip)
+                        yield ip, rtt
+                        continue
+                    # このポートは失敗。他のポートが残っていれば待ち続ける
+                    sel.unregister(sk)
+                    sk.close()
+                    open_socks[ip].remove(sk)
+                    if not open_socks[ip]:
+                        close_host(ip)
+                        yield ip, None
+
+                now = time.monotonic()
+                for ip in [h for h, t0 in started.items() if now - t0 >= self.timeout]:
+                    close_host(ip)
+                    yield ip, None
+        finally:
+            for ip in list(open_socks):
+                close_host(ip)
+            sel.close()
+
+
+# 既定の生存確認バックエンド
+default_prober = LivenessProber()
+
+
+def resolve_status(mac: str, last_ip: Optional[str],
+                   arp: Optional[ArpTable] = None,
+                   prober: Optional[LivenessProber] = None) -> Tuple[str, Optional[str]]:
     """
     MACをキーに現在のIPと稼働状態を取得する
     戻り値: (status, new_ip)
     """
-    ip = get_ip_from_mac(mac) or last_ip
+    ip = get_ip_from_mac(mac, arp) or last_ip
     if not ip:
         return ("不明", None)
 
-    alive = is_host_alive(ip)
+    alive = (prober or default_prober).is_alive(ip)
     if alive:
         return ("稼働中", ip)
     else:
         return ("停止中", ip)
+
+
+# ---------- 一括ステータス取得 ----------
+SWEEP_MAX_WORKERS = 64
+
+def sweep_status(vms: Iterable[Any],
+                 max_workers: int = SWEEP_MAX_WORKERS,
+                 resolver: Optional[Callable[[str, Optional[str]], Tuple[str, Optional[str]]]] = None,
+                 prober: Optional[LivenessProber] = None,
+                 guest_status: Optional[Callable[[list], Dict[str, str]]] = None,
+                 ) -> Iterator[Tuple[Any, str, Optional[str]]]:
+    """
+    インベントリ全体の稼働状態を並列に確認する
+    vms: mac / host_ip 属性を持つオブジェクト（VMなど）
+    戻り値: (vm, status, new_ip) を確認が終わった順に yield する
+    既定では LivenessProber で全ホストをまとめて確認するため、全体の所要時間は
+    おおよそ1ホストのタイムアウトで済む
+    resolver を指定した場合はスレッドプール（max_workers 並列）で resolver を呼ぶ
+    guest_status: 対象一覧を受け取り {mac: status} を返す関数（ハイパーバイザーへの一括問い合わせ）
+                  ここで分かったVMは個別に確認せず、残りだけを確認する
+    """
+    targets = list(vms)
+    if not targets:
+        return
+    start = time.perf_counter()
+    try:
+        for vm, status, ip in _sweep(targets, max_workers, resolver, prober, guest_status):
+            metrics.SWEEP_HOSTS.inc(status=status)
+            yield vm, status, ip
+    finally:
+        metrics.SWEEP_SECONDS.observe(time.perf_counter() - start)
+
+
+def _sweep(targets: list, max_workers: int, resolver: Optional[Callable],
+           prober: Optional[LivenessProber],
+           guest_status: Optional[Callable[[list], Dict[str, str]]] = None
+           ) -> Iterator[Tuple[Any, str, Optional[str]]]:
+    # 1回のスイープにつきARPスナップショットは1回だけ取得する
+    arp_table.refresh()
+    if guest_status is not None:
+        try:
+            known = guest_status(targets)
+        except Exception as e:
+            logger.error(f"Guest status query failed: {e}")
+            known = {}
+        rest = []
+        for vm in targets:
+            status = known.get(vm.mac)
+            if status is None:
+                rest.append(vm)
+                continue
+            yield vm, status, get_ip_from_mac(vm.mac) or getattr(vm, "host_ip", None) or None
+        targets = rest
+        if not targets:
+            return
+    if resolver is not None:
+        yield from _sweep_with_resolver(targets, resolver, max_workers)
+        return
+
+    by_ip: Dict[str, list] = {}
+    for vm in targets:
+        ip = get_ip_from_mac(vm.mac) or getattr(vm, "host_ip", None) or None
+        if not ip:
+            yield vm, "不明", None
+            continue
+        by_ip.setdefault(ip, []).append(vm)
+
+    for ip, rtt in (prober or default_prober).probe_iter(by_ip):
+        status = "稼働中" if rtt is not None else "停止中"
+        for vm in by_ip[ip]:
+            yield vm, status, ip
+
+
+def _sweep_with_resolver(targets: list, resolver: Callable, max_workers: int
+                         ) -> Iterator[Tuple[Any, str, Optional[str]]]:
+    workers = max(1, min(max_workers, len(targets)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sweep") as pool:
+        futures = {
+            pool.submit(resolver, vm.mac, getattr(vm, "host_ip", None) or None): vm
+            for vm in targets
+        }
+        for fut in as_completed(futures):
+            vm = futures[fut]
+            try:
+                status, new_ip = fut.result()
+            except Exception as e:
+                logger.error(f"Status check failed ({vm.mac}): {e}")
+                continue
+            yield vm, status, new_ip
+
+
+# ---------- サブネット探索 ----------
+DISCOVERY_PREFIX = 24           # インベントリのIPから対象サブネットを決める時のプレフィックス長
+DISCOVERY_MAX_HOSTS = 4096      # 1回の探索で扱うアドレス数の上限
+DISCOVERY_TIMEOUT = 1.0
+DISCOVERY_TCP_PORTS = (22, 445, 3389, 5985)  # SSH / SMB / RDP / WinRM
+DISCOVERY_MAX_INFLIGHT = 128    # 同時に接続を試みるホスト数（ポート数分のソケットを使う）
+# 探索するサブネット（カンマ区切り）。未設定ならインベントリのIPから決める
+DISCOVERY_SUBNETS_ENV = "HOMEVM_SUBNETS"
+
+
+@dataclass
+class DiscoveryResult:
+    subnets: List[str]
+    scanned: int                 # 探索したアドレス数
+    alive: Dict[str, float]      # 応答したIP → RTT（秒）
+    updated: List[dict]          # IPが変わったVM {vm_name, mac, old_ip, new_ip}
+    matched: int                 # ARPで見つかったインベントリのVM数
+    candidates: List[dict]       # インベントリにないMAC {mac, ip, rtt}
+    elapsed: float
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def configured_subnets(vms: Iterable[Any] = (), prefix: int = DISCOVERY_PREFIX) -> List[str]:
+    """HOMEVM_SUBNETS の指定、なければインベントリの host_ip を含む /prefix の一覧"""
+    env = os.environ.get(DISCOVERY_SUBNETS_ENV, "")
+    nets = [n.strip() for n in env.split(",") if n.strip()]
+    if not nets:
+        for vm in vms:
+            ip = getattr(vm, "host_ip", "") or ""
+            try:
+                nets.append(str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False)))
+            except ValueError:
+                continue
+    return list(dict.fromkeys(nets))
+
+
+def _subnet_hosts(subnets: Iterable[str], limit: int) -> Tuple[List[str], List[ipaddress.IPv4Network]]:
+    nets = [ipaddress.ip_network(s, strict=False) for s in subnets]
+    hosts: List[str] = []
+    for net in nets:
+        if net.version != 4:
+            raise ValueError(f"IPv4 only: {net}")
+        if len(hosts) + net.num_addresses > limit:
+            raise ValueError(f"Too many addresses (limit {limit}): {net}")
+        hosts.extend(str(h) for h in (net.hosts() if net.num_addresses > 1 else [net.network_address]))
+    return list(dict.fromkeys(hosts)), nets
+
+
+def discover_subnets(subnets: Iterable[str], vms: Iterable[Any],
+                     prober: Optional[LivenessProber] = None,
+                     arp: Optional[ArpTable] = None,
+                     limit: int = DISCOVERY_MAX_HOSTS) -> DiscoveryResult:
+    """
+    サブネット内の全アドレスへ並列に接続を試みてARPキャッシュを埋め、
+    インベントリのMACと突き合わせる（インベントリ自体は変更しない）
+    ARPはOSがホストの応答から学習するので、ポートが閉じているホストも見つかる
+    """
+    start = time.monotonic()
+    hosts, nets = _subnet_hosts(subnets, limit)
+    prober = prober or LivenessProber(timeout=DISCOVERY_TIMEOUT, tcp_ports=DISCOVERY_TCP_PORTS,
+                                      max_inflight=DISCOVERY_MAX_INFLIGHT, host_metrics=False)
+    alive = {ip: rtt for ip, rtt in prober.probe_iter(hosts) if rtt is not None}
+
+    table = (arp or arp_table).refresh()
+    found = {mac: ip for mac, ip in table.items()
+             if any(ipaddress.ip_address(ip) in net for net in nets)}
+
+    known = set()
+    updated: List[dict] = []
+    for vm in vms:
+        mac = normalize_mac(vm.mac)
+        ip = found.get(mac)
+        if ip is None:
+            continue
+        known.add(mac)
+        if ip != (vm.host_ip or ""):
+            updated.append({"vm_name": vm.vm_name, "mac": vm.mac, "old_ip": vm.host_ip or "", "new_ip": ip})
+    candidates = [{"mac": mac, "ip": ip, "rtt": alive.get(ip)}
+                  for mac, ip in sorted(found.items(), key=lambda kv: ipaddress.ip_address(kv[1]))
+                  if mac not in known]
+    result = DiscoveryResult([str(n) for n in nets], len(hosts), alive, updated, len(known),
+                             candidates, time.monotonic() - start)
+    logger.info(f"Discovery {', '.join(result.subnets)}: {len(alive)}/{len(hosts)} answered, "
+                f"{len(updated)} IP changes, {len(candidates)} unknown MACs ({result.elapsed:.1f}s)")
+    return result
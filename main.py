@@ -4,25 +4,36 @@ import re
 import threading
 import time
 from pathlib import Path
-from typing import List, Dict, Optional, Tuple, Callable
+from typing import List, Dict, Iterable, Optional, Tuple, Callable
 
 
 import keyring
-from functools import partial
+from dataclasses import replace
 from datetime import datetime
 
-from core.vm_data import VM, load_vm_list, save_vm_list, DATA_FILE
-from core.vm_control import send_magic_packet, SshClient, power_action_unified
-from core.vm_info import resolve_status
+from core.vm_data import VM, get_repository, InventoryCorruptError
+from core.vm_control import (
+    power_action_vm, PowerResult, BATCH_MAX_WORKERS, wake_on_lan, HypervisorBackend,
+    ExecChunk, run_command_batch
+)
+from core.orchestrator import (
+    PowerOrchestrator, PlanResult, DependencyError, critical_path, STARTUP, SHUTDOWN
+)
+from core.monitor import StatusMonitor
+from core.status_service import connect_service
+from core.vm_info import DiscoveryResult, configured_subnets, discover_subnets
 from core.logger import get_logger
 
 from PyQt6 import QtWidgets, uic
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QDialog, QFormLayout, QLineEdit, QComboBox,
-    QDialogButtonBox, QMessageBox, QTableWidgetItem, QInputDialog
+    QDialogButtonBox, QMessageBox, QInputDialog, QPlainTextEdit, QVBoxLayout, QLabel
 )
-from PyQt6.QtCore import QMetaObject, Qt, QTimer, QSize
-from PyQt6.QtGui import QColor, QIcon
+from PyQt6.QtCore import (
+    Qt, QSize, QObject, QRunnable, QThreadPool, pyqtSignal,
+    QAbstractTableModel, QModelIndex, QSortFilterProxyModel
+)
+from PyQt6.QtGui import QColor
 
 
 
@@ -34,7 +45,7 @@ MAC_REGEX = re.compile(r"^[0-9A-Fa-f]{2}(:[0-9A-Fa-f]{2}){5}$")
 
 class AddVmDialog(QDialog):
     """VM登録ダイアログ"""
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, hosts: Iterable[str] = ()):
         super().__init__(parent)
         self.setWindowTitle("VM 追加")
         self.setMinimumWidth(360)
@@ -47,6 +58,9 @@ class AddVmDialog(QDialog):
         self.cb_type = QComboBox(self)
         self.cb_type.addItems(["virtual", "physical"])  # ← 種別選択を追加
         self.ed_user = QLineEdit(self)
+        self.cb_runs_on = QComboBox(self)  # ゲストが動いているハイパーバイザー
+        self.cb_runs_on.setEditable(True)
+        self.cb_runs_on.addItems([""] + list(hosts))
 
         form = QFormLayout(self)
         form.addRow("VM名", self.ed_vm_name)
@@ -55,6 +69,7 @@ class AddVmDialog(QDialog):
         form.addRow("方式", self.cb_method)
         form.addRow("ユーザー", self.ed_user)
         form.addRow("種別", self.cb_type)
+        form.addRow("稼働ホスト（任意）", self.cb_runs_on)
 
         #self.buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel, parent=self)
         self.buttons = QDialogButtonBox(
@@ -91,13 +106,413 @@ class AddVmDialog(QDialog):
             return
 
         vm_type = self.cb_type.currentText().strip()
-        self._vm = VM(vm_name=vm_name, host_ip=host_ip or "", mac=mac, method=method, user=user, type=vm_type)
+        runs_on = self.cb_runs_on.currentText().strip()
+        if runs_on == vm_name:
+            QMessageBox.warning(self, "入力エラー", "稼働ホストに自分自身は指定できません。")
+            return
+        self._vm = VM(vm_name=vm_name, host_ip=host_ip or "", mac=mac, method=method, user=user,
+                      type=vm_type, runs_on=runs_on)
         self.accept()
 
     def get_vm(self) -> VM | None:
         return self._vm
 
 
+# ---------- VM一覧テーブル（モデル/ビュー） ----------
+COLUMNS = ["VM名", "ホストIP", "MAC", "方式", "ユーザー", "種別", "状態", "最終更新", "稼働ホスト"]
+COL_IP, COL_STATUS, COL_UPDATED, COL_RUNS_ON = 1, 6, 7, 8
+
+STATUS_COLORS = {
+    "稼働中": QColor(166, 227, 161),  # Pastel Green
+    "停止中": QColor(243, 139, 168),  # Pastel Red
+}
+STATUS_COLOR_OTHER = QColor(249, 226, 175)  # Pastel Yellow
+STATUS_COLOR_BUSY = QColor(137, 180, 250)   # Pastel Blue（操作実行中）
+STATUS_TEXT_COLOR = QColor(30, 30, 46)      # Dark Text
+
+
+class VmTableModel(QAbstractTableModel):
+    """
+    VM一覧のテーブルモデル
+    - 行は self.vms の並び（ソートは QSortFilterProxyModel 側で行い、元の並びは変えない）
+    - 監視スレッドからの結果は post_status() で溜め、UIスレッドでまとめて反映する
+      値が変わったセルだけを、連続する行ごとに1回の dataChanged で通知する
+    """
+    _flush_requested = pyqtSignal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.vms: List[VM] = []
+        self._row_of: Dict[int, int] = {}              # id(vm) -> 行
+        self._status: Dict[str, Tuple[str, str]] = {}  # mac -> (状態, 最終更新)
+        self._busy: Dict[str, str] = {}                # mac -> 実行中の操作
+        self._pending: List[Tuple[VM, str, Optional[str], str]] = []
+        self._pending_lock = threading.Lock()
+        self._flush_requested.connect(self.flush, Qt.ConnectionType.QueuedConnection)
+
+    # --- QAbstractTableModel ---
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.vms)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        vm = self.vms[index.row()]
+        col = index.column()
+        if role == Qt.ItemDataRole.DisplayRole:
+            return self._text(vm, col)
+        if role == Qt.ItemDataRole.UserRole:
+            return vm
+        if col == COL_STATUS:
+            if role == Qt.ItemDataRole.BackgroundRole:
+                if vm.mac in self._busy:
+                    return STATUS_COLOR_BUSY
+                return STATUS_COLORS.get(self._status.get(vm.mac, ("",))[0], STATUS_COLOR_OTHER)
+            if role == Qt.ItemDataRole.ForegroundRole:
+                return STATUS_TEXT_COLOR
+        return None
+
+    def _text(self, vm: VM, col: int) -> str:
+        if col == 0:
+            return vm.vm_name
+        if col == COL_IP:
+            return vm.host_ip or "-"
+        if col == 2:
+            return vm.mac
+        if col == 3:
+            # API -> WinRM 表記ゆれ吸収
+            return "WinRM" if vm.method.upper() in ("API", "WINRM") else vm.method
+        if col == 4:
+            return vm.user
+        if col == 5:
+            return vm.type
+        if col == COL_RUNS_ON:
+            return vm.runs_on or "-"
+        status, updated = self._status.get(vm.mac, ("取得中...", "-"))
+        if col == COL_STATUS:
+            action = self._busy.get(vm.mac)
+            return f"{status}（{action} 実行中…）" if action else status
+        return updated
+
+    # --- 行の操作 ---
+    def set_vms(self, vms: List[VM]) -> None:
+        """一覧を丸ごと差し替える（読み込み時）"""
+        self.beginResetModel()
+        self.vms = vms
+        self._reindex()
+        self.endResetModel()
+
+    def add_vm(self, vm: VM) -> None:
+        row = len(self.vms)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.vms.append(vm)
+        self._row_of[id(vm)] = row
+        self.endInsertRows()
+
+    def remove_vm(self, vm: VM) -> None:
+        row = self.row_of(vm)
+        if row is None:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.vms[row]
+        self._reindex()
+        self.endRemoveRows()
+
+    def _reindex(self) -> None:
+        self._row_of = {id(vm): i for i, vm in enumerate(self.vms)}
+
+    def row_of(self, vm: VM) -> Optional[int]:
+        return self._row_of.get(id(vm))
+
+    def vm_at(self, row: int) -> VM:
+        return self.vms[row]
+
+    # --- ステータス反映 ---
+    def post_status(self, vm: VM, status: str, ip: Optional[str]) -> None:
+        """任意のスレッドから呼べる。反映は UIスレッドの flush() でまとめて行う"""
+        now_str = datetime.now().strftime("%H:%M:%S")
+        with self._pending_lock:
+            first = not self._pending
+            self._pending.append((vm, status, ip, now_str))
+        if first:
+            self._flush_requested.emit()
+
+    def flush(self) -> int:
+        """溜まったステータスを反映し、変化したセル数を返す"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        changed: Dict[int, List[int]] = {}
+        for vm, status, ip, now_str in pending:
+            row = self.row_of(vm)
+            if row is None:
+                continue  # 再読み込みなどで一覧から外れたVM
+            cols = changed.setdefault(row, [])
+            new_ip = ip or vm.host_ip
+            if new_ip and new_ip != vm.host_ip:
+                vm.host_ip = new_ip
+                cols.append(COL_IP)
+            prev = self._status.get(vm.mac)
+            if prev is None or prev[0] != status:
+                cols.append(COL_STATUS)
+            if prev is None or prev[1] != now_str:
+                cols.append(COL_UPDATED)
+            self._status[vm.mac] = (status, now_str)
+        self._emit_changed(changed)
+        return sum(len(c) for c in changed.values())
+
+    def set_busy(self, vm: VM, action: Optional[str]) -> None:
+        if action:
+            self._busy[vm.mac] = action
+        else:
+            self._busy.pop(vm.mac, None)
+        row = self.row_of(vm)
+        if row is not None:
+            self._emit_changed({row: [COL_STATUS]})
+
+    def set_ips(self, updates: Iterable[Tuple[VM, str]]) -> None:
+        """IPの変更（サブネット探索の結果など）をまとめて反映する"""
+        changed: Dict[int, List[int]] = {}
+        for vm, ip in updates:
+            row = self.row_of(vm)
+            if row is not None and vm.host_ip != ip:
+                vm.host_ip = ip
+                changed[row] = [COL_IP]
+        self._emit_changed(changed)
+
+    def _emit_changed(self, changed: Dict[int, List[int]]) -> None:
+        """連続する行をまとめて dataChanged を出す"""
+        rows = sorted(r for r, cols in changed.items() if cols)
+        i = 0
+        while i < len(rows):
+            j = i
+            while j + 1 < len(rows) and rows[j + 1] == rows[j] + 1:
+                j += 1
+            cols = [c for r in rows[i:j + 1] for c in changed[r]]
+            self.dataChanged.emit(self.index(rows[i], min(cols)), self.index(rows[j], max(cols)))
+            i = j + 1
+
+
+class _WorkerSignals(QObject):
+    done = pyqtSignal(object)  # PowerResult
+
+
+class _ActionWorker(QRunnable):
+    """操作をスレッドプール上で実行し、VMごとの PowerResult を1件ずつ通知する"""
+    def __init__(self, vms: List[VM], action: str, run: Callable[[], Iterable[PowerResult]]):
+        super().__init__()
+        self.vms = vms
+        self.action = action
+        self.run_fn = run
+        self.signals = _WorkerSignals()
+
+    def run(self):
+        start = time.monotonic()
+        reported = set()
+        try:
+            for res in self.run_fn():
+                reported.add(res.mac)
+                self.signals.done.emit(res)
+        except Exception as e:
+            logger.error(f"{self.action} error: {e}")
+            for vm in self.vms:
+                if vm.mac not in reported:
+                    self.signals.done.emit(PowerResult(vm.vm_name, vm.mac, self.action, False, str(e),
+                                                       time.monotonic() - start))
+
+
+class _ExecSignals(QObject):
+    chunk = pyqtSignal(object)  # ExecChunk
+    finished = pyqtSignal()
+
+
+class _ExecWorker(QRunnable):
+    """run_command_batch をスレッドプール上で回し、出力の断片を届いた順に通知する"""
+    def __init__(self, vms: List[VM], command: str, passwords: Dict[str, str]):
+        super().__init__()
+        self.vms = vms
+        self.command = command
+        self.passwords = passwords
+        self.cancel = threading.Event()
+        self.signals = _ExecSignals()
+
+    def run(self):
+        try:
+            for chunk in run_command_batch(self.vms, self.command, lambda vm: self.passwords.get(vm.host_ip),
+                                           cancel=self.cancel):
+                self.signals.chunk.emit(chunk)
+        except Exception as e:
+            logger.error(f"Exec error: {e}")
+        finally:
+            self.signals.finished.emit()
+
+
+class _CallSignals(QObject):
+    done = pyqtSignal(object, object)  # 戻り値, 例外（成功時は None）
+
+
+class _CallWorker(QRunnable):
+    """引数なしの関数をスレッドプール上で1回実行し、結果を通知する"""
+    def __init__(self, fn: Callable[[], object]):
+        super().__init__()
+        self.fn = fn
+        self.signals = _CallSignals()
+
+    def run(self):
+        try:
+            result, error = self.fn(), None
+        except Exception as e:
+            logger.error(f"Background task error: {e}")
+            result, error = None, e
+        self.signals.done.emit(result, error)
+
+
+class ExecOutputDialog(QDialog):
+    """複数ホストでのコマンド実行結果を、届いた順に [VM名] 付きで1行ずつ表示する"""
+    def __init__(self, parent, vms: List[VM], command: str, passwords: Dict[str, str]):
+        super().__init__(parent)
+        self.setWindowTitle(f"コマンド実行: {command}")
+        self.resize(760, 480)
+        self.output = QPlainTextEdit(self)
+        self.output.setReadOnly(True)
+        self.output.setMaximumBlockCount(20000)  # 長い出力でもメモリを使い切らない
+        self.summary = QLabel(self)
+        buttons = QDialogButtonBox(QDialogButtonBox.StandardButton.Close, self)
+        buttons.rejected.connect(self.close)
+        layout = QVBoxLayout(self)
+        layout.addWidget(self.output)
+        layout.addWidget(self.summary)
+        layout.addWidget(buttons)
+
+        self.results: Dict[str, ExecChunk] = {}
+        self._partial: Dict[str, str] = {}  # VMごとの改行前の断片
+        self._total = len(vms)
+        self.worker = _ExecWorker(vms, command, passwords)
+        self.worker.signals.chunk.connect(self.on_chunk)
+        self._update_summary()
+        QThreadPool.globalInstance().start(self.worker)
+
+    def on_chunk(self, chunk: ExecChunk):
+        name = chunk.vm_name
+        if chunk.stream in ("stdout", "stderr"):
+            text = self._partial.pop(name, "") + chunk.data
+            *lines, rest = text.split("\n")
+            if rest:
+                self._partial[name] = rest
+            mark = "!" if chunk.stream == "stderr" else " "
+            for line in lines:
+                self.output.appendPlainText(f"[{name}]{mark} {line}")
+            return
+        rest = self._partial.pop(name, "")
+        if rest:
+            self.output.appendPlainText(f"[{name}]  {rest}")
+        if chunk.stream == "exit":
+            self.output.appendPlainText(f"[{name}] --- exit {chunk.rc} ({chunk.elapsed:.1f}s)")
+        else:
+            self.output.appendPlainText(f"[{name}] --- error: {chunk.data}")
+        self.results[name] = chunk
+        self._update_summary()
+
+    def _update_summary(self):
+        ok = sum(1 for c in self.results.values() if c.stream == "exit" and c.rc == 0)
+        self.summary.setText(f"完了 {len(self.results)}/{self._total}（成功 {ok}）")
+
+    def closeEvent(self, event):
+        self.worker.cancel.set()  # 実行中のコマンドは中断する
+        super().closeEvent(event)
+
+
+class ActionExecutor(QObject):
+    """
+    SSH/WinRM/WOL の操作をUIスレッドの外（QThreadPool）で実行する
+    結果はシグナルでUIスレッドに届く。同じVMへの操作は同時に1件まで
+    """
+    started = pyqtSignal(object, str)     # vm, action
+    finished = pyqtSignal(object, object)  # vm, PowerResult
+    plan_done = pyqtSignal(object)         # PlanResult（submit_plan の全ステップ完了後）
+
+    def __init__(self, parent=None, max_threads: int = BATCH_MAX_WORKERS,
+                 hypervisor: Optional[HypervisorBackend] = None):
+        super().__init__(parent)
+        self.hypervisor = hypervisor  # ハイパーバイザー上のゲストはホスト経由で操作する
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_threads)
+        self._running: Dict[str, Tuple[VM, str]] = {}
+
+    def busy(self, mac: str) -> Optional[str]:
+        """実行中の操作名（なければ None）"""
+        entry = self._running.get(mac)
+        return entry[1] if entry else None
+
+    def submit(self, vm: VM, action: str, password: Optional[str] = None) -> bool:
+        if vm.mac in self._running:
+            return False
+
+        def run():
+            start = time.monotonic()
+            ok, msg = power_action_vm(vm, action, password, self.hypervisor)
+            yield PowerResult(vm.vm_name, vm.mac, action, ok, msg, time.monotonic() - start)
+        self._start([vm], action, run)
+        return True
+
+    def submit_wake(self, vms: List[VM], wait: bool = True) -> List[VM]:
+        """
+        複数台へまとめてWOLを送る（1ソケット・1ワーカー）
+        wait=True なら起動を確認した台から順に結果が届く。受け付けたVMを返す
+        """
+        targets = [vm for vm in vms if vm.mac not in self._running]
+        if not targets:
+            return []
+
+        def run():
+            for res in wake_on_lan(targets, wait=wait):
+                yield PowerResult(res.vm_name, res.mac, "wol", res.ok, res.message,
+                                  res.time_to_alive or 0.0)
+        self._start(targets, "wol", run)
+        return targets
+
+    def submit_plan(self, orch: PowerOrchestrator, action: str,
+                    targets: Optional[List[str]] = None) -> bool:
+        """依存関係順の一括起動・停止。対象に実行中のVMがあれば受け付けない"""
+        vms = [orch.by_name[name] for name in orch.plan(action, targets)]
+        if any(vm.mac in self._running for vm in vms):
+            return False
+
+        def run():
+            start = time.monotonic()
+            steps = []
+            for step in orch.iter_run(action, targets):
+                steps.append(step)
+                yield PowerResult(step.vm_name, step.mac, action, step.ok, step.message, step.elapsed)
+            path, path_time = critical_path(steps)
+            self.plan_done.emit(PlanResult(action, steps, time.monotonic() - start, path, path_time))
+        self._start(vms, action, run)
+        return True
+
+    def _start(self, vms: List[VM], action: str, run: Callable[[], Iterable[PowerResult]]) -> None:
+        worker = _ActionWorker(vms, action, run)
+        worker.signals.done.connect(self._on_done)
+        for vm in vms:
+            self._running[vm.mac] = (vm, action)
+            self.started.emit(vm, action)
+        self.pool.start(worker)
+
+    def _on_done(self, res: PowerResult):
+        vm, _ = self._running.pop(res.mac, (None, None))
+        if vm is not None:
+            self.finished.emit(vm, res)
+
+    def wait(self, msecs: int = -1) -> bool:
+        return self.pool.waitForDone(msecs)
+
+
 class MainWindow(QMainWindow):
     """HomeVM Manager メインウィンドウ"""
     def __init__(self):
@@ -106,7 +521,7 @@ class MainWindow(QMainWindow):
         uic.loadUi(str(ui_path), self)
 
         # --- UI要素取得 ---
-        self.table = self.findChild(QtWidgets.QTableWidget, "tableVMs")
+        self.table = self.findChild(QtWidgets.QTableView, "tableVMs")
         self.btnAdd = self.findChild(QtWidgets.QPushButton, "btnAdd")
         self.btnDelete = self.findChild(QtWidgets.QPushButton, "btnDelete")
         self.btnSave = self.findChild(QtWidgets.QPushButton, "btnSave")
@@ -123,6 +538,32 @@ class MainWindow(QMainWindow):
         # --- 内部状態 ---
         self.vms: List[VM] = []
         self._pass_cache: Dict[str, str] = {}
+        self.inventory = get_repository()
+        self._saved: Optional[Tuple[VM, ...]] = None  # 最後に読み込み・保存した時点の一覧（読み込み失敗時は None）
+        self._batch_of: Dict[str, dict] = {}
+        # runs_on がSSHのハイパーバイザーを指すゲストは、ホストから一括で状態取得・電源操作する
+        # （ワーカースレッドから呼ばれるため、パスワードは入力を求めずキャッシュ/keyringから取る）
+        self.hypervisor = HypervisorBackend(lambda: list(self.vms),
+                                            lambda vm: self._stored_password(vm.host_ip))
+
+        # --- テーブル（モデル → ソート/フィルタ用プロキシ → ビュー） ---
+        self.model = VmTableModel(self)
+        self.proxy = QSortFilterProxyModel(self)
+        self.proxy.setSourceModel(self.model)
+        self.proxy.setFilterKeyColumn(-1)  # 全列を対象に絞り込む
+        self.proxy.setFilterCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+        self.table.setModel(self.proxy)
+        self.table.setSortingEnabled(True)
+        self.table.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.ResizeMode.Fixed)
+        self.filterEdit.textChanged.connect(self.proxy.setFilterFixedString)
+
+        # --- 電源操作はバックグラウンドで実行 ---
+        self.actions = ActionExecutor(self, hypervisor=self.hypervisor)
+        self.actions.started.connect(self._on_action_started)
+        self.actions.finished.connect(self._on_action_finished)
+        self.actions.plan_done.connect(self._on_plan_done)
+        self._plan_macs: set = set()
+        self._discover_worker: Optional[_CallWorker] = None
 
         # --- イベント接続 ---
         self.btnAdd.clicked.connect(self.on_add)
@@ -140,7 +581,6 @@ class MainWindow(QMainWindow):
 
         # --- 初期ロードとステータス監視 ---
         self.load_and_refresh()
-        self.table.horizontalHeader().sectionClicked.connect(self.on_table_sort)
         self.start_status_monitor()
 
         # --- ウィンドウ設定 ---
@@ -151,39 +591,45 @@ class MainWindow(QMainWindow):
 
     # ====== データI/O ======
     def load_and_refresh(self):
-        self.vms = load_vm_list()
+        # GUIはVMを編集するので共有スナップショットの複製を持つ
+        try:
+            snap = self.inventory.snapshot()
+        except InventoryCorruptError as e:
+            logger.error(f"Inventory load failed: {e}")
+            QMessageBox.critical(self, "読み込みエラー", f"VM一覧を読み込めませんでした。\n{e}")
+            self.vms = []
+            self._saved = None
+        else:
+            self.vms = snap.copy_vms()
+            self._saved = snap.vms
         self.refresh_table()
         self.status.showMessage(f"読み込み完了: {len(self.vms)} 件", 3000)
 
     def persist(self):
-        save_vm_list(self.vms)
-        self.status.showMessage(f"保存しました: {DATA_FILE}", 3000)
+        if self._saved is None:
+            # 壊れたファイルを空の一覧で上書きしない
+            QMessageBox.warning(self, "保存", "VM一覧を読み込めていないため保存しません。\n"
+                                              "ファイルを修復してから再読み込みしてください。")
+            return
+        # 読み込み時からの差分（追加・編集・削除した行）だけを書き込む
+        # 丸ごと置き換えると、その間にWebから追加されたVMまで消してしまうため
+        self.inventory.save_changes(self._saved, self.vms)
+        self._saved = tuple(replace(vm) for vm in self.vms)
+        self.status.showMessage(f"保存しました: {self.inventory.path}", 3000)
 
     # ====== GUI更新 ======
     def refresh_table(self):
-        """テーブルを再描画"""
-        self.table.setSortingEnabled(False)
-        self.table.clearContents()
-        self.table.setRowCount(len(self.vms))
-        headers = ["VM名", "ホストIP", "MAC", "方式", "ユーザー", "種別", "状態", "最終更新"]
-        self.table.setColumnCount(len(headers))
-        self.table.setHorizontalHeaderLabels(headers)
-
-        for row, vm in enumerate(self.vms):
-            # API -> WinRM 表記ゆれ吸収
-            method_disp = "WinRM" if vm.method.upper() in ("API", "WINRM") else vm.method
-
-            values = [vm.vm_name, vm.host_ip or "-", vm.mac, method_disp, vm.user, vm.type, "取得中...", "-"]
-            for col, value in enumerate(values):
-                item = QTableWidgetItem(value)
-                item.setFlags(item.flags())
-                self.table.setItem(row, col, item)
+        """一覧を読み直してテーブルに反映（状態の表示は引き継ぐ）"""
+        self.model.set_vms(self.vms)
         self.table.resizeColumnsToContents()
-        self.table.setSortingEnabled(True)
+
+    def _vm_at(self, index: QModelIndex) -> VM:
+        """ビュー（ソート・絞り込み後）の行から VM を引く"""
+        return self.model.vm_at(self.proxy.mapToSource(index).row())
 
     # ====== ボタンハンドラ ======
     def on_add(self):
-        dlg = AddVmDialog(self)
+        dlg = AddVmDialog(self, hosts=[v.vm_name for v in self.vms if v.type == "physical"])
         #if dlg.exec_() == QDialog.Accepted:
         if dlg.exec() == QDialog.DialogCode.Accepted:
             new_vm = dlg.get_vm()
@@ -191,23 +637,22 @@ class MainWindow(QMainWindow):
                 if any(v.vm_name == new_vm.vm_name for v in self.vms):
                     QMessageBox.warning(self, "重複", f"VM名 '{new_vm.vm_name}' は既に存在します。")
                     return
-                self.vms.append(new_vm)
-                self.refresh_table()
+                self.model.add_vm(new_vm)
                 logger.info(f"VM added: {new_vm.vm_name}")
                 self.status.showMessage(f"追加: {new_vm.vm_name}", 3000)
 
     def on_delete(self):
-        row = self.table.currentRow()
-        if row < 0:
+        index = self.table.currentIndex()
+        if not index.isValid():
             QMessageBox.information(self, "削除", "削除するVMを選択してください。")
             return
-        vm_name = self.table.item(row, 0).text() if self.table.item(row, 0) else "(不明)"
+        vm = self._vm_at(index)
+        vm_name = vm.vm_name
         ret = QMessageBox.question(self, "確認", f"選択中のVM '{vm_name}' を削除しますか？")
         #if ret == QMessageBox.Yes:
         if ret == QMessageBox.StandardButton.Yes:
             logger.info(f"VM removed: {vm_name}")
-            del self.vms[row]
-            self.refresh_table()
+            self.model.remove_vm(vm)
             self.status.showMessage(f"削除: {vm_name}", 3000)
 
     def on_save(self):
@@ -217,12 +662,12 @@ class MainWindow(QMainWindow):
         self.load_and_refresh()
 
     # ====== 電源操作 ======
-    def _get_password(self, host_ip: str) -> str:
-        """SSH/WinRM接続パスワード取得（keyring -> キャッシュ -> 入力）"""
+    def _stored_password(self, host_ip: str) -> Optional[str]:
+        """キャッシュ -> keyring の順に保存済みパスワードを返す（入力は求めない）"""
         # 1. メモリキャッシュ確認
         if host_ip in self._pass_cache:
             return self._pass_cache[host_ip]
-        
+
         # 2. keyring確認
         try:
             saved_pw = keyring.get_password("HomeVM-Manager", host_ip)
@@ -231,6 +676,13 @@ class MainWindow(QMainWindow):
                 return saved_pw
         except Exception as e:
             logger.warning(f"Keyring access failed: {e}")
+        return None
+
+    def _get_password(self, host_ip: str) -> str:
+        """SSH/WinRM接続パスワード取得（キャッシュ -> keyring -> 入力）"""
+        saved_pw = self._stored_password(host_ip)
+        if saved_pw:
+            return saved_pw
 
         # 3. 入力ダイアログ
         pw, ok = QInputDialog.getText(
@@ -252,114 +704,317 @@ class MainWindow(QMainWindow):
         return pw
 
     def _selected_vm(self) -> Optional[VM]:
-        row = self.table.currentRow()
-        if row < 0:
+        index = self.table.currentIndex()
+        if not index.isValid():
             QMessageBox.information(self, "選択", "操作対象を選択してください。")
             return None
-        return self.vms[row]
+        return self._vm_at(index)
+
+    def _selected_vms(self) -> List[VM]:
+        indexes = sorted(self.table.selectionModel().selectedRows(), key=lambda idx: idx.row())
+        if not indexes and self.table.currentIndex().isValid():
+            indexes = [self.table.currentIndex()]
+        if not indexes:
+            QMessageBox.information(self, "選択", "操作対象を選択してください。")
+        return [self._vm_at(idx) for idx in indexes]
 
     def _do_power(self, action: str):
-        vm = self._selected_vm()
+        vms = self._selected_vms()
+        if len(vms) > 1:
+            self._do_power_batch(vms, action)
+            return
+        vm = vms[0] if vms else None
         if not vm:
             return
+        host = self.hypervisor.host_vm(vm)
+        if host is not None:
+            # ハイパーバイザー経由（ゲストのIP・パスワードは不要）
+            try:
+                self._get_password(host.host_ip)
+            except Exception as e:
+                QMessageBox.warning(self, "中止", f"{e}")
+                return
+            self._submit_action(vm, action)
+            return
         if not vm.host_ip:
             QMessageBox.warning(self, "エラー", "IP未取得のためSSH操作できません。")
             return
         try:
             password = self._get_password(vm.host_ip)
-            ok, msg = power_action_unified(vm.method, vm.host_ip, vm.user, password, action)
-            if ok:
-                QMessageBox.information(self, "成功", f"{vm.vm_name}: {action} 完了\n{msg}")
-            else:
-                QMessageBox.warning(self, "失敗", f"{vm.vm_name}: {action} 失敗\n{msg}")
         except Exception as e:
-            logger.exception("Power action error")
-            QMessageBox.critical(self, "エラー", f"操作でエラーが発生しました。\n{e}")
-
+            QMessageBox.warning(self, "中止", f"{e}")
+            return
+        self._submit_action(vm, action, password)
+
+    def _do_power_batch(self, vms: List[VM], action: str):
+        """複数VMへ並列に電源操作し、全件終わったら結果をまとめて表示"""
+        hosts = {vm.mac: self.hypervisor.host_vm(vm) for vm in vms}
+        targets = [vm for vm in vms if vm.host_ip or hosts[vm.mac]]
+        skipped = [vm.vm_name for vm in vms if not (vm.host_ip or hosts[vm.mac])]
+        ret = QMessageBox.question(self, "確認", f"{len(targets)} 台に {action} を実行しますか？")
+        if ret != QMessageBox.StandardButton.Yes:
+            return
+        # パスワードは事前にまとめて取得（ダイアログはUIスレッドでしか出せないため）
+        # ハイパーバイザー上のゲストはホストのパスワードを使う
+        passwords: Dict[str, str] = {}
+        try:
+            for vm in targets:
+                ip = (hosts[vm.mac] or vm).host_ip
+                if ip not in passwords:
+                    passwords[ip] = self._get_password(ip)
+        except Exception as e:
+            QMessageBox.warning(self, "中止", f"{e}")
+            return
 
-        #     with SshClient(vm.host_ip, vm.user, password) as cli:
-        #         ok, msg = cli.power_action(action)
-        #     if ok:
-        #         QMessageBox.information(self, "成功", f"{vm.vm_name}: {action} 完了\n{msg}")
-        #     else:
-        #         QMessageBox.warning(self, "失敗", f"{vm.vm_name}: {action} 失敗\n{msg}")
-        # except Exception as e:
-        #     logger.exception("Power action error")
-        #     QMessageBox.critical(self, "エラー", f"SSH操作でエラーが発生しました。\n{e}")
+        batch = {"action": action, "pending": 0, "failed": 0,
+                 "lines": [], "skipped": [f"[SKIP] {name}: IP未取得" for name in skipped]}
+        for vm in targets:
+            password = None if hosts[vm.mac] else passwords[vm.host_ip]
+            if self._submit_action(vm, action, password, quiet=True):
+                batch["pending"] += 1
+                self._batch_of[vm.mac] = batch
+            else:
+                batch["skipped"].append(f"[SKIP] {vm.vm_name}: 実行中の操作あり")
+        if not batch["pending"]:
+            self._show_batch_result(batch)
 
     def _do_wol(self):
-        vm = self._selected_vm()
-        if not vm:
+        """選択中の物理マシンへまとめてWOLを送り、起動（生存確認の応答）まで待つ"""
+        vms = self._selected_vms()
+        if not vms:
             return
-        
-        if vm.type != "physical":
-            QMessageBox.information(self, "WOL無効", f"{vm.vm_name} は仮想マシンのためWOLをサポートしません。")
+        targets = [vm for vm in vms if vm.type == "physical"]
+        # ハイパーバイザー上のゲストはWOLの代わりにホスト経由で電源ONする
+        guests = [vm for vm in vms if vm.type != "physical" and self.hypervisor.manages(vm)]
+        skipped = [f"[SKIP] {vm.vm_name}: 仮想マシンのためWOL非対応" for vm in vms
+                   if vm.type != "physical" and vm not in guests]
+        if not targets and not guests:
+            names = "、".join(vm.vm_name for vm in vms)
+            QMessageBox.information(self, "WOL無効", f"{names} は仮想マシンのためWOLをサポートしません。")
+            return
+        try:
+            for host_ip in {self.hypervisor.host_vm(vm).host_ip for vm in guests}:
+                self._get_password(host_ip)
+        except Exception as e:
+            QMessageBox.warning(self, "中止", f"{e}")
+            return
+        accepted = self.actions.submit_wake(targets) if targets else []
+        accepted += [vm for vm in guests if self.actions.submit(vm, "wol")]
+        targets += guests
+        accepted_ids = {id(vm) for vm in accepted}
+        busy = [vm for vm in targets if id(vm) not in accepted_ids]
+        skipped += [f"[SKIP] {vm.vm_name}: 実行中の操作あり" for vm in busy]
+        if len(vms) == 1:
+            if busy:
+                vm = busy[0]
+                self.status.showMessage(
+                    f"{vm.vm_name}: {self.actions.busy(vm.mac)} を実行中のため wol は受け付けません", 5000)
             return
+        batch = {"action": "wol", "pending": len(accepted), "failed": 0, "lines": [], "skipped": skipped}
+        for vm in accepted:
+            self._batch_of[vm.mac] = batch
+        if not accepted:
+            self._show_batch_result(batch)
+
+    # ====== バックグラウンド実行 ======
+    def _submit_action(self, vm: VM, action: str, password: Optional[str] = None,
+                       quiet: bool = False) -> bool:
+        if self.actions.submit(vm, action, password):
+            return True
+        if not quiet:
+            self.status.showMessage(
+                f"{vm.vm_name}: {self.actions.busy(vm.mac)} を実行中のため {action} は受け付けません", 5000)
+        return False
+
+    def _on_action_started(self, vm: VM, action: str):
+        self.model.set_busy(vm, action)
+        self.status.showMessage(f"{vm.vm_name}: {action} 実行中...", 3000)
+
+    def _on_action_finished(self, vm: VM, res: PowerResult):
+        self.monitor.boost(vm.mac)
+        self.model.set_busy(vm, None)
+        label = "WOL" if res.action == "wol" else res.action
+        if vm.mac in self._plan_macs:
+            # 一括起動・停止の結果は plan_done でまとめて表示する
+            self._plan_macs.discard(vm.mac)
+            self.status.showMessage(f"{vm.vm_name}: {label} {'完了' if res.ok else '失敗'} {res.message}", 5000)
+            return
+        batch = self._batch_of.pop(vm.mac, None)
+        if batch is not None:
+            batch["pending"] -= 1
+            batch["failed"] += 0 if res.ok else 1
+            mark = "OK" if res.ok else "NG"
+            batch["lines"].append(f"[{mark}] {res.vm_name} ({res.elapsed:.1f}s): {res.message}")
+            if batch["pending"] == 0:
+                self._show_batch_result(batch)
+            return
+        if res.ok:
+            self.status.showMessage(f"{vm.vm_name}: {label} 完了 ({res.elapsed:.1f}s) {res.message}", 5000)
+        else:
+            self._notify(QMessageBox.Icon.Warning, "失敗", f"{vm.vm_name}: {label} 失敗\n{res.message}")
+
+    def _do_orchestrate(self, action: str):
+        """
+        runs_on の依存関係に沿って一括起動・停止する
+        選択があれば選択中のVM（と依存先）、なければ全VMが対象
+        """
+        indexes = self.table.selectionModel().selectedRows()
+        names = [self._vm_at(idx).vm_name for idx in indexes] or None
         try:
-            send_magic_packet(vm.mac)
-            QMessageBox.information(self, "WOL", f"{vm.vm_name}（{vm.mac}）へ送信しました。")
+            orch = PowerOrchestrator(self.vms, guest_starter=self.hypervisor.start_guest,
+                                     guest_stopper=self.hypervisor.stop_guest)
+            planned = [orch.by_name[n] for n in orch.plan(action, names)]
+        except DependencyError as e:
+            QMessageBox.warning(self, "依存関係エラー", f"{e}")
+            return
+        verb = "起動" if action == STARTUP else "停止"
+        order = "ハイパーバイザー → ゲスト" if action == STARTUP else "ゲスト → ハイパーバイザー"
+        ret = QMessageBox.question(self, "確認", f"{len(planned)} 台を{verb}しますか？（{order} の順）")
+        if ret != QMessageBox.StandardButton.Yes:
+            return
+        try:
+            # ハイパーバイザー経由で起動・停止するゲストのため、ホストのパスワードを先に確認しておく
+            for host_ip in {h.host_ip for h in map(self.hypervisor.host_vm, planned) if h is not None}:
+                self._get_password(host_ip)
         except Exception as e:
-            logger.exception("WOL error")
-            QMessageBox.critical(self, "エラー", f"WOL送信に失敗しました。\n{e}")
+            QMessageBox.warning(self, "中止", f"{e}")
+            return
+        if action == SHUTDOWN:
+            # パスワードは事前にまとめて取得（ダイアログはUIスレッドでしか出せないため）
+            # ホスト経由で停止するゲストは、ホストに届かない時の予備として保存済みのものだけ使う
+            passwords: Dict[str, str] = {}
+            try:
+                for vm in planned:
+                    if vm.host_ip and vm.host_ip not in passwords:
+                        if self.hypervisor.manages(vm):
+                            passwords[vm.host_ip] = self._stored_password(vm.host_ip)
+                        else:
+                            passwords[vm.host_ip] = self._get_password(vm.host_ip)
+            except Exception as e:
+                QMessageBox.warning(self, "中止", f"{e}")
+                return
+            orch.password_for = lambda vm: passwords.get(vm.host_ip)
+        if not self.actions.submit_plan(orch, action, names):
+            self.status.showMessage(f"実行中の操作があるため一括{verb}は受け付けません", 5000)
+            return
+        self._plan_macs.update(vm.mac for vm in planned)
 
-    # ====== ステータス監視 ======
-    def start_status_monitor(self):
-        """バックグラウンドで定期的にMAC→IP→ping確認"""
-        def loop():
-            while True:
-                for i, vm in enumerate(self.vms):
-                    try:
-                        status, new_ip = resolve_status(vm.mac, getattr(vm, "host_ip", None))
-                        vm.host_ip = new_ip or vm.host_ip
-                        # Qtのメインスレッドで安全に関数を読み出し
-                        # QMetaObject.invokeMethod(
-                        #     self,
-                        #     "_update_status_row_safe",
-                        #     Qt.QueuedConnection,
-                        #     # 引数を渡す
-                        #     args=[i, status, new_ip or ""]
-                        # )
-
-                        # UIスレッドで安全に更新（partialで変数を確定キャプチャ）
-                        QTimer.singleShot(
-                            0,
-                            partial(self._update_status_row, i, status, new_ip)
-                        )
-
-                    except Exception as e:
-                        logger.error(f"Status check failed: {e}")
-                time.sleep(10)  # 10秒間隔でチェック
-        t = threading.Thread(target=loop, daemon=True)
-        t.start()
-
-    def _update_status_row(self, row: int, status: str, ip: str):
-        """GUI上のテーブル行を更新"""
+    def _do_exec(self):
+        """選択中のSSHホストで同じコマンドを並列に実行し、出力を順次表示する"""
+        vms = self._selected_vms()
+        if not vms:
+            return
+        targets = [vm for vm in vms if vm.method.upper() == "SSH" and vm.host_ip]
+        if not targets:
+            QMessageBox.information(self, "コマンド実行", "IP取得済みのSSHホストを選択してください。")
+            return
+        command, ok = QInputDialog.getText(
+            self, "コマンド実行", f"{len(targets)} 台で実行するコマンド（例: sudo dnf -y update）")
+        command = command.strip()
+        if not ok or not command:
+            return
+        # パスワードは事前にまとめて取得（ダイアログはUIスレッドでしか出せないため）
+        passwords: Dict[str, str] = {}
         try:
-            self.table.setItem(row, 1, QTableWidgetItem(ip or "-"))
-
-            item = QTableWidgetItem(status)
-            # 状態ごとに色分け
-            if status == "稼働中":
-                #pass
-                item.setBackground(QColor(166, 227, 161))  # Pastel Green
-                item.setForeground(QColor(30, 30, 46))     # Dark Text
-            elif status == "停止中":
-                #pass
-                item.setBackground(QColor(243, 139, 168))  # Pastel Red
-                item.setForeground(QColor(30, 30, 46))     # Dark Text
-            else:
-                #ass
-                item.setBackground(QColor(249, 226, 175))  # Pastel Yellow
-                item.setForeground(QColor(30, 30, 46))     # Dark Text
-            self.table.setItem(row, 6, item)
+            for vm in targets:
+                if vm.host_ip not in passwords:
+                    passwords[vm.host_ip] = self._get_password(vm.host_ip)
+        except Exception as e:
+            QMessageBox.warning(self, "中止", f"{e}")
+            return
+        dlg = ExecOutputDialog(self, targets, command, passwords)
+        dlg.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        dlg.show()
+
+    def _do_discover(self):
+        """サブネットを探索してIPの変わったVMを更新し、未登録のMACを追加候補として示す"""
+        if self._discover_worker is not None:
+            self.status.showMessage("IP探索を実行中です", 3000)
+            return
+        subnets = configured_subnets(self.vms)
+        if not subnets:
+            text, ok = QInputDialog.getText(self, "IP探索", "探索するサブネット（例: 192.168.0.0/24、カンマ区切り）")
+            subnets = [s.strip() for s in text.split(",") if s.strip()]
+            if not ok or not subnets:
+                return
+        vms = list(self.vms)
+        self._discover_worker = _CallWorker(lambda: discover_subnets(subnets, vms))
+        self._discover_worker.signals.done.connect(self._on_discovered)
+        QThreadPool.globalInstance().start(self._discover_worker)
+        self.status.showMessage(f"IP探索中: {', '.join(subnets)}")
+
+    def _on_discovered(self, result: Optional[DiscoveryResult], error: Optional[Exception]):
+        self._discover_worker = None
+        if error is not None:
+            QMessageBox.warning(self, "IP探索", f"探索に失敗しました。\n{error}")
+            return
+        by_name = {vm.vm_name: vm for vm in self.vms}
+        updates = [(by_name[u["vm_name"]], u["new_ip"]) for u in result.updated if u["vm_name"] in by_name]
+        if updates:
+            # 保存済みのVMだけをまとめて1回で保存（未保存の編集はそのまま残す）
+            self.inventory.update_ips({vm.vm_name: ip for vm, ip in updates})
+            self.model.set_ips(updates)
+            for vm, _ in updates:
+                self.monitor.boost(vm.mac)
+        self.status.showMessage(
+            f"IP探索完了: {len(result.alive)}/{result.scanned} 応答, IP更新 {len(updates)} 台, "
+            f"未登録 {len(result.candidates)} 件 ({result.elapsed:.1f}s)", 10000)
+        if not result.candidates:
+            return
+        items = [f"{c['mac']}  {c['ip']}" for c in result.candidates]
+        item, ok = QInputDialog.getItem(self, "IP探索", "インベントリにないMACです。追加するものを選んでください",
+                                        items, 0, False)
+        if not ok:
+            return
+        cand = result.candidates[items.index(item)]
+        dlg = AddVmDialog(self, hosts=[v.vm_name for v in self.vms if v.type == "physical"])
+        dlg.ed_mac.setText(cand["mac"].upper())
+        dlg.ed_host_ip.setText(cand["ip"])
+        if dlg.exec() == QDialog.DialogCode.Accepted:
+            new_vm = dlg.get_vm()
+            if new_vm:
+                if any(v.vm_name == new_vm.vm_name for v in self.vms):
+                    QMessageBox.warning(self, "重複", f"VM名 '{new_vm.vm_name}' は既に存在します。")
+                    return
+                self.model.add_vm(new_vm)
+                logger.info(f"VM added: {new_vm.vm_name}")
 
-            # 最終更新時刻
-            now_str = datetime.now().strftime("%H:%M:%S")
-            self.table.setItem(row, 7, QTableWidgetItem(now_str))
+    def _on_plan_done(self, plan: PlanResult):
+        for step in plan.steps:
+            self._plan_macs.discard(step.mac)
+        verb = "起動" if plan.action == STARTUP else "停止"
+        lines = [f"[{'OK' if s.ok else ('SKIP' if s.skipped else 'NG')}] {s.vm_name} "
+                 f"({s.start:.1f}s → {s.end:.1f}s): {s.message}" for s in plan.steps]
+        text = (f"一括{verb}: {sum(s.ok for s in plan.steps)}/{len(plan.steps)} 成功\n"
+                f"クリティカルパス: {' → '.join(plan.critical_path)} ({plan.critical_path_time:.1f}s)\n\n"
+                + "\n".join(lines))
+        self._notify(QMessageBox.Icon.Information if plan.ok else QMessageBox.Icon.Warning,
+                     f"一括{verb}", text)
+
+    def _show_batch_result(self, batch: dict):
+        done = len(batch["lines"])
+        text = (f"{batch['action']}: {done - batch['failed']}/{done} 成功\n\n"
+                + "\n".join(batch["lines"] + batch["skipped"]))
+        icon = QMessageBox.Icon.Warning if batch["failed"] or batch["skipped"] else QMessageBox.Icon.Information
+        self._notify(icon, "一括操作", text)
+
+    def _notify(self, icon: QMessageBox.Icon, title: str, text: str):
+        """結果表示（モードレスなので他の操作やテーブル更新を止めない）"""
+        box = QMessageBox(icon, title, text, QMessageBox.StandardButton.Ok, self)
+        box.setWindowModality(Qt.WindowModality.NonModal)
+        box.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+        box.show()
 
-            logger.info(f"Status updated: {self.vms[row].vm_name} -> {status} ({ip})")
-        except Exception as e:
-            logger.error(f"UI update failed: {e}")
+    # ====== ステータス監視 ======
+    def start_status_monitor(self):
+        """バックグラウンドでVMごとに適応的な間隔でMAC→IP→生存確認"""
+        # 結果はモデルに溜め、UIスレッドで変化したセルだけをまとめて更新する
+        # 共有監視サービスが動いていればその結果を購読し、自分では確認しない
+        self.monitor = connect_service(lambda: list(self.vms), on_result=self.model.post_status)
+        if self.monitor is None:
+            self.monitor = StatusMonitor(lambda: list(self.vms), on_result=self.model.post_status,
+                                         guest_status=self.hypervisor.guest_states)
+        self.monitor.start()
 
     def setup_toolbar(self):
         """上部ツールバーの作成と旧ボタンの非表示"""
@@ -375,10 +1030,20 @@ class MainWindow(QMainWindow):
         act_power_off = toolbar.addAction("電源OFF")
         act_reboot = toolbar.addAction("再起動")
         act_wol = toolbar.addAction("WOL")
+        act_startup = toolbar.addAction("一括起動")
+        act_shutdown = toolbar.addAction("一括停止")
+        act_exec = toolbar.addAction("コマンド実行")
+        act_discover = toolbar.addAction("IP探索")
         toolbar.addSeparator()
         act_add = toolbar.addAction("追加")
         act_delete = toolbar.addAction("削除")
         act_save = toolbar.addAction("保存")
+        toolbar.addSeparator()
+        self.filterEdit = QLineEdit(toolbar)
+        self.filterEdit.setPlaceholderText("絞り込み（VM名・IP・MAC など）")
+        self.filterEdit.setClearButtonEnabled(True)
+        self.filterEdit.setMaximumWidth(260)
+        toolbar.addWidget(self.filterEdit)
 
         # --- シグナル接続（既存のハンドラを使う） ---
         act_reload.triggered.connect(self.on_reload)
@@ -386,6 +1051,10 @@ class MainWindow(QMainWindow):
         act_power_off.triggered.connect(lambda: self._do_power("off"))
         act_reboot.triggered.connect(lambda: self._do_power("reboot"))
         act_wol.triggered.connect(self._do_wol)
+        act_startup.triggered.connect(lambda: self._do_orchestrate(STARTUP))
+        act_shutdown.triggered.connect(lambda: self._do_orchestrate(SHUTDOWN))
+        act_exec.triggered.connect(self._do_exec)
+        act_discover.triggered.connect(self._do_discover)
         act_add.triggered.connect(self.on_add)
         act_delete.triggered.connect(self.on_delete)
         act_save.triggered.connect(self.on_save)
@@ -398,29 +1067,6 @@ class MainWindow(QMainWindow):
         ):
             if btn is not None:
                 btn.hide()
-    
-    def on_table_sort(self, column_index):
-        """テーブルのソート後に内部データを同期"""
-        # 列インデックスとVM属性の対応
-        COL_MAP = {
-            0: "vm_name",
-            1: "host_ip",
-            2: "mac",
-            3: "method",
-            4: "user"
-        }
-
-        key_name = COL_MAP.get(column_index)
-        if not key_name:
-            return
-
-        # ソート（昇順／降順はQTableWidgetの設定に合わせてもよい）
-        self.vms.sort(key=lambda vm: getattr(vm, key_name) or "")
-        self.refresh_table()
-
-
-
-
 
 
 def main():
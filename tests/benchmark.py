@@ -0,0 +1,226 @@
+"""HomeVM Manager マイクロベンチマーク
+
+ネットワークに触れずに core.vm_info / core.vm_data / core.vm_control と
+/api/vms のコストを測り、結果をJSONに書き出す。
+
+    python tests/benchmark.py                      # bench_output.json に出力
+    python tests/benchmark.py --quick              # サイズを絞って短時間で
+    python tests/benchmark.py --compare old.json   # 以前の結果と比較
+"""
+import argparse
+import json
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from core.vm_data import VM, load_vm_list, save_vm_list, InventoryRepository, SqliteStorage
+from core.vm_info import ArpTable, LivenessProber, parse_arp_output, resolve_status
+from core.vm_control import build_magic_packet
+from core.logger import set_log_dir, shutdown_logging
+
+MIN_TIME = 0.2     # 1ケースあたりの最低計測時間（秒）
+MAX_ROUNDS = 10000
+
+
+def synthetic_macs(n: int) -> List[str]:
+    rnd = random.Random(n)
+    return [":".join(f"{rnd.randrange(256):02x}" for _ in range(6)) for _ in range(n)]
+
+
+def synthetic_vms(n: int) -> List[VM]:
+    return [VM(f"VM{i:06d}", f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}", mac,
+               "SSH" if i % 2 else "WinRM", "root", "virtual" if i % 3 else "physical")
+            for i, mac in enumerate(synthetic_macs(n))]
+
+
+def proc_arp_text(vms: List[VM]) -> str:
+    lines = ["IP address       HW type     Flags       HW address            Mask     Device"]
+    lines += [f"{vm.host_ip:<16} 0x1         0x2         {vm.mac}     *        eth0" for vm in vms]
+    return "\n".join(lines) + "\n"
+
+
+def arp_a_text(vms: List[VM]) -> str:
+    return "\n".join(f"? ({vm.host_ip}) at {vm.mac} [ether] on eth0  {vm.host_ip}  {vm.mac}"
+                     for vm in vms)
+
+
+class StubProber(LivenessProber):
+    """ネットワークを使わず、奇数オクテットだけ応答ありとみなす"""
+    def __init__(self):
+        super().__init__(use_icmp=False)
+
+    def probe_iter(self, ips):
+        for ip in ips:
+            yield ip, (0.001 if int(ip.rsplit(".", 1)[1]) % 2 else None)
+
+
+# ---------- 計測 ----------
+class Bench:
+    def __init__(self, min_time: float = MIN_TIME):
+        self.min_time = min_time
+        self.results: List[Dict] = []
+
+    def run(self, name: str, params: Dict, fn: Callable[[], object],
+            setup: Callable[[], object] = None) -> None:
+        samples: List[float] = []
+        total = 0.0
+        while (total < self.min_time or len(samples) < 3) and len(samples) < MAX_ROUNDS:
+            if setup:
+                setup()
+            t0 = time.perf_counter()
+            fn()
+            dt = time.perf_counter() - t0
+            samples.append(dt)
+            total += dt
+        samples.sort()
+        res = {
+            "name": name,
+            "params": params,
+            "rounds": len(samples),
+            "mean": statistics.fmean(samples),
+            "median": statistics.median(samples),
+            "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            "min": samples[0],
+        }
+        self.results.append(res)
+        label = ",".join(f"{k}={v}" for k, v in params.items())
+        print(f"{name:<32} {label:<20} median={res['median'] * 1e6:12.1f} us  rounds={res['rounds']}")
+
+
+def bench_arp(b: Bench, sizes: List[int], tmp: Path) -> None:
+    for n in sizes:
+        vms = synthetic_vms(n)
+        proc = tmp / f"arp-{n}"
+        proc.write_text(proc_arp_text(vms), encoding="utf-8")
+        table = ArpTable(ttl=3600, proc_path=proc)
+        table.refresh()
+        target = vms[-1].mac
+        b.run("arp.snapshot_proc", {"entries": n}, table.refresh)
+        b.run("arp.parse_arp_a", {"entries": n}, lambda t=arp_a_text(vms): parse_arp_output(t))
+        b.run("arp.get_ip_from_mac", {"entries": n}, lambda: table.lookup(target))
+
+
+def bench_inventory(b: Bench, sizes: List[int], tmp: Path) -> None:
+    for n in sizes:
+        vms = synthetic_vms(n)
+        path = tmp / f"vmlist-{n}.json"
+        save_vm_list(vms, path)
+        b.run("vm_data.save_vm_list", {"vms": n}, lambda: save_vm_list(vms, path))
+        b.run("vm_data.load_vm_list", {"vms": n}, lambda: load_vm_list(path))
+
+        repo = InventoryRepository(path, check_interval=0)
+        repo.snapshot()
+        b.run("vm_data.snapshot_cached", {"vms": n}, repo.snapshot)
+        b.run("vm_data.find_by_mac", {"vms": n}, lambda: repo.snapshot().get(vms[-1].mac))
+
+        db = SqliteStorage(tmp / f"vmlist-{n}.db")
+        db.save_all(vms)
+        vm = vms[n // 2]
+        b.run("vm_data.sqlite_upsert", {"vms": n}, lambda: db.upsert(vm))
+        db.close()
+
+
+def bench_resolve(b: Bench, sizes: List[int], tmp: Path) -> None:
+    prober = StubProber()
+    for n in sizes:
+        vms = synthetic_vms(n)
+        proc = tmp / f"arp-resolve-{n}"
+        proc.write_text(proc_arp_text(vms), encoding="utf-8")
+        arp = ArpTable(ttl=3600, proc_path=proc)
+        arp.refresh()
+
+        def resolve_all():
+            for vm in vms:
+                resolve_status(vm.mac, vm.host_ip, arp=arp, prober=prober)
+        b.run("vm_info.resolve_status", {"vms": n}, resolve_all)
+
+
+def bench_magic_packet(b: Bench) -> None:
+    macs = synthetic_macs(1000)
+    b.run("vm_control.build_magic_packet", {"macs": 1000},
+          lambda: [build_magic_packet(m) for m in macs])
+
+
+def bench_api(b: Bench, sizes: List[int], tmp: Path) -> None:
+    sys.path.insert(0, str(ROOT / "web"))
+    import app as web_app
+    for n in sizes:
+        path = tmp / f"api-{n}.json"
+        save_vm_list(synthetic_vms(n), path)
+        # 監視スレッドは起動せず、data/ 以下には何も書かない
+        client = web_app.create_app({"INVENTORY_PATH": path, "HISTORY_PATH": None,
+                                     "MONITOR_SERVICE": "off"}).test_client()
+        b.run("web.get_api_vms", {"vms": n}, lambda: client.get("/api/vms").get_data())
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current: List[Dict], baseline_path: Path) -> None:
+    old = {(r["name"], json.dumps(r["params"], sort_keys=True)): r
+           for r in json.loads(baseline_path.read_text(encoding="utf-8"))["results"]}
+    print(f"\n--- compare with {baseline_path} ---")
+    for r in current:
+        prev = old.get((r["name"], json.dumps(r["params"], sort_keys=True)))
+        if prev:
+            ratio = r["median"] / prev["median"] if prev["median"] else float("inf")
+            print(f"{r['name']:<32} {json.dumps(r['params']):<20} x{ratio:6.2f}")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--output", type=Path, default=ROOT / "bench_output.json")
+    ap.add_argument("--compare", type=Path, help="比較対象の過去の結果JSON")
+    ap.add_argument("--quick", action="store_true", help="サイズを絞って短時間で実行")
+    ap.add_argument("--min-time", type=float, default=MIN_TIME)
+    args = ap.parse_args()
+
+    arp_sizes = [10, 100, 1000] if args.quick else [10, 100, 1000, 10000]
+    inv_sizes = [10, 1000] if args.quick else [10, 100, 1000, 10000, 100000]
+    res_sizes = [10, 100] if args.quick else [10, 100, 1000]
+    api_sizes = [10, 100] if args.quick else [10, 100, 1000]
+
+    b = Bench(args.min_time)
+    tmp = Path(tempfile.mkdtemp(prefix="homevm-bench-"))
+    set_log_dir(tmp / "logs")  # 計測中のログは logs/ に残さない
+    try:
+        bench_arp(b, arp_sizes, tmp)
+        bench_inventory(b, inv_sizes, tmp)
+        bench_resolve(b, res_sizes, tmp)
+        bench_magic_packet(b)
+        bench_api(b, api_sizes, tmp)
+    finally:
+        shutdown_logging()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": b.results,
+    }
+    args.output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"\nwrote {args.output}")
+    if args.compare:
+        compare(b.results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
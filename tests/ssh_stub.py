@@ -0,0 +1,105 @@
+"""テスト用のローカルSSHサーバ（paramiko）
+
+exec要求に対して commands 辞書の (rc, stdout, stderr) を返す。
+(rc, [(stream, text, delay), ...]) を登録すると、delay 秒ずつ間を空けて
+stdout / stderr を順に送る（出力のストリーミング確認用）。
+受け付けたTCP接続数を connections に記録する。
+"""
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Tuple, Union
+
+import paramiko
+
+Reply = Union[Tuple[int, str, str], Tuple[int, List[Tuple[str, str, float]]]]
+
+_HOST_KEY = paramiko.RSAKey.generate(1024)
+
+
+class _Server(paramiko.ServerInterface):
+    def __init__(self, stub: "SshStubServer"):
+        self.stub = stub
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (self.stub.user, self.stub.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED_OPEN_REQUEST
+
+    def check_channel_exec_request(self, channel, command):
+        cmd = command.decode("utf-8")
+        self.stub.executed.append(cmd)
+        threading.Thread(target=self.stub._reply, args=(channel, cmd), daemon=True).start()
+        return True
+
+
+class SshStubServer:
+    def __init__(self, user: str = "root", password: str = "secret",
+                 commands: Dict[str, Union[Reply, Callable[[str], Reply]]] = None):
+        self.user = user
+        self.password = password
+        self.commands = commands or {}
+        self.executed: List[str] = []
+        self.connections = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(16)
+        self.port = self._sock.getsockname()[1]
+        self._transports: List[paramiko.Transport] = []
+        self._closed = False
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def _accept_loop(self):
+        while not self._closed:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            t = paramiko.Transport(conn)
+            t.add_server_key(_HOST_KEY)
+            t.start_server(server=_Server(self))
+            self._transports.append(t)
+
+    def _reply(self, channel, cmd: str):
+        # exec要求への応答（成功通知）がクライアントへ届くのを待ってから返す
+        time.sleep(0.02)
+        reply = self.commands.get(cmd, (0, "", ""))
+        if callable(reply):
+            reply = reply(cmd)
+        if len(reply) == 2:
+            rc, script = reply
+            for stream, text, delay in script:
+                time.sleep(delay)
+                send = channel.sendall if stream == "stdout" else channel.sendall_stderr
+                send(text.encode("utf-8"))
+            channel.send_exit_status(rc)
+            channel.close()
+            return
+        rc, out, err = reply
+        if out:
+            channel.sendall(out.encode("utf-8"))
+        if err:
+            channel.sendall_stderr(err.encode("utf-8"))
+        channel.send_exit_status(rc)
+        channel.close()
+
+    def drop_connections(self):
+        """サーバ側から全セッションを切断する"""
+        for t in self._transports:
+            t.close()
+        self._transports.clear()
+
+    def close(self):
+        self._closed = True
+        self.drop_connections()
+        self._sock.close()
@@ -0,0 +1,477 @@
+import unittest
+import paramiko
+import queue
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+# Add project root to path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.conn_pool import ConnectionPool
+from core.vm_data import VM
+from core.jobs import JobQueue, JobQueueFull, DONE, FAILED
+from core.vm_control import (SshClient, power_action_batch, build_magic_packet, directed_broadcast, wake_on_lan,
+                             HypervisorBackend, ESXI_INVENTORY_CMD, ESXI_STATES_CMD, run_command_batch)
+from core.vm_info import LivenessProber, sweep_status
+from core.orchestrator import PowerOrchestrator, DependencyError, STARTUP, SHUTDOWN
+from core.logger import set_log_dir, shutdown_logging
+from tests.ssh_stub import SshStubServer
+
+_log_dir = None
+
+
+def setUpModule():
+    # テスト中のログは一時ディレクトリへ（logs/homevm.log に書かない）
+    global _log_dir
+    _log_dir = tempfile.TemporaryDirectory()
+    set_log_dir(_log_dir.name)
+
+
+def tearDownModule():
+    shutdown_logging()
+    _log_dir.cleanup()
+
+
+class TestSshPool(unittest.TestCase):
+    def setUp(self):
+        self.server = SshStubServer(commands={"uptime": (0, "up 3 days", "")})
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.close()
+
+    def _run(self, cmd):
+        with SshClient("127.0.0.1", "root", "secret", port=self.server.port, pool=self.pool) as cli:
+            return cli.run(cmd)
+
+    def test_reuses_transport(self):
+        """同じホストへの2回目以降はハンドシェイクを省略するか"""
+        self.assertEqual(self._run("uptime"), (0, "up 3 days", ""))
+        self.assertEqual(self._run("uptime"), (0, "up 3 days", ""))
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_wrong_password_not_pooled(self):
+        """認証済みの接続があっても、違うパスワードでは再利用せず認証に失敗するか"""
+        self._run("uptime")
+        with self.assertRaises(paramiko.AuthenticationException):
+            with SshClient("127.0.0.1", "root", "wrong", port=self.server.port, pool=self.pool) as cli:
+                cli.run("uptime")
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(self._run("uptime"), (0, "up 3 days", ""))
+
+    def test_reconnects_after_drop(self):
+        """サーバ側で切断された接続は破棄して再接続するか"""
+        self._run("uptime")
+        self.server.drop_connections()
+        self.assertEqual(self._run("uptime"), (0, "up 3 days", ""))
+        self.assertEqual(self.server.connections, 2)
+
+    def test_power_action_discards_connection(self):
+        """電源操作後の接続はプールに戻さないか"""
+        with SshClient("127.0.0.1", "root", "secret", port=self.server.port, pool=self.pool) as cli:
+            ok, _ = cli.power_action("off")
+        self.assertTrue(ok)
+        self.assertEqual(self.server.executed, ["sudo shutdown -h now"])
+        self.assertEqual(len(self.pool), 0)
+
+
+class TestPowerBatch(unittest.TestCase):
+    def test_parallel_fan_out(self):
+        """複数VMへの電源操作が並列に実行され、VMごとの結果が返るか"""
+        vms = [VM(f"VM{i}", f"10.0.0.{i}", f"00:00:00:00:00:{i:02x}", "SSH", "root") for i in range(1, 11)]
+        vms.append(VM("NoIP", "", "00:00:00:00:00:ff", "SSH", "root"))
+
+        def slow_action(method, host, user, password, action):
+            time.sleep(0.2)
+            return True, f"{action} {host}"
+
+        start = time.monotonic()
+        with patch("core.vm_control.power_action_unified", side_effect=slow_action):
+            results = list(power_action_batch(vms, "off", lambda vm: "pw", max_workers=16))
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(len(results), 11)
+        self.assertLess(elapsed, 1.0)
+        by_name = {r.vm_name: r for r in results}
+        self.assertTrue(by_name["VM3"].ok)
+        self.assertEqual(by_name["VM3"].message, "off 10.0.0.3")
+        self.assertGreaterEqual(by_name["VM3"].elapsed, 0.2)
+        self.assertFalse(by_name["NoIP"].ok)
+
+    def test_wol_rejects_virtual(self):
+        """仮想マシンへのWOLは失敗として返るか"""
+        vm = VM("Guest", "", "00:00:00:00:00:01", "SSH", "root", "virtual")
+        [res] = power_action_batch([vm], "wol")
+        self.assertFalse(res.ok)
+
+
+class TestWakeOnLan(unittest.TestCase):
+    def setUp(self):
+        self.rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rx.bind(("127.0.0.1", 0))
+        self.rx.settimeout(1.0)
+        self.addCleanup(self.rx.close)
+        self.port = self.rx.getsockname()[1]
+        self.vms = [VM(f"PC{i}", f"10.0.0.{i}", f"00:11:22:33:44:{i:02x}", "SSH", "root", "physical")
+                    for i in (1, 2)]
+
+    def test_bulk_send(self):
+        """物理マシンだけに repeat 回ずつ送り、仮想マシンは失敗として返るか"""
+        guest = VM("Guest", "", "00:11:22:33:44:ff", "SSH", "root", "virtual")
+        results = list(wake_on_lan(self.vms + [guest], repeat=3, interval=0,
+                                   broadcast="127.0.0.1", port=self.port, directed=False))
+        by_name = {r.vm_name: r for r in results}
+        self.assertTrue(by_name["PC1"].sent)
+        self.assertEqual(by_name["PC1"].destinations, ["127.0.0.1"])
+        self.assertIsNone(by_name["PC1"].alive)
+        self.assertFalse(by_name["Guest"].ok)
+        packets = [self.rx.recv(1024) for _ in range(6)]
+        expected = {build_magic_packet(vm.mac) for vm in self.vms}
+        self.assertEqual(set(packets), expected)
+        self.assertEqual(packets.count(build_magic_packet("00:11:22:33:44:01")), 3)
+
+    def test_directed_broadcast(self):
+        """ホストIPからサブネットのブロードキャストアドレスを求めるか"""
+        self.assertEqual(directed_broadcast("192.168.1.20"), "192.168.1.255")
+        self.assertEqual(directed_broadcast("10.1.2.3", 16), "10.1.255.255")
+        self.assertIsNone(directed_broadcast("not-an-ip"))
+
+    def test_wake_and_wait(self):
+        """応答したホストは time_to_alive 付きで、応答しないホストはタイムアウトで返るか"""
+        class BootingProber(LivenessProber):
+            """10.0.0.1 は3回目の確認から応答する"""
+            def __init__(self):
+                super().__init__(use_icmp=False)
+                self.calls = 0
+
+            def probe_iter(self, ips):
+                self.calls += 1
+                for ip in ips:
+                    yield ip, (0.001 if ip == "10.0.0.1" and self.calls >= 3 else None)
+
+        results = list(wake_on_lan(self.vms, interval=0, broadcast="127.0.0.1", port=self.port,
+                                   directed=False, wait=True, timeout=1.0, poll_interval=0.05,
+                                   prober=BootingProber()))
+        self.assertEqual([r.vm_name for r in results], ["PC1", "PC2"])
+        up, down = results
+        self.assertTrue(up.alive)
+        self.assertEqual(up.ip, "10.0.0.1")
+        self.assertGreaterEqual(up.time_to_alive, 0.1)
+        self.assertFalse(down.alive)
+        self.assertFalse(down.ok)
+
+
+class FakeLab:
+    """電源状態を辞書で持つ疑似ラボ（起動・停止は delay 秒後に反映）"""
+    def __init__(self, running, delay=0.1):
+        self.running = dict(running)
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _set_later(self, mac, value):
+        threading.Timer(self.delay, lambda: self.running.__setitem__(mac, value)).start()
+
+    def resolver(self, mac, ip):
+        return ("稼働中" if self.running[mac] else "停止中"), ip
+
+    def wake(self, mac):
+        with self.lock:
+            self.calls.append(("wol", mac))
+        self._set_later(mac, True)
+
+    def start_guest(self, guest, host):
+        with self.lock:
+            self.calls.append(("on", guest.mac))
+        self.assertion = self.running[host.mac]  # 起動時点でホストが稼働しているか
+        self._set_later(guest.mac, True)
+        return True, "Power on requested"
+
+    def stop_guest(self, guest, host, password):
+        with self.lock:
+            self.calls.append(("host-off", guest.mac))
+        self._set_later(guest.mac, False)
+        return True, "Power off requested"
+
+    def power(self, method, host, user, password, action):
+        mac = next(m for m, ip in self.ips.items() if ip == host)
+        with self.lock:
+            self.calls.append((action, mac))
+        self._set_later(mac, False)
+        return True, "ok"
+
+
+class TestOrchestrator(unittest.TestCase):
+    def setUp(self):
+        self.host = VM("ESXi-HOST", "10.0.0.1", "00:00:00:00:00:01", "SSH", "root", "physical")
+        self.guests = [VM(f"G{i}_ESXiVM", f"10.0.0.1{i}", f"00:00:00:00:00:1{i}", "SSH", "root",
+                          "virtual", runs_on="ESXi-HOST") for i in range(3)]
+        self.vms = [self.host] + self.guests
+
+    def orchestrator(self, lab, **kw):
+        lab.ips = {vm.mac: vm.host_ip for vm in self.vms}
+        return PowerOrchestrator(self.vms, password_for=lambda vm: "pw", guest_starter=lab.start_guest,
+                                 poll_interval=0.02, resolver=lab.resolver, wake=lab.wake,
+                                 power=lab.power, **kw)
+
+    def test_startup_order_and_parallelism(self):
+        """ハイパーバイザーの起動を待ってからゲストを並列に起動し、クリティカルパスを返すか"""
+        lab = FakeLab({vm.mac: False for vm in self.vms})
+        plan = self.orchestrator(lab).run(STARTUP, ["G0_ESXiVM"])  # 依存先のホストは自動で加わる
+        self.assertTrue(plan.ok, [s.message for s in plan.steps])
+        steps = {s.vm_name: s for s in plan.steps}
+        self.assertEqual(set(steps), {"ESXi-HOST", "G0_ESXiVM"})
+        self.assertTrue(lab.assertion)
+        self.assertGreaterEqual(steps["G0_ESXiVM"].start, steps["ESXi-HOST"].end)
+        self.assertEqual(plan.critical_path, ["ESXi-HOST", "G0_ESXiVM"])
+        self.assertAlmostEqual(plan.critical_path_time, steps["G0_ESXiVM"].end)
+
+        lab = FakeLab({vm.mac: False for vm in self.vms})
+        plan = self.orchestrator(lab).run(STARTUP)
+        guest_steps = [s for s in plan.steps if s.vm_name != "ESXi-HOST"]
+        # ゲスト3台は並列なので、全体はホスト＋ゲスト1台分程度で終わる
+        self.assertLess(max(s.end for s in guest_steps) - min(s.start for s in guest_steps), 0.3)
+
+    def test_shutdown_guests_first(self):
+        """ゲストが止まってからハイパーバイザーを停止するか"""
+        lab = FakeLab({vm.mac: True for vm in self.vms})
+        plan = self.orchestrator(lab).run(SHUTDOWN, ["ESXi-HOST"])
+        self.assertTrue(plan.ok, [s.message for s in plan.steps])
+        self.assertEqual(len(plan.steps), 4)
+        self.assertEqual(lab.calls[-1], ("off", self.host.mac))
+        self.assertEqual(plan.critical_path[-1], "ESXi-HOST")
+
+    def test_shutdown_guests_via_hypervisor(self):
+        """guest_stopper があればゲストのパスワードなしでホスト経由で停止するか"""
+        lab = FakeLab({vm.mac: True for vm in self.vms})
+        orch = self.orchestrator(lab, guest_stopper=lab.stop_guest)
+        orch.password_for = lambda vm: "pw" if vm is self.host else None
+        plan = orch.run(SHUTDOWN, ["ESXi-HOST"])
+        self.assertTrue(plan.ok, [s.message for s in plan.steps])
+        self.assertEqual(sorted(lab.calls[:-1]), sorted(("host-off", g.mac) for g in self.guests))
+        self.assertEqual(lab.calls[-1], ("off", self.host.mac))
+
+    def test_failed_host_skips_guests(self):
+        """ホストが起動しなければゲストは実行せず skipped になるか"""
+        lab = FakeLab({vm.mac: False for vm in self.vms})
+        lab.wake = lambda mac: None  # パケットが届かない
+        plan = self.orchestrator(lab, ready_timeout=0.1).run(STARTUP)
+        steps = {s.vm_name: s for s in plan.steps}
+        self.assertFalse(steps["ESXi-HOST"].ok)
+        self.assertTrue(all(steps[g.vm_name].skipped for g in self.guests))
+        self.assertNotIn("on", [c[0] for c in lab.calls])
+
+    def test_invalid_dependencies(self):
+        """存在しないホストや循環した runs_on は拒否されるか"""
+        self.host.runs_on = "G0_ESXiVM"
+        with self.assertRaises(DependencyError):
+            PowerOrchestrator(self.vms)
+        self.host.runs_on = "nowhere"
+        with self.assertRaises(DependencyError):
+            PowerOrchestrator(self.vms)
+
+
+ESXI_GETALLVMS = """Vmid        Name                    File                                 Guest OS          Version   Annotation
+1      RHEL94-1_ESXiVM     [datastore1] RHEL94-1/RHEL94-1.vmx        rhel9_64Guest     vmx-21
+2      Win11-1_ESXiVM      [datastore1] Win11-1/Win11-1.vmx          windows11_64Guest vmx-21    test box
+3      Renamed Guest       [datastore1] Win11-2/Win11-2.vmx          windows11_64Guest vmx-21
+#MACS
+1 00:0c:29:00:00:01
+2 00:0c:29:00:00:02
+3 00:0c:29:00:00:03
+"""
+ESXI_STATES = "1 Powered on\n2 Powered off\n3 Suspended\n"
+
+
+class TestHypervisorBackend(unittest.TestCase):
+    def setUp(self):
+        self.server = SshStubServer(commands={
+            ESXI_INVENTORY_CMD: (0, ESXI_GETALLVMS, ""),
+            ESXI_STATES_CMD: (0, ESXI_STATES, ""),
+            "vim-cmd vmsvc/power.on 2": (0, "Powering on VM:", ""),
+        })
+        self.pool = ConnectionPool()
+        self.host = VM("ESXi-HOST", "127.0.0.1", "00:00:00:00:01:00", "SSH", "root", "physical")
+        self.guests = [
+            VM("RHEL94-1_ESXiVM", "10.0.0.11", "00-0C-29-00-00-01", "SSH", "root", "virtual", runs_on="ESXi-HOST"),
+            VM("Win11-1_ESXiVM", "10.0.0.12", "00:0c:29:00:00:02", "WinRM", "admin", "virtual", runs_on="ESXi-HOST"),
+            # MAC が一致しないゲストは名前で対応付ける
+            VM("Renamed Guest", "", "00:0c:29:ff:ff:ff", "WinRM", "admin", "virtual", runs_on="ESXi-HOST"),
+            VM("Standalone", "10.0.0.20", "00:0c:29:00:00:20", "SSH", "root", "virtual"),
+        ]
+        vms = [self.host] + self.guests
+        self.backend = HypervisorBackend(lambda: vms, lambda vm: "secret",
+                                         pool=self.pool, port=self.server.port)
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.close()
+
+    def test_guest_states_single_session(self):
+        """ホスト上の全ゲストの状態を1回の問い合わせで取得するか"""
+        states = self.backend.guest_states(self.guests)
+        self.assertEqual(states, {
+            "00-0C-29-00-00-01": "稼働中",
+            "00:0c:29:00:00:02": "停止中",
+            "00:0c:29:ff:ff:ff": "停止中",
+        })
+        self.backend.guest_states(self.guests)
+        # 一覧はキャッシュし、2回目は状態取得だけ。接続はプールで使い回す
+        self.assertEqual(self.server.executed, [ESXI_INVENTORY_CMD, ESXI_STATES_CMD, ESXI_STATES_CMD])
+        self.assertEqual(self.server.connections, 1)
+
+    def test_sweep_uses_hypervisor(self):
+        """sweep_status がハイパーバイザーで分かったゲストを個別に確認しないか"""
+        prober = LivenessProber(use_icmp=False)
+        with patch.object(prober, "probe_iter", side_effect=lambda ips: ((ip, None) for ip in ips)) as probe:
+            results = {vm.vm_name: status for vm, status, _ in
+                       sweep_status(self.guests, prober=prober, guest_status=self.backend.guest_states)}
+        self.assertEqual(results["RHEL94-1_ESXiVM"], "稼働中")
+        self.assertEqual(results["Standalone"], "停止中")
+        self.assertEqual(list(probe.call_args[0][0]), ["10.0.0.20"])
+
+    def test_power_through_hypervisor(self):
+        """ゲストの電源操作がゲストのパスワードなしでホスト経由で行われるか"""
+        results = list(power_action_batch([self.guests[1]], "wol", hypervisor=self.backend))
+        self.assertTrue(results[0].ok, results[0].message)
+        self.assertEqual(self.server.executed[-1], "vim-cmd vmsvc/power.on 2")
+        self.assertFalse(self.backend.manages(self.guests[3]))
+
+    def test_unreachable_host_falls_back(self):
+        """ホストに届かない場合はゲストを結果に含めず、通常の確認に回すか"""
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.backend.port = s.getsockname()[1]  # 待ち受けていないポート
+        self.assertEqual(self.backend.guest_states(self.guests), {})
+
+    def test_power_falls_back_to_guest(self):
+        """ホストのパスワードが無い・ホストに届かない場合、ゲストへ直接 SSH/WinRM するか"""
+        guest = self.guests[1]
+        with patch("core.vm_control.power_action_unified", return_value=(True, "ok")) as direct:
+            self.backend.password_for = lambda vm: None
+            results = list(power_action_batch([guest], "off", lambda vm: "guest-pw", hypervisor=self.backend))
+            self.assertTrue(results[0].ok, results[0].message)
+            direct.assert_called_once_with("WinRM", "10.0.0.12", "admin", "guest-pw", "off")
+
+            self.backend.password_for = lambda vm: "secret"
+            with socket.socket() as s:
+                s.bind(("127.0.0.1", 0))
+                self.backend.port = s.getsockname()[1]
+            results = list(power_action_batch([guest], "reboot", lambda vm: "guest-pw", hypervisor=self.backend))
+            self.assertTrue(results[0].ok, results[0].message)
+            self.assertEqual(direct.call_args[0][4], "reboot")
+
+            # パスワードが無い・電源ONはゲスト側からできないので、そのまま失敗を返す
+            results = list(power_action_batch([guest], "off", hypervisor=self.backend))
+            self.assertFalse(results[0].ok)
+            results = list(power_action_batch([guest], "wol", lambda vm: "guest-pw", hypervisor=self.backend))
+            self.assertFalse(results[0].ok)
+        self.assertEqual(direct.call_count, 2)
+
+
+class TestRemoteExec(unittest.TestCase):
+    def setUp(self):
+        script = [("stdout", "Updating\n", 0.0), ("stderr", "warning: x\n", 0.1), ("stdout", "Complete!\n", 0.2)]
+        self.server = SshStubServer(commands={"dnf -y update": (0, script), "false": (1, "", "")})
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.close_all()
+        self.server.close()
+
+    def test_stream_interleaves(self):
+        """stdout と stderr が届いた順に、終了を待たずに返るか"""
+        start = time.monotonic()
+        got = []
+        with SshClient("127.0.0.1", "root", "secret", port=self.server.port, pool=self.pool) as cli:
+            for stream, data in cli.stream("dnf -y update"):
+                got.append((stream, data, time.monotonic() - start))
+        self.assertEqual([(s, d) for s, d, _ in got],
+                         [("stdout", "Updating\n"), ("stderr", "warning: x\n"),
+                          ("stdout", "Complete!\n"), ("exit", 0)])
+        self.assertLess(got[0][2], got[-1][2] - 0.2)
+
+    def test_batch_parallel(self):
+        """複数ホストで並列に実行し、ホストごとに出力と終了コードが届くか"""
+        vms = [VM(f"RHEL{i}", "127.0.0.1", f"00:00:00:00:00:3{i}", "SSH", "root") for i in range(4)]
+        vms.append(VM("Win", "127.0.0.1", "00:00:00:00:00:40", "WinRM", "admin"))
+        start = time.monotonic()
+        chunks = list(run_command_batch(vms, "dnf -y update", lambda vm: "secret",
+                                        pool=self.pool, port=self.server.port))
+        self.assertLess(time.monotonic() - start, 1.5)  # 1ホスト約0.3秒 × 4台を並列に
+        final = {c.vm_name: c for c in chunks if c.final}
+        self.assertEqual(len(final), 5)
+        self.assertTrue(all(final[f"RHEL{i}"].rc == 0 for i in range(4)))
+        self.assertEqual((final["Win"].stream, final["Win"].data), ("error", "SSH only"))
+        out = "".join(c.data for c in chunks if c.vm_name == "RHEL2" and c.stream == "stdout")
+        self.assertEqual(out, "Updating\nComplete!\n")
+        # 終了コードが0以外でも exit として返る
+        res = list(run_command_batch(vms[:1], "false", lambda vm: "secret", pool=self.pool, port=self.server.port))
+        self.assertEqual((res[-1].stream, res[-1].rc), ("exit", 1))
+
+    def test_batch_bounded_queue(self):
+        """読み手が遅くても、たまる出力は queue_size までで欠けずに届くか"""
+        vms = [VM(f"RHEL{i}", "127.0.0.1", f"00:00:00:00:00:3{i}", "SSH", "root") for i in range(3)]
+        chunks = []
+        with patch("core.vm_control.queue.Queue", wraps=queue.Queue) as made:
+            for chunk in run_command_batch(vms, "dnf -y update", lambda vm: "secret",
+                                           pool=self.pool, port=self.server.port, queue_size=1):
+                time.sleep(0.05)
+                chunks.append(chunk)
+        made.assert_called_once_with(maxsize=1)
+        for i in range(3):
+            out = "".join(c.data for c in chunks if c.vm_name == f"RHEL{i}" and c.stream == "stdout")
+            self.assertEqual(out, "Updating\nComplete!\n")
+        self.assertEqual(sum(c.final for c in chunks), 3)
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.jobs = JobQueue(max_workers=2, max_pending=1)
+
+    def tearDown(self):
+        self.jobs.shutdown()
+
+    def test_submit_returns_immediately(self):
+        """遅い操作でも submit はすぐ返り、完了後に結果を参照できるか"""
+        def slow():
+            time.sleep(0.3)
+            return True, "done"
+        start = time.monotonic()
+        job = self.jobs.submit("power", slow, {"action": "off"})
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertFalse(job.done)
+        job = self.jobs.wait(job.id, timeout=5)
+        self.assertEqual(job.state, DONE)
+        self.assertEqual(job.to_dict()["message"], "done")
+        self.assertGreaterEqual(job.to_dict()["elapsed"], 0.3)
+
+    def test_error_and_bound(self):
+        """例外は failed になり、上限を超える投入は拒否されるか"""
+        gate = threading.Event()
+
+        def blocked():
+            gate.wait(5)
+            return True, ""
+
+        def boom():
+            raise RuntimeError("ssh timeout")
+        first = [self.jobs.submit("power", blocked) for _ in range(2)]
+        failing = self.jobs.submit("power", boom)  # 待ち枠を使う
+        with self.assertRaises(JobQueueFull):
+            self.jobs.submit("power", blocked)
+        gate.set()
+        job = self.jobs.wait(failing.id, timeout=5)
+        self.assertEqual(job.state, FAILED)
+        self.assertEqual(job.message, "ssh timeout")
+        self.assertEqual([j.id for j in self.jobs.list()], [failing.id] + [j.id for j in reversed(first)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,11 +5,42 @@ from pathlib import Path
 import json
 import tempfile
 import shutil
+import time
+import socket
+import struct
+import unittest.mock
 
 # Add project root to path
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-from core.vm_data import VM, load_vm_list, save_vm_list
+from core.vm_data import (VM, load_vm_list, save_vm_list, InventoryRepository,
+                          InventoryCorruptError, SqliteStorage)
+from core.conn_pool import ConnectionPool
+from core.history import StatusHistory, HistoryLocked, open_history
+from core.metrics import Registry
+from core import metrics
+from core.monitor import StatusHub, RESYNC, PollScheduler, StatusMonitor
+from core.logger import RateLimitFilter, JsonFormatter, ChangeLog, set_log_dir, shutdown_logging
+from core.status_service import MonitorService, MonitorClient, parse_address
+import logging
+from core.vm_info import (sweep_status, resolve_status, ArpTable, LivenessProber, icmp_available,
+                          parse_proc_arp, parse_arp_output, discover_subnets, configured_subnets)
+from core.vm_info import _parse_icmp_reply
+
+_log_dir = None
+
+
+def setUpModule():
+    # テスト中のログは一時ディレクトリへ（logs/homevm.log に書かない）
+    global _log_dir
+    _log_dir = tempfile.TemporaryDirectory()
+    set_log_dir(_log_dir.name)
+
+
+def tearDownModule():
+    shutdown_logging()
+    _log_dir.cleanup()
+
 
 class TestVMCore(unittest.TestCase):
     def setUp(self):
@@ -56,5 +87,716 @@ class TestVMCore(unittest.TestCase):
         self.assertEqual(loaded, [])
         self.assertTrue(self.data_file.exists()) # 自動生成されるはず
 
+    def test_corrupt_recovers_from_backup(self):
+        """壊れたファイルは消さずに退避し、.bak から復旧するか"""
+        vms = [VM("VM1", "1.1.1.1", "00:00:00:00:00:01", "SSH", "user1")]
+        save_vm_list(vms, self.data_file)
+        save_vm_list(vms, self.data_file)  # 2回目で .bak ができる
+        self.data_file.write_text("[{broken", encoding="utf-8")
+
+        loaded = load_vm_list(self.data_file)
+        self.assertEqual([v.vm_name for v in loaded], ["VM1"])
+        self.assertEqual(self.data_file.read_text(encoding="utf-8"), "[{broken")
+        self.assertTrue(list(Path(self.test_dir).glob("vmlist.json.corrupt-*")))
+
+    def test_corrupt_without_backup(self):
+        """バックアップもなければ空で上書きせずに例外にするか"""
+        self.data_file.write_text("not json", encoding="utf-8")
+        with self.assertRaises(InventoryCorruptError):
+            load_vm_list(self.data_file)
+        self.assertEqual(self.data_file.read_text(encoding="utf-8"), "not json")
+
+class TestSqliteStorage(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.json_file = Path(self.test_dir) / "vmlist.json"
+        self.db_file = Path(self.test_dir) / "vmlist.db"
+        save_vm_list([
+            VM("VM1", "1.1.1.1", "00:00:00:00:00:01", "SSH", "user1"),
+            VM("VM2", "2.2.2.2", "00:00:00:00:00:02", "WinRM", "user2", "physical"),
+        ], self.json_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_seed_upsert_delete_export(self):
+        """JSONからの取り込み・1件単位の更新・JSONへの書き出し"""
+        st = SqliteStorage(self.db_file, seed_json=self.json_file)
+        self.assertEqual([v.vm_name for v in st.load()], ["VM1", "VM2"])
+
+        st.upsert(VM("VM1", "1.1.1.9", "00:00:00:00:00:01", "SSH", "user1"))
+        st.upsert(VM("VM3", "", "00:00:00:00:00:03", "SSH", "u"))
+        st.delete("VM2")
+        self.assertEqual([(v.vm_name, v.host_ip) for v in st.load()],
+                         [("VM1", "1.1.1.9"), ("VM3", "")])
+
+        out = Path(self.test_dir) / "export.json"
+        self.assertEqual(st.export_json(out), 2)
+        self.assertEqual([v.vm_name for v in load_vm_list(out)], ["VM1", "VM3"])
+        st.close()
+
+    def test_repository_sees_other_writer(self):
+        """別接続（別プロセス相当）の書き込みを検知して読み直すか"""
+        repo = InventoryRepository(SqliteStorage(self.db_file, seed_json=self.json_file), check_interval=0)
+        self.assertEqual(len(repo.snapshot()), 2)
+        other = SqliteStorage(self.db_file)
+        other.delete("VM1")
+        self.assertEqual([v.vm_name for v in repo.snapshot().vms], ["VM2"])
+        other.close()
+
+    def test_seed_only_empty_db(self):
+        """vmlist.json は空のDBにだけ取り込み、JSONが新しくなってもDBの内容を上書きしないか"""
+        st = SqliteStorage(self.db_file, seed_json=self.json_file)
+        st.upsert(VM("VM3", "", "00:00:00:00:00:03", "SSH", "u"))
+        st.close()
+
+        save_vm_list([VM("VM9", "", "00:00:00:00:00:09", "SSH", "u")], self.json_file)
+        st_mtime = self.json_file.stat().st_mtime + 60
+        os.utime(self.json_file, (st_mtime, st_mtime))
+        st = SqliteStorage(self.db_file, seed_json=self.json_file)
+        self.assertEqual([v.vm_name for v in st.load()], ["VM1", "VM2", "VM3"])
+        st.close()
+
+    def test_save_changes_keeps_other_writers(self):
+        """差分保存で、読み込み後に別接続が追加したVMを消さないか"""
+        repo = InventoryRepository(SqliteStorage(self.db_file, seed_json=self.json_file), check_interval=0)
+        base = repo.snapshot().vms
+        vms = repo.snapshot().copy_vms()
+        other = SqliteStorage(self.db_file)
+        other.upsert(VM("Web", "", "00:00:00:00:00:0a", "SSH", "u"))
+        other.close()
+
+        vms[0].host_ip = "1.1.1.9"
+        del vms[1]
+        vms.append(VM("GUI", "", "00:00:00:00:00:0b", "SSH", "u"))
+        snap = repo.save_changes(base, vms)
+        self.assertEqual([(v.vm_name, v.host_ip) for v in snap.vms],
+                         [("VM1", "1.1.1.9"), ("Web", ""), ("GUI", "")])
+        self.assertEqual([v.vm_name for v in repo.reload().vms], ["VM1", "Web", "GUI"])
+
+class TestInventoryRepository(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.data_file = Path(self.test_dir) / "vmlist.json"
+        save_vm_list([
+            VM("VM1", "1.1.1.1", "00:00:00:00:00:01", "SSH", "user1"),
+            VM("VM2", "2.2.2.2", "00:00:00:00:00:02", "WinRM", "user2", "physical"),
+        ], self.data_file)
+        self.repo = InventoryRepository(self.data_file, check_interval=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_indexes(self):
+        """MAC / 名前 / IP で引けるか"""
+        snap = self.repo.snapshot()
+        self.assertEqual(snap.get("00:00:00:00:00:02").vm_name, "VM2")
+        self.assertEqual(snap.find("VM1").mac, "00:00:00:00:00:01")
+        self.assertEqual(snap.by_ip["2.2.2.2"].vm_name, "VM2")
+        with self.assertRaises(TypeError):
+            snap.by_mac["x"] = snap.vms[0]
+
+    def test_snapshot_owns_copies(self):
+        """保存・追加に渡したVMや返されたVMを書き換えても、スナップショットは変わらないか"""
+        vms = self.repo.snapshot().copy_vms()
+        self.repo.save(vms)
+        vms[0].host_ip = "9.9.9.9"
+        vm3 = VM("VM3", "", "00:00:00:00:00:03", "SSH", "u")
+        self.repo.add(vm3)
+        vm3.host_ip = "9.9.9.9"
+        [updated] = self.repo.update_ips({"VM2": "2.2.2.9"})
+        updated.host_ip = "9.9.9.9"
+        snap = self.repo.snapshot()
+        self.assertEqual([v.host_ip for v in snap.vms], ["1.1.1.1", "2.2.2.9", ""])
+        self.assertNotIn("9.9.9.9", snap.by_ip)
+
+    def test_cached_until_file_changes(self):
+        """ファイルが変わらない限り再解析しないか"""
+        snap1 = self.repo.snapshot()
+        self.assertIs(self.repo.snapshot(), snap1)
+
+        save_vm_list([VM("VM3", "", "00:00:00:00:00:03", "SSH", "u")], self.data_file)
+        snap2 = self.repo.snapshot()
+        self.assertIsNot(snap2, snap1)
+        self.assertEqual([v.vm_name for v in snap2.vms], ["VM3"])
+        self.assertGreater(snap2.revision, snap1.revision)
+
+    def test_add_remove(self):
+        """追加・削除がファイルとスナップショットの両方に反映されるか"""
+        self.assertTrue(self.repo.add(VM("VM3", "", "00:00:00:00:00:03", "SSH", "u")))
+        self.assertFalse(self.repo.add(VM("VM3", "", "00:00:00:00:00:04", "SSH", "u")))
+        self.assertEqual(self.repo.remove("00:00:00:00:00:01"), 1)
+
+        names = [v.vm_name for v in self.repo.snapshot().vms]
+        self.assertEqual(names, ["VM2", "VM3"])
+        self.assertEqual([v.vm_name for v in load_vm_list(self.data_file)], names)
+
+class TestSweep(unittest.TestCase):
+    def test_sweep_parallel(self):
+        """全VMが並列に確認され、所要時間が1ホスト分程度で済むか"""
+        vms = [VM(f"VM{i}", "", f"00:00:00:00:00:{i:02x}", "SSH", "root") for i in range(50)]
+
+        def slow_resolver(mac, last_ip):
+            time.sleep(0.2)
+            return ("稼働中", "10.0.0.1")
+
+        start = time.monotonic()
+        results = list(sweep_status(vms, max_workers=64, resolver=slow_resolver))
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(len(results), 50)
+        self.assertEqual({vm.mac for vm, _, _ in results}, {vm.mac for vm in vms})
+        self.assertLess(elapsed, 1.0)
+
+    def test_sweep_skips_failures(self):
+        """例外を出したホストは結果から除外されるか"""
+        vms = [VM("OK", "", "00:00:00:00:00:01", "SSH", "root"),
+               VM("NG", "", "00:00:00:00:00:02", "SSH", "root")]
+
+        def resolver(mac, last_ip):
+            if mac.endswith("02"):
+                raise RuntimeError("boom")
+            return ("停止中", None)
+
+        results = list(sweep_status(vms, resolver=resolver))
+        self.assertEqual([(vm.vm_name, st) for vm, st, _ in results], [("OK", "停止中")])
+
+PROC_ARP_SAMPLE = """IP address       HW type     Flags       HW address            Mask     Device
+192.168.24.229   0x1         0x2         b8:ca:3a:ac:22:d9     *        eth0
+192.168.24.199   0x1         0x2         00:0C:29:D2:59:32     *        eth0
+192.168.24.50    0x1         0x0         00:00:00:00:00:00     *        eth0
+"""
+
+class TestArpTable(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.proc_file = Path(self.test_dir) / "arp"
+        self.proc_file.write_text(PROC_ARP_SAMPLE, encoding="utf-8")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_parse_proc_arp(self):
+        """/proc/net/arp の解析と未解決エントリの除外"""
+        table = parse_proc_arp(PROC_ARP_SAMPLE)
+        self.assertEqual(table, {
+            "b8:ca:3a:ac:22:d9": "192.168.24.229",
+            "00:0c:29:d2:59:32": "192.168.24.199",
+        })
+
+    def test_parse_arp_output_windows(self):
+        """Windows形式（ハイフン区切り）の arp -a 出力"""
+        text = "  192.168.24.220        00-0c-29-3b-cb-25     動的\n"
+        self.assertEqual(parse_arp_output(text), {"00:0c:29:3b:cb:25": "192.168.24.220"})
+
+    def test_snapshot_ttl(self):
+        """TTL内は再読込せず、refreshで取り直すか"""
+        arp = ArpTable(ttl=60, proc_path=self.proc_file)
+        self.assertEqual(arp.lookup("00-0C-29-D2-59-32"), "192.168.24.199")
+
+        self.proc_file.write_text(PROC_ARP_SAMPLE.replace("192.168.24.199", "192.168.24.200"), encoding="utf-8")
+        self.assertEqual(arp.lookup("00:0c:29:d2:59:32"), "192.168.24.199")
+        arp.refresh()
+        self.assertEqual(arp.lookup("00:0c:29:d2:59:32"), "192.168.24.200")
+
+class TestLivenessProber(unittest.TestCase):
+    def setUp(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(16)
+        self.port = self.server.getsockname()[1]
+        self.prober = LivenessProber(timeout=0.5, tcp_ports=(self.port,), use_icmp=False)
+
+    def tearDown(self):
+        self.server.close()
+
+    def test_tcp_probe_localhost(self):
+        """localhostへのTCP接続で稼働判定とRTT記録ができるか"""
+        result = self.prober.probe_many(["127.0.0.1", "255.255.255.255"])
+        self.assertIsNotNone(result["127.0.0.1"])
+        self.assertGreaterEqual(result["127.0.0.1"], 0.0)
+        self.assertIsNone(result["255.255.255.255"])
+        self.assertIn("127.0.0.1", self.prober.rtt)
+
+    def test_host_metrics_optional(self):
+        """host_metrics=False（サブネット探索）ではホスト別RTTのラベルを増やさないか"""
+        metrics.PROBE_HOST_RTT.remove(host="127.0.0.1")
+        LivenessProber(timeout=0.5, tcp_ports=(self.port,), use_icmp=False,
+                       host_metrics=False).probe_many(["127.0.0.1"])
+        self.assertIsNone(metrics.PROBE_HOST_RTT.value(host="127.0.0.1"))
+        self.prober.probe_many(["127.0.0.1"])
+        self.assertIsNotNone(metrics.PROBE_HOST_RTT.value(host="127.0.0.1"))
+
+    @unittest.skipUnless(icmp_available(), "unprivileged ICMP sockets are not allowed (net.ipv4.ping_group_range)")
+    def test_icmp_probe_localhost(self):
+        """ICMPデータグラムソケットで localhost の応答とRTTを取れるか"""
+        prober = LivenessProber(timeout=1.0, use_icmp=True)
+        result = prober.probe_many(["127.0.0.1"])
+        self.assertIsNotNone(result["127.0.0.1"])
+        self.assertGreaterEqual(result["127.0.0.1"], 0.0)
+
+    def test_parse_icmp_reply(self):
+        """Echo Reply から seq を取り出し、IPヘッダ付き（macOS）も扱い、それ以外は無視するか"""
+        reply = struct.pack("!BBHHH", 0, 0, 0x1234, 0x0042, 7) + b"homevm" + b"\0" * 8
+        self.assertEqual(_parse_icmp_reply(reply), 7)
+        ip_header = bytes([0x45, 0, 0, 20 + len(reply)]) + b"\0" * 5 + bytes([1]) + b"\0" * 10
+        self.assertEqual(_parse_icmp_reply(ip_header + reply), 7)
+        request = struct.pack("!BBHHH", 8, 0, 0, 0x0042, 7)
+        self.assertIsNone(_parse_icmp_reply(request))
+        self.assertIsNone(_parse_icmp_reply(reply[:6]))
+
+    def test_retain_drops_old_hosts(self):
+        """retain で対象外になったホストのRTTとメトリクスを捨てるか"""
+        self.prober.probe_many(["127.0.0.1"])
+        self.prober.rtt["10.9.9.9"] = 0.1
+        self.prober.retain(["10.9.9.9"])
+        self.assertEqual(self.prober.rtt, {"10.9.9.9": 0.1})
+        self.assertIsNone(metrics.PROBE_HOST_RTT.value(host="127.0.0.1"))
+
+    def test_resolve_status_backend(self):
+        """resolve_status の生存確認バックエンドとして差し替えられるか"""
+        with tempfile.TemporaryDirectory() as d:
+            proc_file = Path(d) / "arp"
+            proc_file.write_text(PROC_ARP_SAMPLE.splitlines()[0] + "\n", encoding="utf-8")
+            arp = ArpTable(proc_path=proc_file)
+            arp.refresh()
+        self.assertEqual(resolve_status("00:00:00:00:00:01", "127.0.0.1", arp=arp, prober=self.prober),
+                         ("稼働中", "127.0.0.1"))
+        self.assertEqual(resolve_status("00:00:00:00:00:01", None, arp=arp, prober=self.prober),
+                         ("不明", None))
+
+    def test_sweep_with_prober(self):
+        """スイープがプローバ経由でまとめて判定されるか"""
+        vms = [VM("Local", "127.0.0.1", "00:00:00:00:00:f1", "SSH", "root"),
+               VM("Dead", "255.255.255.255", "00:00:00:00:00:f2", "SSH", "root"),
+               VM("NoIP", "", "00:00:00:00:00:f3", "SSH", "root")]
+        results = {vm.vm_name: status for vm, status, _ in sweep_status(vms, prober=self.prober)}
+        self.assertEqual(results, {"Local": "稼働中", "Dead": "停止中", "NoIP": "不明"})
+
+class FakeConn:
+    def __init__(self):
+        self.closed = False
+        self.alive = True
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.created = []
+
+    def factory(self):
+        conn = FakeConn()
+        self.created.append(conn)
+        return conn
+
+    def lease(self, pool, key=("SSH", "h1", "root", 22)):
+        return pool.connection(key, self.factory,
+                               is_alive=lambda c: c.alive,
+                               close=lambda c: setattr(c, "closed", True))
+
+    def test_reuse_same_key(self):
+        """同じキーでは接続が再利用されるか"""
+        pool = ConnectionPool()
+        with self.lease(pool) as c1:
+            pass
+        with self.lease(pool) as c2:
+            pass
+        self.assertIs(c1, c2)
+        self.assertEqual(len(self.created), 1)
+
+    def test_broken_and_failed_are_evicted(self):
+        """切断済み・例外発生の接続は破棄されるか"""
+        pool = ConnectionPool()
+        with self.lease(pool) as c1:
+            pass
+        c1.alive = False
+        with self.lease(pool) as c2:
+            pass
+        self.assertIsNot(c1, c2)
+        self.assertTrue(c1.closed)
+
+        with self.assertRaises(RuntimeError):
+            with self.lease(pool) as c3:
+                raise RuntimeError("exec failed")
+        self.assertTrue(c3.closed)
+        self.assertEqual(len(pool), 0)
+
+    def test_max_size_and_idle(self):
+        """上限超過・アイドル時間切れで閉じられるか"""
+        pool = ConnectionPool(max_size=2, idle_timeout=60)
+        conns = []
+        for i in range(3):
+            with self.lease(pool, ("SSH", f"h{i}", "root", 22)) as c:
+                conns.append(c)
+        self.assertEqual(len(pool), 2)
+        self.assertTrue(conns[0].closed)
+
+        pool.idle_timeout = 0
+        self.assertEqual(pool.prune(), 2)
+        self.assertEqual(len(pool), 0)
+
+class TestStatusHub(unittest.TestCase):
+    def test_deltas_only_on_change(self):
+        """状態が変わった時だけ差分が配信されるか"""
+        hub = StatusHub()
+        sub = hub.subscribe()
+        self.assertTrue(hub.update("aa", "稼働中", "10.0.0.1"))
+        self.assertFalse(hub.update("aa", "稼働中", "10.0.0.1"))
+        self.assertTrue(hub.update("aa", "停止中", "10.0.0.1"))
+
+        events = [sub.get_nowait(), sub.get_nowait()]
+        self.assertTrue(sub.empty())
+        self.assertEqual([e["status"] for e in events], ["稼働中", "停止中"])
+        self.assertEqual(hub.version, 2)
+        version, state = hub.snapshot()
+        self.assertEqual(state["aa"]["status"], "停止中")
+
+    def test_overflow_resync(self):
+        """購読キューがあふれたら再同期を要求するか"""
+        hub = StatusHub()
+        sub = hub.subscribe(maxsize=2)
+        for i in range(5):
+            hub.update("aa", f"s{i}", None)
+        self.assertIs(sub.get_nowait(), RESYNC)
+        hub.unsubscribe(sub)
+        hub.update("aa", "x", None)
+        self.assertTrue(sub.empty())
+
+class TestStatusHistory(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.path = Path(self.test_dir) / "history.bin"
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_ring_buffer_bounded(self):
+        """容量を超えると古いサンプルから上書きされ、ファイルサイズは変わらないか"""
+        h = StatusHistory(self.path, slots=4, capacity=8)
+        size = self.path.stat().st_size
+        for i in range(20):
+            h.record("AA:BB:CC:00:00:01", "稼働中", 0.001, ts=1000 + i)
+        rows = h.samples("aa:bb:cc:00:00:01")
+        self.assertEqual([r[0] for r in rows], list(range(1012, 1020)))
+        self.assertEqual(self.path.stat().st_size, size)
+        h.close()
+
+    def test_persist_and_query(self):
+        """再オープン後も残り、間引きと稼働率が計算されるか"""
+        h = StatusHistory(self.path, slots=4, capacity=64)
+        for i in range(10):
+            h.record("aa", "稼働中" if i < 5 else "停止中", 0.002 if i < 5 else None, ts=1000 + i * 10)
+        h.close()
+
+        h = StatusHistory(self.path)
+        result = h.query("aa", range_sec=100, points=2, now=1100)
+        self.assertEqual(result["samples"], 10)
+        self.assertEqual(result["uptime"], 50.0)
+        self.assertEqual([b["samples"] for b in result["series"]], [5, 5])
+        self.assertEqual(result["series"][0]["rtt_ms"], 2.0)
+        self.assertIsNone(result["series"][1]["rtt_ms"])
+        h.close()
+
+    def test_single_writer(self):
+        """同じファイルは1つしか開けず、後から開いた側はメモリ上だけで記録するか"""
+        a = StatusHistory(self.path, slots=4, capacity=8)
+        with self.assertRaises(HistoryLocked):
+            StatusHistory(self.path)
+        b = open_history(self.path, slots=4, capacity=8)
+        self.assertIsNone(b.path)
+        a.record("aa:00:00:00:00:01", "稼働中", ts=1000)
+        b.record("aa:00:00:00:00:02", "稼働中", ts=1000)
+        a.close()
+        b.close()
+
+        h = StatusHistory(self.path)
+        self.assertEqual(len(h.samples("aa:00:00:00:00:01", 0, 2000)), 1)
+        self.assertEqual(h.samples("aa:00:00:00:00:02", 0, 2000), [])
+        h.close()
+
+class TestMetrics(unittest.TestCase):
+    def test_prometheus_text(self):
+        """カウンタ・ゲージ・ヒストグラムがPrometheus形式で出力されるか"""
+        reg = Registry()
+        c = reg.counter("t_actions_total", "actions", ("action", "result"))
+        g = reg.gauge("t_age_seconds", "age", func=lambda: 1.5)
+        h = reg.histogram("t_latency_seconds", "latency", ("method",), buckets=(0.1, 1.0))
+        c.inc(action="off", result="ok")
+        c.inc(action="off", result="ok")
+        for v in (0.05, 0.5, 5):
+            h.observe(v, method="SSH")
+
+        text = reg.render()
+        self.assertIn("# TYPE t_actions_total counter", text)
+        self.assertIn('t_actions_total{action="off",result="ok"} 2', text)
+        self.assertIn("t_age_seconds 1.5", text)
+        self.assertIn('t_latency_seconds_bucket{method="SSH",le="0.1"} 1', text)
+        self.assertIn('t_latency_seconds_bucket{method="SSH",le="1.0"} 2', text)
+        self.assertIn('t_latency_seconds_bucket{method="SSH",le="+Inf"} 3', text)
+        self.assertIn('t_latency_seconds_count{method="SSH"} 3', text)
+
+    def test_sweep_is_instrumented(self):
+        """スイープの所要時間と結果件数が記録されるか"""
+        before = metrics.SWEEP_SECONDS.count()
+        vms = [VM("VM1", "", "00:00:00:00:00:01", "SSH", "root")]
+        list(sweep_status(vms, resolver=lambda mac, ip: ("停止中", None)))
+        self.assertEqual(metrics.SWEEP_SECONDS.count(), before + 1)
+        self.assertGreaterEqual(metrics.SWEEP_HOSTS.value(status="停止中"), 1)
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestPollScheduler(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sched = PollScheduler(base_interval=10, max_interval=80, fast_interval=2,
+                                   fast_duration=30, jitter=0, max_rate=1000, clock=self.clock)
+
+    def advance(self, sec):
+        self.clock.now += sec
+
+    def test_backoff_for_stable_hosts(self):
+        """状態が変わらないホストは間隔が倍々に延び、変化で戻るか"""
+        self.sched.sync(["aa"])
+        intervals = []
+        for status in ["稼働中"] * 5 + ["停止中"]:
+            self.assertEqual(self.sched.due(), ["aa"])
+            self.sched.report("aa", status)
+            delay = self.sched.next_delay()
+            intervals.append(delay)
+            self.advance(delay)
+        self.assertEqual(intervals, [10, 20, 40, 80, 80, 10])
+
+    def test_boost_after_action(self):
+        """boost 直後は即時・高速ポーリングになるか"""
+        self.sched.sync(["aa", "bb"])
+        self.sched.due()
+        self.sched.report("aa", "稼働中")
+        self.sched.report("bb", "稼働中")
+        self.sched.boost("aa")
+        self.assertEqual(self.sched.due(), ["aa"])
+        self.sched.report("aa", "稼働中")
+        self.assertEqual(self.sched.next_delay(), 2)
+
+        self.advance(31)  # 高速期間が終わると通常間隔に戻る
+        self.assertEqual(sorted(self.sched.due()), ["aa", "bb"])
+        self.sched.report("aa", "稼働中")
+        self.assertNotEqual(self.sched.next_delay(), 2)
+
+    def test_rate_budget(self):
+        """1秒あたりのプローブ数上限を超えないか"""
+        sched = PollScheduler(jitter=0, max_rate=5, clock=self.clock)
+        sched.sync([f"m{i}" for i in range(12)])
+        self.assertEqual(len(sched.due()), 5)
+        self.assertEqual(sched.due(), [])
+        self.advance(1)
+        self.assertEqual(len(sched.due()), 5)
+
+    def test_monitor_drives_sweep(self):
+        """StatusMonitor が期限の来たVMだけを確認してハブに反映するか"""
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.bind(("127.0.0.1", 0))
+        server.listen(4)
+        self.addCleanup(server.close)
+        prober = LivenessProber(timeout=0.5, tcp_ports=(server.getsockname()[1],), use_icmp=False)
+
+        vms = [VM("Local", "127.0.0.1", "00:00:00:00:00:f1", "SSH", "root")]
+        seen = []
+        mon = StatusMonitor(lambda: vms, scheduler=self.sched,
+                            on_result=lambda vm, st, ip: seen.append(st))
+        prober.rtt["10.9.9.9"] = 0.1  # もう監視していないホスト
+        with unittest.mock.patch("core.vm_info.default_prober", prober):
+            self.assertEqual(mon.run_once(), 1)
+            self.assertEqual(mon.run_once(), 0)  # 次回時刻まではスキップ
+        self.assertEqual(seen, ["稼働中"])
+        self.assertEqual(set(prober.rtt), {"127.0.0.1"})
+        self.assertEqual(mon.hub.get("00:00:00:00:00:f1")["status"], "稼働中")
+
+class TestDiscovery(unittest.TestCase):
+    ARP = """IP address       HW type     Flags       HW address            Mask     Device
+192.168.24.50    0x1         0x2         aa:bb:cc:00:00:01     *        eth0
+192.168.24.20    0x1         0x2         aa:bb:cc:00:00:02     *        eth0
+192.168.24.99    0x1         0x2         de:ad:be:ef:00:01     *        eth0
+192.168.24.98    0x1         0x0         00:00:00:00:00:00     *        eth0
+10.9.9.9         0x1         0x2         de:ad:be:ef:00:02     *        eth1
+"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+        proc = Path(self.test_dir) / "arp"
+        proc.write_text(self.ARP, encoding="utf-8")
+        self.arp = ArpTable(proc_path=proc)
+        self.vms = [VM("Moved", "192.168.24.10", "AA:BB:CC:00:00:01", "SSH", "root"),
+                    VM("Same", "192.168.24.20", "aa:bb:cc:00:00:02", "SSH", "root"),
+                    VM("Gone", "192.168.24.30", "aa:bb:cc:00:00:03", "SSH", "root")]
+
+    def test_matches_inventory(self):
+        """ARPの結果をインベントリと突き合わせ、IP変更と未登録のMACを返すか"""
+        probed = []
+        prober = LivenessProber(use_icmp=False)
+
+        def probe_iter(ips):
+            for ip in ips:
+                probed.append(ip)
+                yield ip, 0.001 if ip in ("192.168.24.50", "192.168.24.99") else None
+
+        with unittest.mock.patch.object(prober, "probe_iter", side_effect=probe_iter):
+            res = discover_subnets(["192.168.24.0/24"], self.vms, prober=prober, arp=self.arp)
+        self.assertEqual(res.scanned, 254)
+        self.assertEqual(len(probed), 254)
+        self.assertEqual(res.updated, [{"vm_name": "Moved", "mac": "AA:BB:CC:00:00:01",
+                                        "old_ip": "192.168.24.10", "new_ip": "192.168.24.50"}])
+        self.assertEqual(res.matched, 2)
+        # 別サブネットのエントリ・未解決エントリは候補に含めない
+        self.assertEqual(res.candidates, [{"mac": "de:ad:be:ef:00:01", "ip": "192.168.24.99", "rtt": 0.001}])
+        with self.assertRaises(ValueError):
+            discover_subnets(["10.0.0.0/8"], self.vms, prober=prober, arp=self.arp)
+
+    def test_configured_subnets(self):
+        """インベントリのIPから /24 を決め、環境変数があればそちらを使うか"""
+        with unittest.mock.patch.dict(os.environ, {"HOMEVM_SUBNETS": ""}):
+            self.assertEqual(configured_subnets(self.vms + [VM("NoIP", "", "x", "SSH", "root")]),
+                             ["192.168.24.0/24"])
+        with unittest.mock.patch.dict(os.environ, {"HOMEVM_SUBNETS": "10.0.0.0/24, 10.0.1.0/24"}):
+            self.assertEqual(configured_subnets(self.vms), ["10.0.0.0/24", "10.0.1.0/24"])
+
+    def test_update_ips_single_save(self):
+        """IPの変更をまとめて1回で保存するか"""
+        for name in ("vmlist.json", "vmlist.db"):
+            repo = InventoryRepository(Path(self.test_dir) / name)
+            repo.save(self.vms)
+            with unittest.mock.patch.object(repo.storage, "upsert_many",
+                                            wraps=repo.storage.upsert_many) as upsert_many:
+                changed = repo.update_ips({"Moved": "192.168.24.50", "Same": "192.168.24.20",
+                                           "Gone": "192.168.24.31"})
+            self.assertEqual(upsert_many.call_count, 1)
+            self.assertEqual(sorted(vm.vm_name for vm in changed), ["Gone", "Moved"])
+            other = InventoryRepository(Path(self.test_dir) / name)
+            self.assertEqual([vm.host_ip for vm in other.snapshot().vms],
+                             ["192.168.24.50", "192.168.24.20", "192.168.24.31"])
+            for r in (repo, other):
+                if isinstance(r.storage, SqliteStorage):
+                    r.storage.close()
+
+class TestLogging(unittest.TestCase):
+    def _record(self, msg, level=logging.ERROR):
+        return logging.LogRecord("homevm", level, __file__, 1, msg, None, None)
+
+    def test_dedup_and_rate_limit(self):
+        """同じエラーは期間内に1回だけ出し、次に出す時に抑制件数を付けるか"""
+        clock = FakeClock()
+        f = RateLimitFilter(window=60, rate=1, burst=3, clock=clock)
+        self.assertTrue(f.filter(self._record("ARP取得失敗")))
+        self.assertFalse(any(f.filter(self._record("ARP取得失敗")) for _ in range(5)))
+        self.assertTrue(f.filter(self._record("info", logging.INFO)))  # INFO は対象外
+        clock.now += 61
+        rec = self._record("ARP取得失敗")
+        self.assertTrue(f.filter(rec))
+        self.assertEqual(rec.suppressed, 5)
+        self.assertIn("5 件抑制", rec.getMessage())
+        # 内容が違っても全体の上限（burst=3）を超えた分は捨てる
+        passed = [f.filter(self._record(f"error {i}")) for i in range(5)]
+        self.assertEqual(passed, [True, True, False, False, False])
+
+    def test_json_lines(self):
+        """JSON Lines 形式で1行1レコードになるか"""
+        rec = self._record("Status changed: VM1 -> 稼働中", logging.INFO)
+        line = JsonFormatter().format(rec)
+        self.assertNotIn("\n", line)
+        d = json.loads(line)
+        self.assertEqual((d["level"], d["message"]), ("INFO", "Status changed: VM1 -> 稼働中"))
+
+    def test_change_only(self):
+        """状態が変わった時だけログを出すか"""
+        logger = unittest.mock.Mock()
+        log = ChangeLog(logger)
+        self.assertEqual([log.update("m", st, st) for st in ("稼働中", "稼働中", "停止中", "停止中")],
+                         [True, False, True, False])
+        self.assertEqual(logger.info.call_count, 2)
+
+class TestStatusService(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.vms = [VM("VM1", "10.0.0.1", "00:00:00:00:00:01", "SSH", "root"),
+                    VM("VM2", "10.0.0.2", "00:00:00:00:00:02", "SSH", "root")]
+        self.history = StatusHistory(None, slots=4, capacity=16)
+        self.monitor = StatusMonitor(lambda: self.vms, history=self.history)
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.stop(timeout=2)
+        self.service.close()
+        shutil.rmtree(self.test_dir)
+
+    def _start(self, address):
+        self.service = MonitorService(self.monitor, address)
+        self.service.start()
+
+    def _client(self, results=None):
+        client = MonitorClient(lambda: self.vms, address=self.service.address,
+                               on_result=(lambda vm, st, ip: results.append((vm.vm_name, st, ip)))
+                               if results is not None else None)
+        client.start()
+        self.assertTrue(client.wait_connected(5))
+        self.clients.append(client)
+        return client
+
+    def _wait(self, cond, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not cond() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return cond()
+
+    def test_parse_address(self):
+        """ホスト:ポート は TCP、それ以外は Unix ソケットのパスになるか"""
+        self.service = MonitorService(self.monitor, ("tcp", ("127.0.0.1", 0)))
+        self.assertEqual(parse_address("127.0.0.1:5099"), ("tcp", ("127.0.0.1", 5099)))
+        self.assertEqual(parse_address(":5099"), ("tcp", ("127.0.0.1", 5099)))
+        self.assertEqual(parse_address("/run/homevm.sock"), ("unix", "/run/homevm.sock"))
+
+    def test_snapshot_and_deltas(self):
+        """接続時のスナップショットと、その後の差分が全クライアントの StatusHub に写るか"""
+        self._start(("tcp", ("127.0.0.1", 0)))
+        self.monitor.hub.update(self.vms[0].mac, "稼働中", "10.0.0.1")
+        results = []
+        a, b = self._client(results), self._client()
+        self.assertEqual(a.hub.get(self.vms[0].mac)["status"], "稼働中")
+        self.assertEqual(results, [("VM1", "稼働中", "10.0.0.1")])
+
+        self.monitor.hub.update(self.vms[1].mac, "停止中", "-")
+        for client in (a, b):
+            self.assertTrue(self._wait(lambda: client.hub.version == self.monitor.hub.version))
+            self.assertEqual(client.hub.get(self.vms[1].mac)["status"], "停止中")
+        self.assertEqual(results[-1], ("VM2", "停止中", None))
+        self.assertEqual(self.service.clients, 2)
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "AF_UNIX is not available")
+    def test_commands_over_unix_socket(self):
+        """boost・履歴の問い合わせ・削除がサービス側に届くか"""
+        self._start(("unix", str(Path(self.test_dir) / "monitor.sock")))
+        mac = self.vms[0].mac
+        self.history.record(mac, "稼働中", 0.001)
+        client = self._client()
+        with unittest.mock.patch.object(self.monitor, "boost") as boost:
+            client.boost(mac)
+            self.assertTrue(self._wait(lambda: boost.called))
+        boost.assert_called_once_with(mac)
+        self.assertEqual(client.history.query(mac, 3600, 10)["samples"], 1)
+        client.history.forget(mac)
+        self.assertTrue(self._wait(lambda: not self.history.samples(mac)))
+
+    def test_service_close(self):
+        """サービスが止まったらクライアントは切断状態になり、問い合わせは ConnectionError になるか"""
+        self._start(("tcp", ("127.0.0.1", 0)))
+        client = self._client()
+        self.service.close()
+        self.assertTrue(self._wait(lambda: not client.connected))
+        with self.assertRaises(ConnectionError):
+            client.history.query(self.vms[0].mac)
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,5 +1,7 @@
 import unittest
+import os
 import sys
+import tempfile
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
@@ -7,11 +9,34 @@ from unittest.mock import MagicMock, patch
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from PyQt6.QtWidgets import QApplication
+from PyQt6.QtCore import Qt
 
 # Mock keyring before importing main
 sys.modules["keyring"] = MagicMock()
 
-from main import MainWindow, AddVmDialog
+from main import MainWindow, AddVmDialog, ExecOutputDialog
+from core.vm_data import InventoryRepository
+from core.logger import set_log_dir, shutdown_logging
+
+_log_dir = None
+_env = None
+
+
+def setUpModule():
+    # テスト中のログは一時ディレクトリへ（logs/homevm.log に書かない）
+    global _log_dir, _env
+    _log_dir = tempfile.TemporaryDirectory()
+    set_log_dir(_log_dir.name)
+    # 監視サービスは一時ディレクトリのソケットを探す（data/monitor.sock の実サービスにつながない）
+    _env = patch.dict(os.environ, {"HOMEVM_MONITOR": str(Path(_log_dir.name) / "monitor.sock")})
+    _env.start()
+
+
+def tearDownModule():
+    _env.stop()
+    shutdown_logging()
+    _log_dir.cleanup()
+
 
 class TestUI(unittest.TestCase):
     @classmethod
@@ -22,13 +47,21 @@ class TestUI(unittest.TestCase):
         else:
             cls.app = QApplication.instance()
 
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def empty_repository(self):
+        """空のインベントリ（実データを読まない）"""
+        return InventoryRepository(Path(self.tmp.name) / "vmlist.json")
+
     def test_mainwindow_init(self):
         """メインウィンドウが正常に初期化されるか"""
         # Mocking file I/O to avoid reading real config
-        with patch("main.load_vm_list", return_value=[]):
+        with patch("main.get_repository", side_effect=self.empty_repository):
             window = MainWindow()
             self.assertIsNotNone(window)
-            self.assertEqual(window.table.rowCount(), 0)
+            self.assertEqual(window.model.rowCount(), 0)
             
             # Check if style is loaded (Cyber theme)
             # Note: We can't easily check the actual visual style, but we can check no error occurred
@@ -46,7 +79,7 @@ class TestUI(unittest.TestCase):
         """パスワード取得ロジックのテスト (Mock Keyring)"""
         import keyring
         
-        with patch("main.load_vm_list", return_value=[]):
+        with patch("main.get_repository", side_effect=self.empty_repository):
             window = MainWindow()
             
             # Case 1: Keyring has password
@@ -63,5 +96,129 @@ class TestUI(unittest.TestCase):
                 # Should save to keyring
                 keyring.set_password.assert_called_with("HomeVM-Manager", "192.168.1.101", "newpass")
 
+    def test_persist_saves_changes_only(self):
+        """保存は差分だけを書き込み、読み込みに失敗した時は保存しないか"""
+        from core.vm_data import VM, save_vm_list
+        path = Path(self.tmp.name) / "vmlist.json"
+        save_vm_list([VM("VM1", "10.0.0.1", "00:00:00:00:00:01", "SSH", "root")], path)
+        repo = InventoryRepository(path, check_interval=0)
+        with patch("main.get_repository", return_value=repo):
+            window = MainWindow()
+        window.monitor.stop(timeout=2)
+        InventoryRepository(path).add(VM("Web", "", "00:00:00:00:00:0a", "SSH", "root"))
+        window.vms[0].host_ip = "10.0.0.9"
+        window.persist()
+        self.assertEqual([(v.vm_name, v.host_ip) for v in repo.reload().vms],
+                         [("VM1", "10.0.0.9"), ("Web", "")])
+
+        Path(f"{path}.bak").unlink(missing_ok=True)
+        path.write_text("not json", encoding="utf-8")
+        with patch("main.QMessageBox") as box:
+            window.load_and_refresh()
+            window.persist()
+        box.warning.assert_called_once()
+        self.assertEqual(path.read_text(encoding="utf-8"), "not json")
+
+    def test_actions_run_in_background(self):
+        """電源操作がUIスレッドを止めずに並列実行され、結果がシグナルで届くか"""
+        import time
+        from core.vm_data import VM
+
+        def slow_action(vm, action, password, hypervisor=None):
+            time.sleep(0.3)
+            return True, f"{action} {vm.host_ip}"
+
+        with patch("main.get_repository", side_effect=self.empty_repository):
+            window = MainWindow()
+        window.monitor.stop(timeout=2)
+        window.vms = [VM(f"VM{i}", f"10.0.0.{i}", f"00:00:00:00:00:0{i}", "SSH", "root") for i in (1, 2)]
+        window.refresh_table()
+        results = []
+        window.actions.finished.connect(lambda vm, res: results.append(res))
+
+        with patch("main.power_action_vm", side_effect=slow_action):
+            start = time.monotonic()
+            for vm in window.vms:
+                self.assertTrue(window.actions.submit(vm, "off", "pw"))
+            self.assertLess(time.monotonic() - start, 0.2)
+            # 実行中の行は進捗表示になり、同じVMへの重複操作は受け付けない
+            self.assertIn("実行中", window.model.index(0, 6).data())
+            self.assertFalse(window.actions.submit(window.vms[0], "reboot", "pw"))
+            self.assertTrue(window.actions.wait(5000))
+            deadline = time.monotonic() + 5
+            while len(results) < 2 and time.monotonic() < deadline:
+                QApplication.processEvents()
+        self.assertLess(time.monotonic() - start, 0.6)
+        self.assertEqual(sorted(r.message for r in results), ["off 10.0.0.1", "off 10.0.0.2"])
+        self.assertIsNone(window.actions.busy(window.vms[0].mac))
+        self.assertNotIn("実行中", window.model.index(0, 6).data())
+
+    def test_exec_output_streams(self):
+        """コマンド出力がホストごとに [VM名] 付きの行で順次表示されるか"""
+        import time
+        from core.vm_data import VM
+        from core.vm_control import ExecChunk
+
+        def fake_batch(vms, cmd, password_for, cancel=None):
+            yield ExecChunk("RHEL1", "m1", "stdout", "Upda")
+            yield ExecChunk("RHEL2", "m2", "stderr", "warn\n")
+            yield ExecChunk("RHEL1", "m1", "stdout", "ting\nCompl")
+            yield ExecChunk("RHEL1", "m1", "exit", rc=0, elapsed=1.5)
+            yield ExecChunk("RHEL2", "m2", "error", "Password required")
+
+        vms = [VM("RHEL1", "10.0.0.1", "m1", "SSH", "root"), VM("RHEL2", "10.0.0.2", "m2", "SSH", "root")]
+        with patch("main.run_command_batch", side_effect=fake_batch):
+            dlg = ExecOutputDialog(None, vms, "dnf -y update", {})
+            deadline = time.monotonic() + 5
+            while len(dlg.results) < 2 and time.monotonic() < deadline:
+                QApplication.processEvents()
+        self.assertEqual(dlg.output.toPlainText().splitlines(), [
+            "[RHEL2]! warn",
+            "[RHEL1]  Updating",
+            "[RHEL1]  Compl",
+            "[RHEL1] --- exit 0 (1.5s)",
+            "[RHEL2] --- error: Password required",
+        ])
+        self.assertIn("完了 2/2（成功 1）", dlg.summary.text())
+        dlg.close()
+
+    def test_model_incremental_update(self):
+        """ソート後も行とVMの対応が保たれ、変化したセルだけが通知されるか"""
+        from core.vm_data import VM
+
+        with patch("main.get_repository", side_effect=self.empty_repository):
+            window = MainWindow()
+        window.monitor.stop(timeout=2)
+        window.vms = [VM(f"VM{i:04d}", f"10.0.{i // 256}.{i % 256}", f"00:00:00:00:{i // 256:02x}:{i % 256:02x}",
+                         "SSH", "root") for i in range(2000)]
+        window.refresh_table()
+        model = window.model
+        for vm in window.vms:
+            model.post_status(vm, "稼働中", vm.host_ip)
+        model.flush()
+
+        # 降順ソートしても、表示行から引いたVMは同じ名前のもの
+        window.table.sortByColumn(0, Qt.SortOrder.DescendingOrder)
+        top = window.proxy.index(0, 0)
+        self.assertEqual(top.data(), "VM1999")
+        self.assertIs(window._vm_at(top), window.vms[1999])
+
+        signals = []
+        model.dataChanged.connect(lambda tl, br, roles=None: signals.append(
+            (tl.row(), tl.column(), br.row(), br.column())))
+        with patch("main.datetime") as dt:
+            dt.now.return_value.strftime.return_value = "23:59:59"
+            model.post_status(window.vms[10], "停止中", window.vms[10].host_ip)
+            model.post_status(window.vms[11], "停止中", window.vms[11].host_ip)
+            model.post_status(window.vms[500], "稼働中", "10.9.9.9")
+            model.flush()
+        self.assertEqual(signals, [(10, 6, 11, 7), (500, 1, 500, 7)])
+        self.assertEqual(model.index(10, 6).data(), "停止中")
+        self.assertEqual(model.index(500, 1).data(), "10.9.9.9")
+
+        # 絞り込み
+        window.filterEdit.setText("VM000")
+        self.assertEqual(window.proxy.rowCount(), 10)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,472 @@
+import unittest
+import sys
+import gzip
+import json
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest.mock
+import urllib.request
+from functools import partial
+from pathlib import Path
+
+# Add project root and web/ to path
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "web"))
+
+from core.vm_data import VM, InventoryRepository, load_vm_list, save_vm_list
+from core.vm_info import ArpTable, LivenessProber, discover_subnets
+from core.monitor import CLOSED
+from core.vm_control import ConnectionPool, build_magic_packet, run_command_batch, wake_on_lan
+import app as web_app
+from tests.ssh_stub import SshStubServer
+from core.logger import set_log_dir, shutdown_logging
+
+_log_dir = None
+
+
+def setUpModule():
+    # テスト中のログは一時ディレクトリへ（logs/homevm.log に書かない）
+    global _log_dir
+    _log_dir = tempfile.TemporaryDirectory()
+    set_log_dir(_log_dir.name)
+
+
+def tearDownModule():
+    shutdown_logging()
+    _log_dir.cleanup()
+
+
+class TestWebApp(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.path = Path(self.test_dir) / "vmlist.json"
+        save_vm_list([VM("VM1", "10.0.0.1", "00:00:00:00:00:01", "SSH", "root"),
+                      VM("VM2", "10.0.0.2", "00:00:00:00:00:02", "WinRM", "admin", "physical")], self.path)
+        self.config = {"INVENTORY_PATH": self.path, "HISTORY_PATH": None, "MONITOR_SERVICE": "off"}
+        self.app = web_app.create_app(self.config)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        web_app.stop_background()
+        shutil.rmtree(self.test_dir)
+
+    def test_create_app_uses_config(self):
+        """create_app() が設定のパスで状態を作り、監視スレッドは起動しないか"""
+        self.assertEqual(web_app.inventory.path, self.path)
+        self.assertIsNone(web_app.status_history.path)
+        self.assertFalse(web_app._background_running)
+        self.assertIsNone(web_app.monitor._thread)
+
+    def test_vms_not_modified(self):
+        """/api/vms が ETag 一致で 304 を返すか"""
+        res = self.client.get("/api/vms")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual({d["vm_name"] for d in res.get_json()}, {"VM1", "VM2"})
+        res2 = self.client.get("/api/vms", headers={"If-None-Match": res.headers["ETag"]})
+        self.assertEqual(res2.status_code, 304)
+
+    def test_vms_gzip(self):
+        """Accept-Encoding: gzip の時だけ圧縮して返すか"""
+        with unittest.mock.patch.object(web_app, "GZIP_MIN_SIZE", 0):
+            web_app._vms_cache = (None, b"", None)
+            res = self.client.get("/api/vms", headers={"Accept-Encoding": "gzip"})
+            self.assertEqual(res.headers["Content-Encoding"], "gzip")
+            self.assertEqual(len(json.loads(gzip.decompress(res.data))), 2)
+            res = self.client.get("/api/vms")
+            self.assertNotIn("Content-Encoding", res.headers)
+            self.assertEqual(len(res.get_json()), 2)
+
+    def test_vms_since(self):
+        """?since= で変化したVMだけを返し、起動・置き換えをまたいだ version には全件を返すか"""
+        version = self.client.get("/api/vms").headers["X-Version"]
+        web_app.status_hub.update("00:00:00:00:00:02", "稼働中", "10.0.0.2")
+        res = self.client.get(f"/api/vms?since={version}").get_json()
+        self.assertFalse(res["full"])
+        self.assertEqual([d["vm_name"] for d in res["vms"]], ["VM2"])
+        self.assertEqual(res["vms"][0]["status"], "稼働中")
+
+        version = res["version"]
+        res2 = self.client.get(f"/api/vms?since={version}")
+        self.assertEqual(res2.get_json()["vms"], [])
+        self.assertEqual(self.client.get(f"/api/vms?since={version}",
+                                         headers={"If-None-Match": res2.headers["ETag"]}).status_code, 304)
+
+        # 別プロセス（再起動前）の version は、数字が同じでも全件
+        epoch, rest = version.split(":", 1)
+        res = self.client.get(f"/api/vms?since=other:{rest}").get_json()
+        self.assertTrue(res["full"])
+        self.assertEqual(len(res["vms"]), 2)
+        # 監視サービスからの置き換えで version が戻っても全件
+        web_app.status_hub.replace(0, {})
+        res = self.client.get(f"/api/vms?since={version}").get_json()
+        self.assertTrue(res["full"])
+        self.assertNotEqual(res["version"].split(":", 1)[0], epoch)
+
+    def test_power_batch(self):
+        """一括電源操作で、MACと名前の重複を1台にまとめ、成功したVMごとにパスワードを保存するか"""
+        body = {"targets": ["00:00:00:00:00:01", "VM1", "VM2", "nope"], "action": "off", "password": "pw"}
+        with unittest.mock.patch("core.vm_control.power_action_unified",
+                                 side_effect=lambda method, host, user, pw, action: (True, f"{action} {host}")) as run, \
+                unittest.mock.patch.object(web_app, "keyring") as kr:
+            res = self.client.post("/api/power/batch", json=body)
+            self.assertEqual(res.status_code, 202)
+            self.assertEqual(res.get_json()["missing"], ["nope"])
+            job = self.wait_job(self.client, res.get_json()["job_id"], "done")
+        self.assertEqual(job["message"], "2/2 off ok")
+        self.assertEqual(sorted(r["vm_name"] for r in job["result"]), ["VM1", "VM2"])
+        self.assertEqual(run.call_count, 2)
+        self.assertEqual(sorted(c.args for c in kr.set_password.call_args_list),
+                         [("HomeVM-Manager", "10.0.0.1", "pw"), ("HomeVM-Manager", "10.0.0.2", "pw")])
+
+    def test_power_batch_not_found(self):
+        """対象が1台も見つからなければ 404 と missing を返すか"""
+        res = self.client.post("/api/power/batch", json={"targets": ["x", "y"], "action": "off"})
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res.get_json()["missing"], ["x", "y"])
+        self.assertEqual(self.client.post("/api/power/batch", json={"targets": []}).status_code, 400)
+
+    def test_events_stream(self):
+        """SSE が最初にスナップショット、以後は差分、再同期・インベントリ変更時はスナップショットを送るか"""
+        res = self.client.get("/api/events", buffered=False)
+        self.assertEqual(res.mimetype, "text/event-stream")
+        chunks = iter(res.response)
+
+        def next_event():
+            event, data = next(chunks).decode("utf-8").strip().split("\n")
+            return event.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+        try:
+            event, data = next_event()
+            self.assertEqual(event, "snapshot")
+            self.assertEqual({d["vm_name"] for d in data}, {"VM1", "VM2"})
+
+            web_app.status_hub.update("00:00:00:00:00:01", "稼働中", "10.0.0.1")
+            event, data = next_event()
+            self.assertEqual(event, "status")
+            self.assertEqual((data["mac"], data["status"]), ("00:00:00:00:00:01", "稼働中"))
+
+            web_app.status_hub.replace(web_app.status_hub.version, {})
+            self.assertEqual(next_event()[0], "snapshot")
+            web_app.inventory.add(VM("VM3", "", "00:00:00:00:00:03", "SSH", "root"))
+            web_app.status_hub.notify_inventory()
+            event, data = next_event()
+            self.assertEqual(event, "snapshot")
+            self.assertIn("VM3", {d["vm_name"] for d in data})
+
+            web_app.status_hub.close()
+            self.assertEqual(list(chunks), [])
+        finally:
+            res.close()
+
+    def test_vm_history(self):
+        """履歴ファイルの内容を間引いて返し、未知のVMは 404、不正な値は 400 を返すか"""
+        client = web_app.create_app({**self.config, "HISTORY_PATH": Path(self.test_dir) / "history.bin"}).test_client()
+        mac = "00:00:00:00:00:01"
+        now = time.time()
+        for i in range(60):  # 1時間分を1分ごとに、前半は停止・後半は稼働
+            web_app.status_history.record(mac, "稼働中" if i >= 30 else "停止中",
+                                          0.002 if i >= 30 else None, ts=now - 3590 + i * 60)
+        res = client.get(f"/api/vms/{mac}/history?range=3600&points=4")
+        self.assertEqual(res.status_code, 200)
+        data = res.get_json()
+        self.assertEqual(data["samples"], 60)
+        self.assertEqual(len(data["series"]), 4)
+        self.assertEqual([b["status"] for b in data["series"]], ["停止中", "停止中", "稼働中", "稼働中"])
+        self.assertEqual(data["series"][-1]["rtt_ms"], 2.0)
+        self.assertAlmostEqual(data["uptime"], 50.0, delta=2)
+
+        self.assertEqual(client.get("/api/vms/ff:ff:ff:ff:ff:ff/history").status_code, 404)
+        self.assertEqual(client.get(f"/api/vms/{mac}/history?range=abc").status_code, 400)
+        self.assertEqual(client.get(f"/api/vms/{mac}/history?points=0").status_code, 400)
+
+    def test_metrics_exposition(self):
+        """/metrics が Prometheus テキスト形式で、ホスト別RTTが計測値どおりに出るか"""
+        server = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(server.close)
+        self.addCleanup(web_app.metrics.PROBE_HOST_RTT.remove, host="127.0.0.1")
+        prober = LivenessProber(timeout=0.5, tcp_ports=(server.getsockname()[1],), use_icmp=False)
+        rtt = prober.probe_many(["127.0.0.1"])["127.0.0.1"]
+        self.assertIsNotNone(rtt)
+
+        res = self.client.get("/metrics")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith("text/plain; version=0.0.4"))
+        lines = res.get_data(as_text=True).splitlines()
+        # 各メトリクスは # HELP → # TYPE → サンプルの順に並ぶ
+        for i, line in enumerate(lines):
+            if line.startswith("# HELP "):
+                name = line.split()[2]
+                self.assertRegex(lines[i + 1], rf"^# TYPE {name} (counter|gauge|histogram)$")
+        self.assertIn("# TYPE homevm_probe_host_rtt_seconds gauge", lines)
+        samples = dict(line.rsplit(" ", 1) for line in lines if not line.startswith("#"))
+        self.assertAlmostEqual(float(samples['homevm_probe_host_rtt_seconds{host="127.0.0.1"}']), rtt)
+        self.assertIn("homevm_probe_rtt_seconds_count", samples)
+
+    def wait_job(self, client, job_id, state):
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            job = client.get(f"/api/jobs/{job_id}").get_json()
+            if job["state"] == state:
+                return job
+            time.sleep(0.01)
+        self.fail(f"job {job_id} did not reach {state}: {job}")
+
+    def test_wol_job(self):
+        """/api/wol がジョブとして受け付けられ、マジックパケットを送って結果を返すか"""
+        rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        rx.bind(("127.0.0.1", 0))
+        rx.settimeout(5)
+        self.addCleanup(rx.close)
+        # 送信先だけローカルの受信ソケットへ向ける
+        local = partial(wake_on_lan, broadcast="127.0.0.1", port=rx.getsockname()[1], directed=False)
+        with unittest.mock.patch.object(web_app, "wake_on_lan", local):
+            res = self.client.post("/api/wol", json={"targets": ["VM2", "ff:ff:ff:ff:ff:ff"], "repeat": 2})
+            self.assertEqual(res.status_code, 202)
+            data = res.get_json()
+            self.assertEqual(res.headers["Location"], f"/api/jobs/{data['job_id']}")
+            self.assertEqual(data["missing"], ["ff:ff:ff:ff:ff:ff"])
+            job = self.wait_job(self.client, data["job_id"], "done")
+        self.assertEqual([(r["vm_name"], r["ok"]) for r in job["result"]], [("VM2", True)])
+        self.assertEqual(job["message"], "1/1 sent")
+        packet = build_magic_packet("00:00:00:00:00:02")
+        self.assertEqual([rx.recv(1024) for _ in range(2)], [packet, packet])
+
+    def test_wol_rejects_bad_targets(self):
+        """MACが不正なVMや不正な targets・パラメータは 400 で、ジョブを作らないか"""
+        self.client.post("/api/vms", json={"vm_name": "BAD", "host_ip": "10.0.0.9", "mac": "not-a-mac",
+                                           "method": "SSH", "user": "root", "type": "physical"})
+        with unittest.mock.patch.object(web_app.jobs, "submit") as submit:
+            res = self.client.post("/api/wol", json={"targets": ["BAD", "VM2"]})
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(res.get_json()["invalid"], ["BAD"])
+            for body in ({"targets": "VM2"}, {"targets": [2]}, {"targets": ["VM2"], "repeat": 0},
+                         {"targets": ["VM2"], "timeout": "soon"}):
+                self.assertEqual(self.client.post("/api/wol", json=body).status_code, 400, body)
+            submit.assert_not_called()
+        self.assertEqual(self.client.post("/api/wol", json={"targets": ["x"]}).status_code, 404)
+
+    def test_add_vm_checks_runs_on(self):
+        """runs_on が存在しないVM・自分自身を指す追加は 400 で保存しないか"""
+        guest = {"vm_name": "G1", "host_ip": "10.0.0.11", "mac": "00:00:00:00:00:11",
+                 "method": "SSH", "user": "root", "type": "virtual"}
+        for runs_on in ("nowhere", "G1"):
+            res = self.client.post("/api/vms", json={**guest, "runs_on": runs_on})
+            self.assertEqual(res.status_code, 400, runs_on)
+            self.assertIn("runs_on", res.get_json()["error"])
+        self.assertIsNone(web_app.inventory.snapshot().find("G1"))
+        self.assertEqual(self.client.post("/api/vms", json={**guest, "runs_on": "VM2"}).status_code, 200)
+        self.assertEqual(web_app.inventory.snapshot().find("G1").runs_on, "VM2")
+
+    def test_orchestrate_order(self):
+        """/api/orchestrate がホストを起こしてからゲストを起動し、計画の順序と結果をジョブで返すか"""
+        self.client.post("/api/vms", json={"vm_name": "G1", "host_ip": "10.0.0.11", "mac": "00:00:00:00:00:11",
+                                           "method": "SSH", "user": "root", "type": "virtual", "runs_on": "VM2"})
+        running = set()
+        calls = []
+
+        def wake(mac):
+            calls.append(("wol", mac))
+            running.add(mac)
+
+        def start_guest(guest, host):
+            calls.append(("on", guest.mac))
+            running.add(guest.mac)
+            return True, "Power on requested"
+
+        def resolver(mac, ip):
+            return ("稼働中" if mac in running else "停止中"), ip
+
+        orchestrator = partial(web_app.PowerOrchestrator, resolver=resolver, wake=wake, poll_interval=0.01)
+        with unittest.mock.patch.object(web_app, "PowerOrchestrator", orchestrator), \
+                unittest.mock.patch.object(web_app.hypervisor, "start_guest", start_guest):
+            res = self.client.post("/api/orchestrate", json={"action": "startup", "targets": ["G1"]})
+            self.assertEqual(res.status_code, 202)
+            self.assertEqual(res.get_json()["job"]["params"]["targets"], ["G1", "VM2"])
+            job = self.wait_job(self.client, res.get_json()["job_id"], "done")
+        self.assertEqual(calls, [("wol", "00:00:00:00:00:02"), ("on", "00:00:00:00:00:11")])
+        steps = {s["vm_name"]: s for s in job["result"]["steps"]}
+        self.assertEqual(steps["G1"]["depends_on"], ["VM2"])
+        self.assertGreaterEqual(steps["G1"]["start"], steps["VM2"]["end"])
+        self.assertEqual(job["result"]["critical_path"], ["VM2", "G1"])
+
+    def test_orchestrate_rejects_bad_dependencies(self):
+        """runs_on が循環したインベントリや不正な action は 400 で、ジョブを作らないか"""
+        save_vm_list([VM("A", "10.0.0.1", "00:00:00:00:00:01", "SSH", "root", runs_on="B"),
+                      VM("B", "10.0.0.2", "00:00:00:00:00:02", "SSH", "root", runs_on="A")], self.path)
+        client = web_app.create_app(self.config).test_client()
+        with unittest.mock.patch.object(web_app.jobs, "submit") as submit:
+            res = client.post("/api/orchestrate", json={"action": "startup"})
+            self.assertEqual(res.status_code, 400)
+            self.assertIn("cycle", res.get_json()["error"])
+            self.assertEqual(client.post("/api/orchestrate", json={"action": "reboot"}).status_code, 400)
+            submit.assert_not_called()
+        self.assertEqual(client.post("/api/orchestrate", json={"action": "startup", "targets": ["x"]}).status_code, 404)
+
+    def test_job_lifecycle(self):
+        """電源操作ジョブが queued → running → done / failed と進み、未知のIDは 404 か"""
+        client = web_app.create_app({**self.config, "JOB_WORKERS": 1}).test_client()
+        release = threading.Event()
+
+        def action(method, host, user, password, action):
+            release.wait(5)
+            return (True, "ok") if host == "10.0.0.1" else (False, "denied")
+
+        with unittest.mock.patch.object(web_app, "power_action_unified", side_effect=action), \
+                unittest.mock.patch.object(web_app, "keyring"):
+            res = client.post("/api/power", json={"mac": "00:00:00:00:00:01", "action": "off", "password": "pw"})
+            self.assertEqual(res.status_code, 202)
+            first = res.get_json()["job_id"]
+            self.assertEqual(res.headers["Location"], f"/api/jobs/{first}")
+            self.wait_job(client, first, "running")
+            second = client.post("/api/power", json={"mac": "00:00:00:00:00:02", "action": "off",
+                                                     "password": "pw"}).get_json()["job_id"]
+            self.assertEqual(client.get(f"/api/jobs/{second}").get_json()["state"], "queued")
+            self.assertEqual(client.get("/api/jobs").get_json()["active"], 2)
+
+            release.set()
+            job = self.wait_job(client, first, "done")
+            self.assertEqual((job["ok"], job["message"], job["params"]["vm_name"]), (True, "ok", "VM1"))
+            job = self.wait_job(client, second, "failed")
+            self.assertEqual((job["ok"], job["message"]), (False, "denied"))
+        self.assertEqual(client.get("/api/jobs?state=failed").get_json()["jobs"][0]["id"], second)
+        self.assertEqual(client.get("/api/jobs/unknown").status_code, 404)
+
+    def test_discover_updates_ips(self):
+        """IP探索が ARP の結果を update_ips で反映し、探索中の他の編集を消さないか"""
+        arp = Path(self.test_dir) / "arp"
+        arp.write_text("IP address  HW type  Flags  HW address         Mask  Device\n"
+                       "10.0.0.50   0x1      0x2    00:00:00:00:00:01  *     eth0\n"
+                       "10.0.0.99   0x1      0x2    de:ad:be:ef:00:01  *     eth0\n", encoding="utf-8")
+        prober = LivenessProber(use_icmp=False, host_metrics=False)
+
+        def probe_iter(ips):
+            # 探索中に Web から追加・別プロセスから編集される
+            self.client.post("/api/vms", json=VM("VM3", "", "00:00:00:00:00:03", "SSH", "root").to_dict())
+            other = InventoryRepository(self.path)
+            other.upsert(VM("VM2", "10.0.0.2", "00:00:00:00:00:02", "WinRM", "edited", "physical"))
+            for ip in ips:
+                yield ip, 0.001 if ip in ("10.0.0.50", "10.0.0.99") else None
+
+        def fake_discover(subnets, vms):
+            return discover_subnets(subnets, vms, prober=prober, arp=ArpTable(proc_path=arp))
+
+        with unittest.mock.patch.object(prober, "probe_iter", side_effect=probe_iter), \
+                unittest.mock.patch.object(web_app, "discover_subnets", side_effect=fake_discover), \
+                unittest.mock.patch.object(web_app.inventory, "update_ips",
+                                           wraps=web_app.inventory.update_ips) as update_ips:
+            res = self.client.post("/api/discover", json={"subnets": ["10.0.0.0/24"]})
+            self.assertEqual(res.status_code, 202)
+            job = self.wait_job(self.client, res.get_json()["job_id"], "done")
+        update_ips.assert_called_once_with({"VM1": "10.0.0.50"})
+        self.assertEqual(job["result"]["updated"][0]["new_ip"], "10.0.0.50")
+        self.assertEqual([c["mac"] for c in job["result"]["candidates"]], ["de:ad:be:ef:00:01"])
+
+        expected = [("VM1", "10.0.0.50", "root"), ("VM2", "10.0.0.2", "edited"), ("VM3", "", "root")]
+        self.assertEqual([(v.vm_name, v.host_ip, v.user) for v in web_app.inventory.snapshot().vms], expected)
+        self.assertEqual([(v.vm_name, v.host_ip, v.user) for v in load_vm_list(self.path)], expected)
+        self.assertEqual(self.client.post("/api/discover", json={"subnets": ["bad"]}).status_code, 400)
+
+    def test_background_started_once(self):
+        """監視は1つだけ起動し、作り直し・停止時には古い方を止めて購読者へ CLOSED が届くか"""
+        with unittest.mock.patch.object(web_app.StatusMonitor, "start") as start, \
+                unittest.mock.patch.object(web_app.StatusMonitor, "stop") as stop:
+            web_app.create_app({**self.config, "START_MONITOR": True})
+            web_app.start_background()
+            self.assertEqual(start.call_count, 1)
+
+            sub = web_app.status_hub.subscribe()
+            web_app.create_app({**self.config, "START_MONITOR": True})
+            self.assertEqual((start.call_count, stop.call_count), (2, 1))
+            self.assertIs(sub.get(timeout=1), CLOSED)
+
+            web_app.stop_background()
+            web_app.stop_background()
+            self.assertEqual(stop.call_count, 2)
+        self.assertFalse(web_app._background_running)
+
+    def test_create_app_tunes_workers(self):
+        """JOB_WORKERS / PROBE_WORKERS が反映されるか"""
+        web_app.create_app({**self.config, "JOB_WORKERS": 3, "PROBE_WORKERS": 7})
+        self.assertEqual(web_app.jobs.max_workers, 3)
+        self.assertEqual(web_app.monitor.max_workers, 7)
+
+    def test_exec_requires_opt_in_and_password(self):
+        """/api/exec は有効化しない限り 403、有効でもパスワードがなければ 401 か"""
+        body = {"targets": ["VM1"], "command": "uptime"}
+        self.assertEqual(self.client.post("/api/exec", json=body).status_code, 403)
+        client = web_app.create_app({**self.config, "EXEC_ENABLED": True}).test_client()
+        with unittest.mock.patch.object(web_app, "_keyring_password", return_value="stored"), \
+                unittest.mock.patch.object(web_app, "run_command_batch") as run:
+            res = client.post("/api/exec", json=body)
+        self.assertEqual(res.status_code, 401)
+        run.assert_not_called()
+
+    def test_exec_streams_output(self):
+        """/api/exec が出力を届いた順に NDJSON で流し、各ホストの最後に終了コードかエラーを返すか"""
+        server = SshStubServer(commands={"dnf -y update": (1, [("stdout", "Updating\n", 0.05),
+                                                               ("stderr", "warning\n", 0.05),
+                                                               ("stdout", "Complete!\n", 0.05)])})
+        self.addCleanup(server.close)
+        pool = ConnectionPool()
+        self.addCleanup(pool.close_all)
+        self.client.post("/api/vms", json={"vm_name": "R1", "host_ip": "127.0.0.1", "mac": "00:00:00:00:00:21",
+                                           "method": "SSH", "user": "root", "type": "virtual"})
+        client = web_app.create_app({**self.config, "EXEC_ENABLED": True}).test_client()
+        body = {"targets": ["R1", "VM2"], "command": "dnf -y update", "password": "secret"}
+        with unittest.mock.patch.object(web_app, "run_command_batch",
+                                        partial(run_command_batch, pool=pool, port=server.port)):
+            res = client.post("/api/exec", json=body, buffered=False)
+            self.assertEqual(res.mimetype, "application/x-ndjson")
+            chunks = [json.loads(line) for line in res.response]
+            res.close()
+        self.assertEqual(server.executed, ["dnf -y update"])
+        r1 = [c for c in chunks if c["vm_name"] == "R1"]
+        self.assertGreater(len(r1), 2)  # 出力は1行ずつ届く
+        self.assertEqual("".join(c["data"] for c in r1 if c["stream"] == "stdout"), "Updating\nComplete!\n")
+        self.assertEqual("".join(c["data"] for c in r1 if c["stream"] == "stderr"), "warning\n")
+        self.assertEqual((r1[-1]["stream"], r1[-1]["rc"]), ("exit", 1))
+        self.assertEqual(sum(c["stream"] == "exit" for c in r1), 1)
+        vm2 = [(c["stream"], c["data"]) for c in chunks if c["vm_name"] == "VM2"]
+        self.assertEqual(vm2, [("error", "SSH only")])
+
+    def test_pooled_server(self):
+        """スレッドプール版サーバーが並行リクエストを処理し、停止できるか"""
+        server = web_app.PooledWSGIServer("127.0.0.1", 0, self.app, threads=2)
+        runner = threading.Thread(target=server.run, daemon=True)
+        runner.start()
+        url = f"http://127.0.0.1:{server.server_port}/api/jobs"
+        results = []
+
+        def fetch():
+            with urllib.request.urlopen(url, timeout=5) as res:
+                results.append(json.loads(res.read())["active"])
+
+        try:
+            clients = [threading.Thread(target=fetch) for _ in range(6)]
+            for t in clients:
+                t.start()
+            for t in clients:
+                t.join(5)
+            self.assertEqual(results, [0] * 6)
+        finally:
+            server.shutdown()
+            server.close()
+        runner.join(5)
+        self.assertFalse(runner.is_alive())
+
+    def test_server_fallback_warns(self):
+        """waitress がなければ警告を出して PooledWSGIServer を使うか"""
+        with unittest.mock.patch.object(web_app, "waitress_server", None), \
+                self.assertLogs("homevm", level="WARNING") as logs:
+            server = web_app.make_server(self.app, "127.0.0.1", 0, threads=1)
+        server.close()
+        self.assertIsInstance(server, web_app.PooledWSGIServer)
+        self.assertIn("waitress is not installed", logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,131 +1,543 @@
 import sys
-from pathlib import Path
+import json
+import gzip
+import argparse
+import ipaddress
+import queue
+import signal
 import threading
-import time
+from pathlib import Path
 import keyring
 
 # Add project root to path to import core modules
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
-from flask import Flask, render_template, jsonify, request
-from core.vm_data import VM, load_vm_list, save_vm_list
-from core.vm_control import power_action_unified, send_magic_packet
-from core.vm_info import resolve_status
+from flask import Blueprint, Flask, Response, current_app, render_template, jsonify, request
+from werkzeug.serving import BaseWSGIServer
+from core.logger import get_logger
+from core.vm_data import VM, get_repository
+from core.vm_control import (power_action_unified, power_action_vm, power_action_batch,
+                             build_magic_packet, wake_on_lan, run_command_batch, HypervisorBackend)
+from core.vm_info import SWEEP_MAX_WORKERS, configured_subnets, discover_subnets
+from core.monitor import StatusHub, StatusMonitor, RESYNC, INVENTORY_CHANGED, CLOSED
+from core.status_service import connect_service, parse_address
+from core.history import HISTORY_FILE, StatusHistory, open_history
+from core.jobs import JOB_MAX_WORKERS, JobQueue, JobQueueFull
+from core.orchestrator import PowerOrchestrator, DependencyError, STARTUP, SHUTDOWN, dependency_graph
+from core import metrics
 
-app = Flask(__name__)
+try:
+    from waitress import create_server as waitress_server
+except ImportError:  # declared dependency; make_server() warns and falls back to werkzeug
+    waitress_server = None
 
-# Cache for status
-status_cache = {}
+logger = get_logger("homevm")
 
-def update_status_loop():
-    """Background thread to update VM status periodically"""
-    while True:
-        vms = load_vm_list()
-        for vm in vms:
-            try:
-                status, new_ip = resolve_status(vm.mac, vm.host_ip)
-                status_cache[vm.mac] = {
-                    "status": status,
-                    "ip": new_ip or vm.host_ip or "-",
-                    "last_updated": time.strftime("%H:%M:%S")
-                }
-            except Exception as e:
-                print(f"Error updating status for {vm.vm_name}: {e}")
-        time.sleep(10)
-
-# Start background thread
-t = threading.Thread(target=update_status_loop, daemon=True)
-t.start()
-
-@app.route('/')
+# Routes live on a blueprint; create_app() mounts it. The module-level state
+# below is built by create_app() (importing this module opens nothing), and a
+# process holds exactly one inventory, status hub, /api/vms cache and monitor.
+bp = Blueprint("homevm", __name__)
+
+inventory = None       # InventoryRepository: parsed once, indexed by MAC/name/IP
+status_hub = None      # StatusHub: latest status per MAC, publishes deltas to SSE subscribers
+hypervisor = None      # HypervisorBackend for guests whose runs_on is an SSH hypervisor
+monitor = None         # StatusMonitor, or MonitorClient mirroring the shared service
+status_history = None  # StatusHistory, or RemoteHistory answered by the service
+jobs = None            # JobQueue: power actions run here, never on request threads
+
+DEFAULT_CONFIG = {
+    "INVENTORY_PATH": None,        # None: data/vmlist.db (seeded from data/vmlist.json)
+    "HISTORY_PATH": HISTORY_FILE,  # None: anonymous memory (nothing written to disk)
+    "MONITOR_SERVICE": "auto",     # "auto" (HOMEVM_MONITOR / default address), "off" or an address
+    "JOB_WORKERS": JOB_MAX_WORKERS,
+    "PROBE_WORKERS": SWEEP_MAX_WORKERS,
+    "START_MONITOR": False,
+    "EXEC_ENABLED": False,         # POST /api/exec runs arbitrary shell commands; opt in explicitly
+}
+
+metrics.REGISTRY.gauge("homevm_status_cache_age_seconds",
+                       "Seconds since the status cache last received a probe result",
+                       func=lambda: status_hub.age() if status_hub else None)
+metrics.REGISTRY.gauge("homevm_jobs_active", "Queued or running power-action jobs",
+                       func=lambda: jobs.active if jobs else None)
+
+SSE_KEEPALIVE = 15  # seconds
+
+@bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/api/vms', methods=['GET'])
-def get_vms():
-    vms = load_vm_list()
+def _vm_payload(vms):
     data = []
     for vm in vms:
         d = vm.to_dict()
         # Merge with live status
-        if vm.mac in status_cache:
-            d.update(status_cache[vm.mac])
+        st = status_hub.get(vm.mac)
+        if st:
+            d.update(st)
         else:
             d.update({"status": "取得中...", "last_updated": "-"})
         data.append(d)
-    return jsonify(data)
+    return data
+
+# /api/vms is version-addressed: "<epoch>:<inventory revision>:<status version>".
+# Both counters restart on every boot (and the status version can move back when
+# the hub is replaced from the monitor service), so the hub's epoch is part of
+# the version and a client holding another epoch always gets a full list.
+# The encoded body is cached per version, so idle polling only compares strings.
+GZIP_MIN_SIZE = 1024  # bytes
+_vms_cache = (None, b"", None)  # (version, json body, gzip body or None)
+
+def _vms_version():
+    epoch, status_ver = status_hub.stamp()
+    return f"{epoch}:{inventory.revision}:{status_ver}"
+
+def _encode(payload):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return body, (gzip.compress(body, compresslevel=5) if len(body) >= GZIP_MIN_SIZE else None)
+
+def _versioned_response(body, gz, etag, version):
+    use_gz = gz is not None and "gzip" in request.headers.get("Accept-Encoding", "")
+    resp = Response(gz if use_gz else body, mimetype="application/json")
+    if use_gz:
+        resp.headers["Content-Encoding"] = "gzip"
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.headers["ETag"] = f'"{etag}"'
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Version"] = version
+    return resp
+
+@bp.route('/api/vms', methods=['GET'])
+def get_vms():
+    """Inventory merged with live status.
 
-@app.route('/api/vms', methods=['POST'])
+    ETag is the version "<epoch>:<inventory revision>:<status version>" and changes only
+    when a VM is added/removed/edited or its status/IP changes (not when
+    last_updated alone moves). If-None-Match with the current ETag returns 304
+    without building anything. Bodies over GZIP_MIN_SIZE are gzipped.
+
+    ?since=<version> returns {"version", "full", "vms"} with only the VMs whose
+    status changed after that version; "full" is true (all VMs) when the
+    inventory changed in between or the version is from another epoch. The current version is also sent as X-Version.
+    """
+    global _vms_cache
+    version = _vms_version()
+    since = request.args.get("since")
+    etag = f"{version}/{since}" if since else version
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"', "X-Version": version})
+
+    if since:
+        epoch, rev, status_ver = (since.split(":") + ["", ""])[:3]
+        snap = inventory.snapshot()
+        full = (epoch != version.split(":", 1)[0] or rev != str(snap.revision)
+                or not status_ver.isdigit())
+        vms = snap.vms
+        if not full:
+            floor = int(status_ver)
+            vms = [vm for vm in vms if (status_hub.get(vm.mac) or {}).get("version", 0) > floor]
+        body, gz = _encode({"version": version, "full": full, "vms": _vm_payload(vms)})
+        return _versioned_response(body, gz, etag, version)
+
+    cached_version, body, gz = _vms_cache
+    if cached_version != version:
+        body, gz = _encode(_vm_payload(inventory.snapshot().vms))
+        _vms_cache = (version, body, gz)
+    return _versioned_response(body, gz, etag, version)
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@bp.route('/api/events')
+def events():
+    """Server-Sent Events: one full snapshot, then per-VM status deltas only."""
+    def stream():
+        sub = status_hub.subscribe()
+        try:
+            yield _sse("snapshot", _vm_payload(inventory.snapshot().vms))
+            while True:
+                try:
+                    ev = sub.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if ev is CLOSED:
+                    return  # server is shutting down
+                if ev is RESYNC or ev is INVENTORY_CHANGED:
+                    yield _sse("snapshot", _vm_payload(inventory.snapshot().vms))
+                else:
+                    yield _sse("status", ev)
+        finally:
+            status_hub.unsubscribe(sub)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@bp.route('/api/vms/<string:mac>/history', methods=['GET'])
+def vm_history(mac):
+    """Downsampled status/RTT history with uptime percentage.
+
+    Query: range=<seconds> (default 86400), points=<buckets> (default 200)
+    """
+    if inventory.snapshot().get(mac) is None:
+        return jsonify({"error": "VM not found"}), 404
+    try:
+        range_sec = float(request.args.get("range", 86400))
+        points = int(request.args.get("points", 200))
+    except ValueError:
+        return jsonify({"error": "range and points must be numbers"}), 400
+    if range_sec <= 0 or points <= 0:
+        return jsonify({"error": "range and points must be positive"}), 400
+    try:
+        return jsonify(status_history.query(mac, range_sec, points))
+    except (ConnectionError, RuntimeError) as e:
+        return jsonify({"error": f"History unavailable: {e}"}), 503
+
+@bp.route('/api/vms', methods=['POST'])
 def add_vm():
     data = request.json
-    vms = load_vm_list()
-    
+    new_vm = VM.from_dict(data)
     # Validation
-    if any(v.vm_name == data.get("vm_name") for v in vms):
+    try:
+        dependency_graph([*inventory.snapshot().vms, new_vm])  # runs_on must name an existing VM
+    except DependencyError as e:
+        return jsonify({"error": str(e)}), 400
+    if not inventory.add(new_vm):
         return jsonify({"error": "Name already exists"}), 400
-        
-    new_vm = VM.from_dict(data)
-    vms.append(new_vm)
-    save_vm_list(vms)
+    status_hub.notify_inventory()
     return jsonify({"success": True})
 
-@app.route('/api/vms/<string:mac>', methods=['DELETE'])
+@bp.route('/api/vms/<string:mac>', methods=['DELETE'])
 def delete_vm(mac):
-    vms = load_vm_list()
-    vms = [v for v in vms if v.mac != mac]
-    save_vm_list(vms)
+    inventory.remove(mac)
+    status_history.forget(mac)
+    status_hub.notify_inventory()
     return jsonify({"success": True})
 
-@app.route('/api/power', methods=['POST'])
+@bp.route('/api/power', methods=['POST'])
 def power_action():
-    data = request.json
+    """Validate, then queue the action; returns 202 with a job ID immediately.
+
+    Progress: GET /api/jobs/<id>. A missing password is still reported
+    synchronously (401) so the client can prompt before anything is queued.
+    """
+    data = request.json or {}
     mac = data.get("mac")
     action = data.get("action")
     password = data.get("password") # Optional, if not in keyring
 
-    vms = load_vm_list()
-    target_vm = next((v for v in vms if v.mac == mac), None)
+    target_vm = inventory.snapshot().get(mac or "")
     
     if not target_vm:
         return jsonify({"error": "VM not found"}), 404
 
+    if hypervisor.manages(target_vm):
+        # Powered through the hypervisor; the guest's own password is optional and
+        # only used as a fallback when the hypervisor cannot be reached
+        guest_pw = password or (_keyring_password(target_vm.host_ip) if target_vm.host_ip else None)
+        return _submit_power(target_vm, action, guest_pw, None)
+
     if action == "wol":
         if target_vm.type != "physical":
              return jsonify({"error": "WOL only for physical machines"}), 400
-        try:
-            send_magic_packet(target_vm.mac)
-            return jsonify({"success": True, "message": "Magic Packet sent"})
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+        return _submit_power(target_vm, action, None, None)
 
     # SSH/WinRM
     if not target_vm.host_ip:
          return jsonify({"error": "IP unknown"}), 400
          
     # Password resolution
-    final_pw = password
+    final_pw = password or _keyring_password(target_vm.host_ip)
     if not final_pw:
+        return jsonify({"error": "Password required", "need_password": True}), 401
+
+    return _submit_power(target_vm, action, final_pw, password)
+
+def _submit_power(vm, action, password, save_password):
+    def run():
         try:
-            final_pw = keyring.get_password("HomeVM-Manager", target_vm.host_ip)
-        except:
-            pass
-    
-    if not final_pw:
+            if action == "wol" or hypervisor.manages(vm):
+                return power_action_vm(vm, action, password, hypervisor)
+            ok, msg = power_action_unified(vm.method, vm.host_ip, vm.user, password, action)
+            # Save password if successful and provided manually
+            if ok and save_password:
+                try:
+                    keyring.set_password("HomeVM-Manager", vm.host_ip, save_password)
+                except Exception:
+                    pass
+            return ok, msg
+        finally:
+            monitor.boost(vm.mac)
+
+    try:
+        job = jobs.submit("power", run, {"mac": vm.mac, "vm_name": vm.vm_name, "action": action})
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    return jsonify({"success": True, "job_id": job.id, "job": job.to_dict()}), 202, \
+        {"Location": f"/api/jobs/{job.id}"}
+
+@bp.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """Recent jobs, newest first. Query: state=queued|running|done|failed, limit=<n>"""
+    try:
+        limit = int(request.args.get("limit", 100))
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+    return jsonify({
+        "active": jobs.active,
+        "jobs": [j.to_dict() for j in jobs.list(request.args.get("state"), limit)],
+    })
+
+@bp.route('/api/jobs/<string:job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+def _keyring_password(host_ip):
+    try:
+        return keyring.get_password("HomeVM-Manager", host_ip)
+    except Exception:
+        return None
+
+@bp.route('/api/power/batch', methods=['POST'])
+def power_batch():
+    """Run one action on many VMs in parallel; runs as a job.
+
+    Body: {"targets": [mac or vm_name, ...], "action": "off", "password": optional}
+    Returns 202 with a job ID whose result holds per-target results with timings.
+    `?stream=1` instead streams the results as NDJSON on this request.
+    """
+    data = request.json or {}
+    action = data.get("action")
+    keys = data.get("targets") or []
+    password = data.get("password")
+    if not action or not isinstance(keys, list) or not keys:
+        return jsonify({"error": "action and targets are required"}), 400
+
+    snap = inventory.snapshot()
+    found = {k: snap.find(k) for k in keys}
+    targets = list({id(v): v for v in found.values() if v}.values())
+    missing = [k for k, v in found.items() if v is None]
+    if not targets:
+        return jsonify({"error": "VM not found", "missing": missing}), 404
+
+    def password_for(vm):
+        return password or _keyring_password(vm.host_ip)
+
+    by_name = {v.vm_name: v for v in targets}
+
+    def run():
+        for res in power_action_batch(targets, action, password_for, hypervisor=hypervisor):
+            monitor.boost(res.mac)
+            if res.ok and password and action != "wol":
+                try:
+                    keyring.set_password("HomeVM-Manager", by_name[res.vm_name].host_ip, password)
+                except Exception:
+                    pass
+            d = res.to_dict()
+            d["need_password"] = res.message == "Password required"
+            yield d
+
+    if request.args.get("stream"):
+        lines = (json.dumps(d, ensure_ascii=False) + "\n" for d in run())
+        return Response(lines, mimetype="application/x-ndjson")
+
+    def run_job():
+        results = list(run())
+        ok_count = sum(r["ok"] for r in results)
+        return ok_count == len(results), f"{ok_count}/{len(results)} {action} ok", results
+
+    try:
+        job = jobs.submit("power_batch", run_job, {"targets": [v.mac for v in targets], "action": action})
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    return jsonify({"success": True, "job_id": job.id, "job": job.to_dict(), "missing": missing}), 202, \
+        {"Location": f"/api/jobs/{job.id}"}
+
+@bp.route('/api/exec', methods=['POST'])
+def exec_batch():
+    """Run one shell command on many SSH hosts in parallel, streaming output.
+
+    Disabled unless the app was created with EXEC_ENABLED (serve --enable-exec).
+    The SSH password must be sent with every request; stored keyring passwords
+    are never used here, so reaching the port alone does not grant a shell.
+
+    Body: {"targets": [mac or vm_name, ...], "command": "dnf -y update", "password": "..."}
+    Response: NDJSON, one line per output chunk as it arrives
+    ({"vm_name", "mac", "stream": stdout|stderr|exit|error, "data", "rc", "elapsed"}).
+    Each host ends with exactly one "exit" or "error" line. Closing the
+    connection cancels the commands still running.
+    """
+    if not current_app.config.get("EXEC_ENABLED"):
+        return jsonify({"error": "Remote command execution is disabled (start with --enable-exec)"}), 403
+    data = request.json or {}
+    command = (data.get("command") or "").strip()
+    keys = data.get("targets") or []
+    password = data.get("password")
+    if not command or not isinstance(keys, list) or not keys:
+        return jsonify({"error": "command and targets are required"}), 400
+    if not password:
         return jsonify({"error": "Password required", "need_password": True}), 401
 
+    snap = inventory.snapshot()
+    found = {k: snap.find(k) for k in keys}
+    targets = list({id(v): v for v in found.values() if v}.values())
+    missing = [k for k, v in found.items() if v is None]
+    if not targets:
+        return jsonify({"error": "VM not found", "missing": missing}), 404
+
+    def lines():
+        for chunk in run_command_batch(targets, command, lambda vm: password):
+            yield json.dumps(chunk.to_dict(), ensure_ascii=False) + "\n"
+
+    return Response(lines(), mimetype="application/x-ndjson",
+                    headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"})
+
+@bp.route('/api/wol', methods=['POST'])
+def wol_batch():
+    """Wake many physical machines with one socket; runs as a job.
+
+    Body: {"targets": [mac or vm_name, ...], "wait": false, "timeout": 180, "repeat": 3}
+    With wait, each result carries time_to_alive once the host answers a probe.
+    """
+    data = request.json or {}
+    keys = data.get("targets") or []
+    if not isinstance(keys, list) or not keys:
+        return jsonify({"error": "targets are required"}), 400
+    if not all(isinstance(k, str) for k in keys):
+        return jsonify({"error": "targets must be MACs or VM names"}), 400
     try:
-        ok, msg = power_action_unified(target_vm.method, target_vm.host_ip, target_vm.user, final_pw, action)
-        if ok:
-            # Save password if successful and provided manually
-            if password:
-                keyring.set_password("HomeVM-Manager", target_vm.host_ip, password)
-            return jsonify({"success": True, "message": msg})
-        else:
-            return jsonify({"error": msg}), 500
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        wait = bool(data.get("wait", False))
+        timeout = float(data.get("timeout", 180))
+        repeat = int(data.get("repeat", 3))
+    except (TypeError, ValueError):
+        return jsonify({"error": "timeout and repeat must be numbers"}), 400
+    if timeout <= 0 or not 1 <= repeat <= 20:
+        return jsonify({"error": "timeout must be positive and repeat 1-20"}), 400
+
+    snap = inventory.snapshot()
+    found = {k: snap.find(k) for k in keys}
+    targets = list({id(v): v for v in found.values() if v}.values())
+    missing = [k for k, v in found.items() if v is None]
+    if not targets:
+        return jsonify({"error": "VM not found", "missing": missing}), 404
+    invalid = []
+    for vm in targets:
+        try:
+            build_magic_packet(vm.mac)
+        except ValueError:
+            invalid.append(vm.vm_name)
+    if invalid:
+        return jsonify({"error": "Invalid MAC", "invalid": invalid}), 400
+
+    def run():
+        results = []
+        for res in wake_on_lan(targets, repeat=repeat, wait=wait, timeout=timeout):
+            monitor.boost(res.mac)
+            results.append(res.to_dict())
+        ok_count = sum(r["ok"] for r in results)
+        summary = f"{ok_count}/{len(results)} " + ("awake" if wait else "sent")
+        return ok_count == len(results), summary, results
+
+    try:
+        job = jobs.submit("wol", run, {"targets": [v.mac for v in targets], "wait": wait})
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    return jsonify({"success": True, "job_id": job.id, "job": job.to_dict(), "missing": missing}), 202, \
+        {"Location": f"/api/jobs/{job.id}"}
+
+@bp.route('/api/discover', methods=['POST'])
+def discover():
+    """Sweep subnets to refresh host_ip from ARP; runs as a job.
+
+    Body: {"subnets": ["192.168.0.0/24", ...] (default: HOMEVM_SUBNETS or the
+           inventory's /24s), "apply": true}
+    Changed IPs are saved in one batch (unless apply is false); the job result
+    lists the updates and unknown MACs as candidates to add.
+    """
+    data = request.json or {}
+    subnets = data.get("subnets") or configured_subnets(inventory.snapshot().vms)
+    apply = bool(data.get("apply", True))
+    if not isinstance(subnets, list) or not subnets:
+        return jsonify({"error": "No subnets configured"}), 400
+    try:
+        subnets = [str(ipaddress.ip_network(s, strict=False)) for s in subnets]
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid subnet: {e}"}), 400
+
+    def run():
+        result = discover_subnets(subnets, inventory.snapshot().vms)
+        if apply and result.updated:
+            changed = inventory.update_ips({u["vm_name"]: u["new_ip"] for u in result.updated})
+            for vm in changed:
+                monitor.boost(vm.mac)
+            status_hub.notify_inventory()
+        summary = (f"{len(result.alive)}/{result.scanned} answered, {len(result.updated)} IP changes, "
+                   f"{len(result.candidates)} candidates")
+        return True, summary, result.to_dict()
+
+    try:
+        job = jobs.submit("discover", run, {"subnets": subnets, "apply": apply})
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    return jsonify({"success": True, "job_id": job.id, "job": job.to_dict()}), 202, \
+        {"Location": f"/api/jobs/{job.id}"}
+
+@bp.route('/api/orchestrate', methods=['POST'])
+def orchestrate():
+    """Bring VMs up or down in runs_on dependency order, as a job.
+
+    Body: {"action": "startup" | "shutdown", "targets": [mac or vm_name, ...] (default: all),
+           "password": optional}
+    Hypervisors are woken before their guests and stopped after them; the job
+    result holds per-VM steps and the critical path.
+    """
+    data = request.json or {}
+    action = data.get("action")
+    if action not in (STARTUP, SHUTDOWN):
+        return jsonify({"error": "action must be startup or shutdown"}), 400
+    keys = data.get("targets")
+    password = data.get("password")
+
+    snap = inventory.snapshot()
+    names = None
+    if keys:
+        found = {k: snap.find(k) for k in keys}
+        missing = [k for k, v in found.items() if v is None]
+        if missing:
+            return jsonify({"error": "VM not found", "missing": missing}), 404
+        names = [v.vm_name for v in found.values()]
+    try:
+        orch = PowerOrchestrator(snap.copy_vms(),
+                                 password_for=lambda vm: password or _keyring_password(vm.host_ip),
+                                 guest_starter=hypervisor.start_guest, guest_stopper=hypervisor.stop_guest)
+        planned = orch.plan(action, names)
+    except DependencyError as e:
+        return jsonify({"error": str(e)}), 400
 
-@app.route('/api/rdp/<string:ip>')
+    def run():
+        plan = orch.run(action, names)
+        for step in plan.steps:
+            monitor.boost(step.mac)
+        summary = (f"{sum(s.ok for s in plan.steps)}/{len(plan.steps)} OK, "
+                   f"critical path {plan.critical_path_time:.1f}s")
+        return plan.ok, summary, plan.to_dict()
+
+    try:
+        job = jobs.submit("orchestrate", run, {"action": action, "targets": sorted(planned)})
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
+    return jsonify({"success": True, "job_id": job.id, "job": job.to_dict()}), 202, \
+        {"Location": f"/api/jobs/{job.id}"}
+
+@bp.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text exposition of sweep, probe, ARP, remote and power metrics."""
+    return metrics.REGISTRY.render(), 200, {"Content-Type": metrics.CONTENT_TYPE}
+
+@bp.route('/api/rdp/<string:ip>')
 def download_rdp(ip):
     """Generate and download .rdp file"""
     rdp_content = f"full address:s:{ip}\nprompt for credentials:i:1\n"
@@ -134,5 +546,170 @@ def download_rdp(ip):
         'Content-Disposition': f'attachment; filename={ip}.rdp'
     }
 
+# ---------- App factory / serving ----------
+SERVE_HOST = "0.0.0.0"
+SERVE_PORT = 5000
+SERVE_THREADS = 32        # request threads; every open SSE stream holds one
+SHUTDOWN_TIMEOUT = 5.0    # seconds to wait for the monitor thread on shutdown
+
+_lifecycle_lock = threading.Lock()
+_background_running = False
+
+def create_app(config=None):
+    """Build the Flask app and this process's state from `config` (see DEFAULT_CONFIG).
+
+    Calling it again replaces the state (the previous monitor is stopped), so
+    tests can point INVENTORY_PATH / HISTORY_PATH at a temporary directory.
+    The monitor is started only with START_MONITOR (serve() sets it).
+    """
+    global inventory, status_hub, hypervisor, monitor, status_history, jobs, _vms_cache
+    cfg = {**DEFAULT_CONFIG, **(config or {})}
+    stop_background()
+    old_jobs = jobs
+    if isinstance(status_history, StatusHistory):
+        status_history.close()  # release the history file lock before reopening it
+
+    inventory = get_repository(cfg["INVENTORY_PATH"])
+    status_hub = StatusHub()
+    _vms_cache = (None, b"", None)
+    # Guests with runs_on pointing at an SSH hypervisor are queried and powered through
+    # the host (one vim-cmd call per host per sweep), using the host's keyring password
+    hypervisor = HypervisorBackend(lambda: inventory.snapshot().vms, lambda vm: _keyring_password(vm.host_ip))
+
+    # Per-VM adaptive polling (backoff for stable hosts, fast polling after actions).
+    # When the shared monitor service (python -m core.status_service) is running, status
+    # is mirrored from it and this process probes nothing; otherwise it runs its own monitor.
+    monitor = None
+    service = cfg["MONITOR_SERVICE"]
+    if service != "off":
+        address = None if service == "auto" else parse_address(service)
+        monitor = connect_service(lambda: inventory.snapshot().vms, status_hub, address=address)
+    if monitor is None:
+        # Per-VM status/RTT ring buffers, memory-mapped to HISTORY_PATH. Only one process
+        # may write that file; if the service already holds it, history stays in memory.
+        monitor = StatusMonitor(lambda: inventory.snapshot().vms, status_hub,
+                                history=open_history(cfg["HISTORY_PATH"]),
+                                guest_status=hypervisor.guest_states, max_workers=cfg["PROBE_WORKERS"])
+    status_history = monitor.history
+
+    jobs = JobQueue(max_workers=cfg["JOB_WORKERS"])
+    if old_jobs is not None:
+        old_jobs.shutdown(wait=False)  # jobs already running finish on the old pool
+
+    flask_app = Flask(__name__)
+    flask_app.config.update(cfg)
+    flask_app.register_blueprint(bp)
+    if cfg["START_MONITOR"]:
+        start_background()
+    return flask_app
+
+def start_background():
+    """Start the status monitor; later calls in the same process do nothing."""
+    global _background_running
+    with _lifecycle_lock:
+        if _background_running:
+            return
+        monitor.start()
+        _background_running = True
+
+def stop_background(timeout=SHUTDOWN_TIMEOUT):
+    """Stop the monitor, end SSE streams and flush the status history."""
+    global _background_running
+    with _lifecycle_lock:
+        if not _background_running:
+            return
+        _background_running = False
+    monitor.stop(timeout)
+    status_hub.close()
+    status_history.flush()
+
+class PooledWSGIServer(BaseWSGIServer):
+    """werkzeug's WSGI server with a fixed pool of daemon request threads.
+
+    Fallback for environments where waitress is missing. Requests beyond
+    `threads` wait in the accept queue instead of spawning a thread each.
+    """
+    multithread = True
+
+    def __init__(self, host, port, app, threads=SERVE_THREADS):
+        super().__init__(host, port, app)
+        self.threads = threads
+        self._requests = queue.Queue()
+        for i in range(threads):
+            threading.Thread(target=self._worker, name=f"http-{i}", daemon=True).start()
+
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+
+    def _worker(self):
+        while True:
+            request, client_address = self._requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def run(self):
+        self.serve_forever()
+
+    def close(self):
+        self.server_close()
+
+def make_server(flask_app, host=SERVE_HOST, port=SERVE_PORT, threads=SERVE_THREADS):
+    """A server object with run()/close(): waitress, or PooledWSGIServer if it is missing."""
+    if waitress_server is not None:
+        return waitress_server(flask_app, host=host, port=port, threads=threads)
+    logger.warning("waitress is not installed (it is a dependency of this project; run `uv sync`). "
+                   "Falling back to werkzeug's development server with a fixed thread pool, "
+                   "which is not meant for production use.")
+    return PooledWSGIServer(host, port, flask_app, threads)
+
+def _exit_on_signal(signum, frame):
+    raise SystemExit(0)
+
+def serve(host=SERVE_HOST, port=SERVE_PORT, threads=SERVE_THREADS, config=None):
+    """Run the web UI on a threaded server with exactly one status monitor.
+
+    Single process, no reloader: one monitor probes the fleet and one status
+    cache serves every request thread. SIGINT/SIGTERM close the listener,
+    end SSE streams, stop the monitor and flush history before returning.
+    """
+    flask_app = create_app({**(config or {}), "START_MONITOR": True})
+    server = make_server(flask_app, host, port, threads)
+    in_main = threading.current_thread() is threading.main_thread()
+    previous = signal.signal(signal.SIGTERM, _exit_on_signal) if in_main else None
+    source = f"{monitor.max_workers} probe workers" if isinstance(monitor, StatusMonitor) else "monitor service"
+    logger.info(f"Serving on http://{host}:{port} ({type(server).__name__}, {threads} threads, "
+                f"{jobs.max_workers} job workers, status from {source})")
+    try:
+        server.run()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.close()
+        stop_background()
+        jobs.shutdown(wait=False)
+        if in_main:
+            signal.signal(signal.SIGTERM, previous)
+        logger.info("Web server stopped")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="HomeVM Manager web UI")
+    ap.add_argument("--host", default=SERVE_HOST)
+    ap.add_argument("--port", type=int, default=SERVE_PORT)
+    ap.add_argument("--threads", type=int, default=SERVE_THREADS,
+                    help="request threads (each open browser tab holds one for SSE)")
+    ap.add_argument("--job-workers", type=int, default=JOB_MAX_WORKERS, help="parallel power-action jobs")
+    ap.add_argument("--probe-workers", type=int, default=SWEEP_MAX_WORKERS,
+                    help="hosts probed in parallel per sweep")
+    ap.add_argument("--enable-exec", action="store_true",
+                    help="enable POST /api/exec (arbitrary shell commands; password required per request)")
+    args = ap.parse_args(argv)
+    serve(args.host, args.port, args.threads,
+          {"JOB_WORKERS": args.job_workers, "PROBE_WORKERS": args.probe_workers,
+           "EXEC_ENABLED": args.enable_exec})
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    main()
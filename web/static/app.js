@@ -3,6 +3,7 @@ const API_BASE = '/api';
 // State
 let vms = [];
 let pendingAction = null;
+const selected = new Set(); // MACs checked for bulk WOL
 
 // DOM Elements
 const vmGrid = document.getElementById('vm-grid');
@@ -12,68 +13,269 @@ const addForm = document.getElementById('add-form');
 
 // Init
 document.addEventListener('DOMContentLoaded', () => {
-    fetchVMs();
-    setInterval(fetchVMs, 5000); // Poll every 5s
+    subscribeEvents();
     updateClock();
     setInterval(updateClock, 1000);
 });
 
+// Live updates: snapshot once, then per-VM status deltas (SSE)
+function subscribeEvents() {
+    if (!window.EventSource) {
+        fetchVMs();
+        setInterval(fetchVMs, 5000); // Fallback: poll every 5s
+        return;
+    }
+    const es = new EventSource(`${API_BASE}/events`);
+    es.addEventListener('snapshot', (e) => {
+        vms = JSON.parse(e.data);
+        render();
+    });
+    es.addEventListener('status', (e) => {
+        const delta = JSON.parse(e.data);
+        const vm = vmByMac.get(delta.mac);
+        if (!vm) return;
+        vm.status = delta.status;
+        vm.ip = delta.ip;
+        vm.last_updated = delta.last_updated;
+        vm.version = delta.version;
+        patchVM(vm);
+    });
+    // EventSource reconnects by itself; the server resends a snapshot on reconnect
+}
+
 function updateClock() {
     const now = new Date();
     document.getElementById('clock').innerText = now.toLocaleTimeString();
 }
 
-// Fetch Data
+// Fetch Data (polling fallback): full list once, then only what changed since our version
+let vmsVersion = null;
+
 async function fetchVMs() {
     try {
-        const res = await fetch(`${API_BASE}/vms`);
-        vms = await res.json();
-        render();
+        if (vmsVersion === null) {
+            const res = await fetch(`${API_BASE}/vms`);
+            vms = await res.json();
+            vmsVersion = res.headers.get('X-Version');
+            render();
+            return;
+        }
+        const res = await fetch(`${API_BASE}/vms?since=${encodeURIComponent(vmsVersion)}`);
+        if (res.status === 304) return;
+        const delta = await res.json();
+        vmsVersion = delta.version;
+        if (delta.full) {
+            vms = delta.vms;
+            render();
+            return;
+        }
+        delta.vms.forEach(changed => {
+            const vm = vmByMac.get(changed.mac);
+            if (!vm) return;
+            Object.assign(vm, changed);
+            patchVM(vm);
+        });
     } catch (e) {
         console.error("Failed to fetch VMs", e);
     }
 }
 
-// Render
-function render() {
-    vmGrid.innerHTML = '';
-    let running = 0;
-    let stopped = 0;
+// Render: one card per MAC, created once and patched field by field.
+// Cards outside the viewport are not touched until they scroll into view,
+// so the cost of an update follows the number of changes, not the inventory.
+const cards = new Map();   // mac -> { el, fields, shown: {field: value}, visible, dirty }
+const vmByMac = new Map(); // mac -> vm (the objects in `vms`)
+const counts = { total: 0, running: 0 };
+const counterEls = {};
+
+const visibility = 'IntersectionObserver' in window ? new IntersectionObserver(entries => {
+    entries.forEach(entry => {
+        const card = cards.get(entry.target.dataset.mac);
+        if (!card) return;
+        card.visible = entry.isIntersecting;
+        if (card.visible && card.dirty) patchCard(card, vmByMac.get(card.mac));
+    });
+}, { rootMargin: '400px 0px' }) : null;
 
+// Full sync after a snapshot or an inventory change: add/remove/reorder cards only
+function render() {
+    const seen = new Set();
+    vmByMac.clear();
+    counts.running = 0;
+    let prev = null;
     vms.forEach(vm => {
-        const isRunning = vm.status === '稼働中';
-        if (isRunning) running++; else stopped++;
-
-        const card = document.createElement('div');
-        card.className = 'vm-card glass';
-        card.innerHTML = `
-            <div class="vm-header">
-                <div class="vm-name">${vm.vm_name}</div>
-                <div class="vm-status-dot ${isRunning ? 'running' : 'stopped'}"></div>
-            </div>
-            <div class="vm-details">
-                <p><span>IP:</span> <span>${vm.host_ip || '-'}</span></p>
-                <p><span>MAC:</span> <span>${vm.mac}</span></p>
-                <p><span>User:</span> <span>${vm.user}</span></p>
-                <p><span>Method:</span> <span>${vm.method}</span></p>
-                <p><span>Status:</span> <span>${vm.status}</span></p>
-            </div>
-            <div class="vm-actions">
-                <button class="btn btn-connect" onclick="connectVM('${vm.method}', '${vm.user}', '${vm.host_ip}')"><i class="fa-solid fa-plug"></i> Connect</button>
-                ${vm.type === 'physical' ?
-                `<button class="btn btn-power" onclick="confirmPower('${vm.mac}', 'wol')"><i class="fa-solid fa-bolt"></i> WOL</button>` : ''
-            }
-                <button class="btn btn-power" onclick="confirmPower('${vm.mac}', 'off')"><i class="fa-solid fa-power-off"></i> OFF</button>
-                <button class="btn btn-reboot" onclick="confirmPower('${vm.mac}', 'reboot')"><i class="fa-solid fa-rotate-right"></i> Reboot</button>
-                <button class="btn btn-delete" onclick="deleteVM('${vm.mac}')"><i class="fa-solid fa-trash"></i></button>
-            </div>
-        `;
-        vmGrid.appendChild(card);
+        seen.add(vm.mac);
+        vmByMac.set(vm.mac, vm);
+        let card = cards.get(vm.mac);
+        if (!card || card.physical !== (vm.type === 'physical')) {
+            if (card) removeCard(card);
+            card = createCard(vm);
+            cards.set(vm.mac, card);
+            patchCard(card, vm); // New cards are filled once so they never show up blank
+        }
+        card.running = vm.status === '稼働中';
+        if (card.running) counts.running++;
+        // Move only cards that are out of order
+        const next = prev ? prev.nextSibling : vmGrid.firstChild;
+        if (next !== card.el) vmGrid.insertBefore(card.el, next);
+        prev = card.el;
+        markDirty(card, vm);
     });
+    cards.forEach(card => { if (!seen.has(card.mac)) removeCard(card); });
+    counts.total = vms.length;
+    updateCounters();
+    updateSelection();
+}
+
+// A single VM changed (status delta): patch its card and the counters
+function patchVM(vm) {
+    const card = cards.get(vm.mac);
+    if (!card) return;
+    const running = vm.status === '稼働中';
+    if (running !== card.running) {
+        counts.running += running ? 1 : -1;
+        card.running = running;
+        updateCounters();
+    }
+    markDirty(card, vm);
+}
+
+function markDirty(card, vm) {
+    card.dirty = true;
+    if (card.visible || !visibility) patchCard(card, vm);
+}
+
+function createCard(vm) {
+    const physical = vm.type === 'physical';
+    const el = document.createElement('div');
+    el.className = 'vm-card glass';
+    el.dataset.mac = vm.mac;
+    el.innerHTML = `
+        <div class="vm-header">
+            <div class="vm-name">${physical ? '<input type="checkbox" class="vm-select" data-action="select">' : ''}<span data-field="vm_name"></span></div>
+            <div class="vm-status-dot"></div>
+        </div>
+        <div class="vm-details">
+            <p><span>IP:</span> <span data-field="host_ip"></span></p>
+            <p><span>MAC:</span> <span data-field="mac"></span></p>
+            <p><span>User:</span> <span data-field="user"></span></p>
+            <p><span>Method:</span> <span data-field="method"></span></p>
+            <p><span>Status:</span> <span data-field="status"></span></p>
+        </div>
+        <div class="vm-actions">
+            <button class="btn btn-connect" data-action="connect"><i class="fa-solid fa-plug"></i> Connect</button>
+            ${physical ? '<button class="btn btn-power" data-action="wol"><i class="fa-solid fa-bolt"></i> WOL</button>' : ''}
+            <button class="btn btn-power" data-action="off"><i class="fa-solid fa-power-off"></i> OFF</button>
+            <button class="btn btn-reboot" data-action="reboot"><i class="fa-solid fa-rotate-right"></i> Reboot</button>
+            <button class="btn btn-delete" data-action="delete"><i class="fa-solid fa-trash"></i></button>
+        </div>
+    `;
+    const fields = {};
+    el.querySelectorAll('[data-field]').forEach(f => { fields[f.dataset.field] = f; });
+    const card = {
+        mac: vm.mac, el, fields, physical, shown: {}, visible: false, dirty: true, running: false,
+        dot: el.querySelector('.vm-status-dot'),
+        checkbox: el.querySelector('.vm-select'),
+    };
+    if (visibility) visibility.observe(el);
+    return card;
+}
+
+function removeCard(card) {
+    if (visibility) visibility.unobserve(card.el);
+    card.el.remove();
+    cards.delete(card.mac);
+}
+
+// Write only the fields whose value differs from what the card shows
+function patchCard(card, vm) {
+    if (!vm) return;
+    card.dirty = false;
+    const values = {
+        vm_name: vm.vm_name, host_ip: vm.host_ip || '-', mac: vm.mac,
+        user: vm.user, method: vm.method, status: vm.status,
+    };
+    for (const key in values) {
+        if (card.shown[key] !== values[key]) {
+            card.fields[key].textContent = values[key];
+            card.shown[key] = values[key];
+        }
+    }
+    const dot = vm.status === '稼働中' ? 'running' : 'stopped';
+    if (card.shown.dot !== dot) {
+        card.dot.className = `vm-status-dot ${dot}`;
+        card.shown.dot = dot;
+    }
+    if (card.checkbox) card.checkbox.checked = selected.has(vm.mac);
+}
+
+function updateCounters() {
+    const values = { 'total-vms': counts.total, 'running-vms': counts.running,
+                     'stopped-vms': counts.total - counts.running };
+    for (const id in values) {
+        const el = counterEls[id] || (counterEls[id] = document.getElementById(id));
+        if (el.textContent !== String(values[id])) el.textContent = values[id];
+    }
+}
+
+// One delegated listener instead of inline handlers on every card
+vmGrid.addEventListener('click', (e) => {
+    const target = e.target.closest('[data-action]');
+    if (!target || target.dataset.action === 'select') return;
+    const vm = vmByMac.get(target.closest('.vm-card').dataset.mac);
+    if (!vm) return;
+    const action = target.dataset.action;
+    if (action === 'connect') connectVM(vm.method, vm.user, vm.host_ip);
+    else if (action === 'delete') deleteVM(vm.mac);
+    else confirmPower(vm.mac, action);
+});
 
-    document.getElementById('total-vms').innerText = vms.length;
-    document.getElementById('running-vms').innerText = running;
-    document.getElementById('stopped-vms').innerText = stopped;
+vmGrid.addEventListener('change', (e) => {
+    if (e.target.dataset.action !== 'select') return;
+    toggleSelect(e.target.closest('.vm-card').dataset.mac, e.target.checked);
+});
+
+// Bulk WOL selection (physical machines only)
+function toggleSelect(mac, checked) {
+    if (checked) selected.add(mac); else selected.delete(mac);
+    updateSelection();
+}
+
+function clearSelection() {
+    selected.clear();
+    cards.forEach(card => { if (card.checkbox) card.checkbox.checked = false; });
+    updateSelection();
+}
+
+function updateSelection() {
+    // Drop selections for VMs that no longer exist
+    selected.forEach(mac => { if (!vmByMac.has(mac)) selected.delete(mac); });
+    document.getElementById('selected-count').innerText = selected.size;
+    document.getElementById('bulk-actions').hidden = selected.size === 0;
+}
+
+async function wakeSelected() {
+    if (!selected.size) return;
+    const targets = [...selected];
+    try {
+        const res = await fetch(`${API_BASE}/wol`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ targets, wait: true })
+        });
+        const data = await res.json();
+        if (!res.ok) {
+            alert(`Error: ${data.error}`);
+            return;
+        }
+        clearSelection();
+        const job = await waitForJob(data.job_id);
+        const lines = (job.result || []).map(r =>
+            `${r.ok ? 'OK' : 'NG'} ${r.vm_name}: ${r.message}`);
+        alert(`WOL ${job.message}\n\n${lines.join('\n')}`);
+    } catch (e) {
+        alert(`Network Error: ${e}`);
+    }
 }
 
 function connectVM(method, user, ip) {
@@ -153,7 +355,7 @@ async function executePower(password) {
 
         if (res.status === 401) {
             // Need password
-            const vm = vms.find(v => v.mac === pendingAction.mac);
+            const vm = vmByMac.get(pendingAction.mac);
             document.getElementById('pw-target-name').innerText = `Enter password for ${vm.vm_name} (${vm.host_ip})`;
             pwModal.classList.add('open');
             document.getElementById('pw-input').focus();
@@ -161,17 +363,65 @@ async function executePower(password) {
         }
 
         const data = await res.json();
-        if (res.ok) {
-            alert(`Success: ${data.message}`);
-            closePwModal();
+        if (!res.ok) {
+            alert(`Error: ${data.error}`);
+            return;
+        }
+        closePwModal();
+        // The action runs server-side as a job; report when it finishes
+        const job = await waitForJob(data.job_id);
+        if (job.ok) {
+            alert(`Success: ${job.message}`);
         } else {
+            alert(`Error: ${job.message}`);
+        }
+    } catch (e) {
+        alert(`Network Error: ${e}`);
+    }
+}
+
+// Dependency-ordered startup/shutdown of the whole inventory
+async function orchestrate(action) {
+    const verb = action === 'startup' ? 'start' : 'shut down';
+    if (!confirm(`Really ${verb} all VMs (hypervisors ${action === 'startup' ? 'first' : 'last'})?`)) return;
+    try {
+        const res = await fetch(`${API_BASE}/orchestrate`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ action })
+        });
+        const data = await res.json();
+        if (!res.ok) {
             alert(`Error: ${data.error}`);
+            return;
         }
+        const job = await waitForJob(data.job_id);
+        const plan = job.result;
+        if (!plan) {
+            alert(`Error: ${job.message}`);
+            return;
+        }
+        const lines = plan.steps.map(s =>
+            `${s.ok ? 'OK' : 'NG'} ${s.vm_name} (${s.start.toFixed(1)}s → ${s.end.toFixed(1)}s): ${s.message}`);
+        alert(`${action}: ${job.message}\nCritical path: ${plan.critical_path.join(' → ')}\n\n${lines.join('\n')}`);
     } catch (e) {
         alert(`Network Error: ${e}`);
     }
 }
 
+// Poll a queued job until it is done (0.5s, backing off to 2s)
+async function waitForJob(jobId) {
+    let delay = 500;
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, delay));
+        const res = await fetch(`${API_BASE}/jobs/${jobId}`);
+        if (!res.ok) throw new Error(`job ${jobId}: HTTP ${res.status}`);
+        const job = await res.json();
+        if (job.state === 'done' || job.state === 'failed') return job;
+        delay = Math.min(delay * 1.5, 2000);
+    }
+}
+
 function closePwModal() {
     pwModal.classList.remove('open');
     document.getElementById('pw-input').value = '';